@@ -0,0 +1,175 @@
+"""
+Benchmark the columnar mutasi valas kernel against the per-currency Python loops it replaced.
+
+Builds synthetic transactions for one branch (mixed datetime / ISO string dates, like
+historical data) and compares:
+  - a period report (what /mutasi-valas/calculate computes for start_date..end_date)
+  - the day x currency matrix for a whole year (compute_mutasi_daily); the Python side
+    is one single-day report per day, so it is timed on a few days and extrapolated
+Outputs are checked for equality after the report rounding before anything is timed.
+
+Usage: python benchmark_mutasi.py [transactions]   (default 1000000)
+No database is needed; MONGO_URL/DB_NAME only have to be set for the import.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from server import (
+    MONEY_SCALE, MUTASI_KERNEL_FIELDS, compute_mutasi_daily, compute_mutasi_period, from_minor,
+    load_mutasi_columns, mutasi_opening_from_history, mutasi_rows, to_minor
+)
+
+CURRENCIES = [
+    {"code": code, "name": code, "symbol": ""}
+    for code in ["USD", "SGD", "AUD", "EUR", "JPY", "MYR", "CNY", "KRW"]
+]
+START = datetime(2025, 1, 1)
+DAYS = 365
+CHECK_DAYS = 5
+
+
+def make_transactions(count):
+    transactions = []
+    for _ in range(count):
+        txn_date = START + timedelta(seconds=random.randint(0, DAYS * 86400 - 1))
+        amount = float(random.randint(1, 500) * 10)
+        transactions.append({
+            "currency_code": random.choice(CURRENCIES)["code"],
+            # Buys outweigh sells so stock stays mostly positive
+            "transaction_type": "beli" if random.random() < 0.55 else "jual",
+            "amount": amount,
+            "total_idr": round(amount * random.uniform(9000, 17000)),
+            "transaction_date": txn_date if random.random() < 0.7 else txn_date.isoformat() + "+00:00",
+        })
+    return transactions
+
+
+def normalize_transaction_date(txn_date):
+    """The per-row normalization build_mutasi_valas used before the kernel"""
+    if isinstance(txn_date, datetime):
+        return txn_date.replace(tzinfo=None)
+    if isinstance(txn_date, str):
+        try:
+            return datetime.fromisoformat(txn_date.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+
+def sum_money(transactions, field):
+    """Exact sum in minor units, as the kernel does"""
+    return sum(to_minor(t[field]) for t in transactions) / MONEY_SCALE
+
+
+def python_period(transactions, start, end, opening=None):
+    """The previous per-currency loops: Stock Awal from history (or opening), then the period"""
+    dated = [(normalize_transaction_date(t.get("transaction_date")), t) for t in transactions]
+    prev_transactions = [t for d, t in dated if d and d < start]
+    transactions = [t for d, t in dated if d and start <= d <= end]
+    rows = []
+    for currency in CURRENCIES:
+        code = currency["code"]
+        if opening is None:
+            prev = [t for t in prev_transactions if t.get("currency_code") == code]
+            prev_buy = [t for t in prev if t.get("transaction_type") in ["beli", "buy"]]
+            prev_buy_valas = sum_money(prev_buy, "amount")
+            prev_buy_idr = sum_money(prev_buy, "total_idr")
+            prev_sell_valas = sum_money([t for t in prev if t.get("transaction_type") in ["jual", "sell"]], "amount")
+            beginning_valas = prev_buy_valas - prev_sell_valas
+            beginning_idr = beginning_valas * (prev_buy_idr / prev_buy_valas if prev_buy_valas > 0 else 0)
+        else:
+            beginning_valas, beginning_idr = opening[code]
+        if beginning_valas < 0:
+            beginning_valas, beginning_idr = 0.0, 0.0
+        if beginning_idr < 0:
+            beginning_idr = 0.0
+        current = [t for t in transactions if t.get("currency_code") == code]
+        purchases = [t for t in current if t.get("transaction_type") in ["beli", "buy"]]
+        sales = [t for t in current if t.get("transaction_type") in ["jual", "sell"]]
+        purchase_valas, purchase_idr = sum_money(purchases, "amount"), sum_money(purchases, "total_idr")
+        sale_valas, sale_idr = sum_money(sales, "amount"), sum_money(sales, "total_idr")
+        ending_valas = max(beginning_valas + purchase_valas - sale_valas, 0.0)
+        valas_in = beginning_valas + purchase_valas
+        avg_rate = (beginning_idr + purchase_idr) / valas_in if valas_in > 0 else 0
+        ending_idr = max(ending_valas * avg_rate, 0.0)
+        rows.append({
+            "currency_code": code,
+            "beginning_stock_valas": beginning_valas, "beginning_stock_idr": beginning_idr,
+            "purchase_valas": purchase_valas, "purchase_idr": purchase_idr,
+            "sale_valas": sale_valas, "sale_idr": sale_idr,
+            "ending_stock_valas": ending_valas, "ending_stock_idr": ending_idr, "avg_rate": avg_rate,
+            "profit_loss": (ending_idr + sale_idr) - (beginning_idr + purchase_idr),
+            "transaction_count": len(current),
+        })
+    return rows
+
+
+def rounded(rows):
+    digits = {field: 2 if "valas" in field or field == "avg_rate" else 0 for field in MUTASI_KERNEL_FIELDS}
+    return [
+        {"currency_code": row["currency_code"], "transaction_count": row["transaction_count"],
+         **{field: round(row[field], digits[field]) for field in MUTASI_KERNEL_FIELDS}}
+        for row in rows
+    ]
+
+
+def kernel_period(columns, start, end):
+    n = len(CURRENCIES)
+    opening_valas, opening_idr = mutasi_opening_from_history(columns, n, start)
+    return mutasi_rows(CURRENCIES, compute_mutasi_period(columns, n, start, end, opening_valas, opening_idr))
+
+
+def timed(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(42)
+    transactions = make_transactions(count)
+    codes = [currency["code"] for currency in CURRENCIES]
+    period_start, period_end = START + timedelta(days=90), START + timedelta(days=120, hours=23, minutes=59, seconds=59)
+    print(f"{count:,} transactions, {len(CURRENCIES)} currencies, {DAYS} days\n")
+
+    load_time, columns = timed(lambda: load_mutasi_columns(transactions, codes), repeat=1)
+
+    # Correctness first: period report, then the first days of the daily chain
+    python_rows = python_period(transactions, period_start, period_end)
+    assert rounded(kernel_period(columns, period_start, period_end)) == rounded(python_rows), "period mismatch"
+    matrix = compute_mutasi_daily(columns, len(CURRENCIES), START, DAYS)
+    opening = None
+    for day in range(CHECK_DAYS):
+        day_start = START + timedelta(days=day)
+        python_rows = python_period(transactions, day_start, day_start + timedelta(hours=23, minutes=59, seconds=59), opening)
+        assert rounded(mutasi_rows(CURRENCIES, matrix, day)) == rounded(python_rows), f"day {day} mismatch"
+        # Stock Akhir is carried to the next day booked to the sen, like the snapshots
+        opening = {
+            row["currency_code"]: (from_minor(to_minor(row["ending_stock_valas"])), from_minor(to_minor(row["ending_stock_idr"])))
+            for row in python_rows
+        }
+    print(f"outputs identical after rounding (period report + first {CHECK_DAYS} days)\n")
+
+    python_time, _ = timed(lambda: python_period(transactions, period_start, period_end), repeat=1)
+    kernel_time, _ = timed(lambda: kernel_period(columns, period_start, period_end))
+    daily_time, _ = timed(lambda: compute_mutasi_daily(columns, len(CURRENCIES), START, DAYS))
+
+    print(f"{'load columns':<28} {load_time * 1000:10.1f} ms  (once per request)")
+    print(f"{'period report':<28} python {python_time * 1000:10.1f} ms  kernel {kernel_time * 1000:8.1f} ms  "
+          f"({python_time / kernel_time:5.1f}x, {(python_time) / (load_time + kernel_time):4.1f}x incl. load)")
+    print(f"{f'daily matrix ({DAYS} days)':<28} python {python_time * DAYS:10.1f} s   kernel {daily_time * 1000:8.1f} ms  "
+          f"(python extrapolated: one single-day report per day)")
+
+
+if __name__ == "__main__":
+    main()
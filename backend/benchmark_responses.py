@@ -0,0 +1,182 @@
+"""
+Benchmark response serialization for the large list endpoints.
+
+Builds synthetic documents shaped like the Mongo rows behind /transactions,
+/customers, /cashbook and /backup/download, then compares the previous
+encoding path (jsonable_encoder + stdlib json) with FastJSONResponse /
+dumps_json, and reports bytes on the wire with and without gzip.
+The "full" rows compare FastAPI's response_model path (validate every row,
+serialize, render) with the trusted_list_response fast path.
+
+Usage: python benchmark_responses.py [rows]   (default 5000)
+No database is needed; MONGO_URL/DB_NAME only have to be set for the import.
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from starlette.responses import JSONResponse
+from typing import List
+
+from server import (
+    Customer, FastJSONResponse, GZIP_MINIMUM_SIZE, Transaction, dumps_json, orjson, trusted_list_response
+)
+
+CURRENCIES = ["USD", "SGD", "AUD", "EUR", "JPY", "MYR", "CNY", "KRW"]
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_customer(branch_id):
+    return {
+        "id": str(uuid.uuid4()),
+        "customer_type": "perorangan",
+        "customer_code": f"MBA{uuid.uuid4().hex[:8].upper()}",
+        "branch_id": branch_id,
+        "name": f"Nasabah {random.randint(1, 99999)}",
+        "gender": random.choice(["L", "P"]),
+        "identity_type": "KTP",
+        "identity_number": str(random.randint(10**15, 10**16 - 1)),
+        "birth_place": "Denpasar",
+        "birth_date": "1985-04-12",
+        "identity_address": "Jl. Sunset Road No. 88, Kuta, Badung, Bali",
+        "domicile_address": "Jl. Sunset Road No. 88, Kuta, Badung, Bali",
+        "phone": f"08{random.randint(10**9, 10**10 - 1)}",
+        "occupation": "Wiraswasta",
+        "fund_source": "Gaji",
+        "transaction_purpose": "Wisata",
+        "is_pep": False,
+        "created_at": START + timedelta(minutes=random.randint(0, 500000)),
+    }
+
+
+def make_transaction(customer):
+    amount = float(random.randint(1, 500) * 100)
+    rate = random.uniform(9000, 17000)
+    txn_date = START + timedelta(minutes=random.randint(0, 500000))
+    return {
+        "id": str(uuid.uuid4()),
+        "transaction_number": f"TRX-DPS-J-{txn_date:%Y%m%d}-{random.randint(1, 9999):04d}",
+        "voucher_number": None,
+        "customer_id": customer["id"],
+        "customer_code": customer["customer_code"],
+        "customer_name": customer["name"],
+        "customer_identity_type": "KTP",
+        "branch_id": customer["branch_id"],
+        "branch_name": "Cabang Kuta",
+        "user_id": str(uuid.uuid4()),
+        "accountant_name": "Kasir Satu",
+        "transaction_type": random.choice(["jual", "beli"]),
+        "currency_id": str(uuid.uuid4()),
+        "currency_code": random.choice(CURRENCIES),
+        "amount": amount,
+        "exchange_rate": rate,
+        "total_idr": amount * rate,
+        "notes": None,
+        "delivery_channel": "Langsung",
+        "payment_method": "Tunai",
+        "transaction_purpose": "Wisata",
+        "transaction_date": txn_date,
+        "accounting_date_wita": f"{txn_date:%Y-%m-%d}",
+        "created_at": txn_date,
+    }
+
+
+def make_cashbook_entry(transaction):
+    return {
+        "id": str(uuid.uuid4()),
+        "branch_id": transaction["branch_id"],
+        "date": transaction["transaction_date"],
+        "entry_type": "debit" if transaction["transaction_type"] == "jual" else "credit",
+        "amount": transaction["total_idr"],
+        "description": f"Transaksi {transaction['transaction_number']}",
+        "reference_type": "transaction",
+        "reference_id": transaction["id"],
+        "created_at": transaction["created_at"],
+    }
+
+
+def response_model_path(model, rows):
+    """What FastAPI does for response_model=List[model]: validate, dump to JSON types, render"""
+    adapter = TypeAdapter(List[model])
+    return lambda: FastJSONResponse(adapter.dump_python(adapter.validate_python(rows), mode="json")).body
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, old_func, new_func):
+    old_time, old_body = timed(old_func)
+    new_time, new_body = timed(new_func)
+    gzipped = gzip.compress(new_body, compresslevel=9)
+    print(
+        f"{name:<22} old {old_time * 1000:8.1f} ms  new {new_time * 1000:8.1f} ms  "
+        f"({old_time / new_time:4.1f}x)  bytes {len(old_body):>11,} -> {len(new_body):>11,}  "
+        f"gzip {len(gzipped):>10,} ({len(gzipped) / len(new_body):.0%})"
+    )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    random.seed(42)
+    branches = [str(uuid.uuid4()) for _ in range(4)]
+    customers = [make_customer(random.choice(branches)) for _ in range(max(rows // 5, 1))]
+    transactions = [make_transaction(random.choice(customers)) for _ in range(rows)]
+    cashbook = {
+        "entries": [make_cashbook_entry(t) for t in transactions],
+        "opening_balance": 250000000.0,
+        "total_debit": 0.0,
+        "total_credit": 0.0,
+        "balance": 250000000.0,
+        "period_date": None,
+    }
+    backup = {
+        "backup_date": datetime.now(timezone.utc).isoformat(),
+        "customers": customers,
+        "transactions": transactions,
+        "cashbook_entries": cashbook["entries"],
+    }
+
+    # response_model routes: FastAPI hands the render step JSON-compatible data
+    transactions_encoded = jsonable_encoder(transactions)
+    customers_encoded = jsonable_encoder(customers)
+
+    print(f"{rows} transactions, {len(customers)} customers; encoder: {'orjson' if orjson else 'stdlib json'}; "
+          f"gzip minimum_size={GZIP_MINIMUM_SIZE}\n")
+    report("/transactions render",
+           lambda: JSONResponse(transactions_encoded).body,
+           lambda: FastJSONResponse(transactions_encoded).body)
+    report("/customers render",
+           lambda: JSONResponse(customers_encoded).body,
+           lambda: FastJSONResponse(customers_encoded).body)
+    report("/transactions full",
+           response_model_path(Transaction, transactions),
+           lambda: trusted_list_response(Transaction, transactions).body)
+    report("/customers full",
+           response_model_path(Customer, customers),
+           lambda: trusted_list_response(Customer, customers).body)
+    report("/cashbook",
+           lambda: JSONResponse(jsonable_encoder(cashbook)).body,
+           lambda: FastJSONResponse(cashbook).body)
+    report("/backup/download",
+           lambda: json.dumps(backup, indent=2, default=str).encode(),
+           lambda: dumps_json(backup, indent=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Header, UploadFile, File, status
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import json
+import hashlib
+import gzip
+import operator
+import asyncio
 import logging
+import time
+import importlib
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, ValidationError
 from typing import List, Optional
 import uuid
+import secrets
 from datetime import datetime, timezone, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from passlib.context import CryptContext
 import jwt
 from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional - responses fall back to the stdlib json encoder
+    orjson = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -75,9 +99,179 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'moztec-secret-key-change-in-productio
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 
+# Idempotency-Key support for create endpoints - stored responses expire after this
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+# The request holding a key renews it every IDEMPOTENCY_HEARTBEAT_SECONDS; a key not renewed
+# for IDEMPOTENCY_STALE_SECONDS belongs to a request whose worker died - a retry takes it over
+IDEMPOTENCY_HEARTBEAT_SECONDS = 20
+IDEMPOTENCY_STALE_SECONDS = 120
+IDEMPOTENCY_CLAIM_ATTEMPTS = 3
+
+# Bulk transaction import (end-of-day batch uploads)
+BULK_IMPORT_MAX_ROWS = 20000
+BULK_IMPORT_BATCH_SIZE = 500
+
+# Per-day transaction number counters are only incremented on their own day
+TRANSACTION_COUNTER_TTL_DAYS = 3
+
+# Activity log writer - entries are queued and written with insert_many once a batch
+# fills up or the oldest queued entry is this many seconds old
+ACTIVITY_LOG_BATCH_SIZE = 200
+ACTIVITY_LOG_FLUSH_SECONDS = 2.0
+ACTIVITY_LOG_MAX_QUEUE = 10000
+ACTIVITY_LOG_RETRY_MAX_SECONDS = 30  # backoff cap while the database rejects writes
+
+# Activity log retention - entries older than this are moved to monthly gzip archives
+ACTIVITY_LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 180))
+ACTIVITY_LOG_ARCHIVE_DIR = Path(os.environ.get('ACTIVITY_LOG_ARCHIVE_DIR', ROOT_DIR / 'archives' / 'activity_logs'))
+ACTIVITY_LOG_ARCHIVE_INTERVAL_HOURS = 24
+ACTIVITY_LOG_TIMESTAMP_JOB_TIMEOUT_MINUTES = 30  # legacy string -> datetime migration
+
+# Online status - authenticated requests (and open SSE streams) refresh users.last_seen at
+# most once per interval; a user is online if seen within the window
+LAST_SEEN_WRITE_INTERVAL_SECONDS = 60
+ONLINE_WINDOW_MINUTES = 5
+ONLINE_STATUS_CACHE_SECONDS = 30
+# How often users who dropped out of (or entered) the window are pushed to admin SSE clients
+PRESENCE_SWEEP_SECONDS = 30
+
+# User manual files - generated in a process pool (python-docx / reportlab are CPU-bound)
+MANUAL_DIR = ROOT_DIR / "static"
+MANUAL_CACHE_DIR = MANUAL_DIR / "manual_cache"
+MANUAL_SCREENSHOTS_DIR = MANUAL_DIR / "screenshots"
+MANUAL_GENERATOR = os.environ.get('MANUAL_GENERATOR', 'enhanced')
+MANUAL_GENERATOR_WORKERS = 2
+MANUAL_JOB_TIMEOUT_MINUTES = 10
+
+# Consolidated (all-branches) reports - branches computed at the same time
+CONSOLIDATED_BRANCH_CONCURRENCY = int(os.environ.get('CONSOLIDATED_BRANCH_CONCURRENCY', 4))
+
+# Server-sent events - "local" publishes from request handlers (single worker);
+# "change_stream" publishes from a MongoDB change stream (multi-worker, needs a replica set)
+EVENT_SOURCE = os.environ.get('EVENT_SOURCE', 'local')
+SSE_HEARTBEAT_SECONDS = 15
+# EventSource cannot send headers: the stream is opened with a single-use ticket that
+# expires quickly, and the user/session behind it is re-checked while the stream is open
+SSE_TICKET_TTL_SECONDS = 60
+SSE_AUTH_RECHECK_SECONDS = 60
+
+# Notification feed - single transactions at/above this amount raise a "large_transaction" alert
+LARGE_TRANSACTION_THRESHOLD_IDR = 50000000
+NOTIFICATION_RETENTION_DAYS = 7
+# Each notification poll re-reads this window before its cursor (clients dedupe by id), so
+# alerts written by other workers with a slightly earlier created_at are still delivered
+NOTIFICATION_CURSOR_OVERLAP_SECONDS = 60
+
+# AML monitoring - cumulative IDR per customer that triggers a compliance alert
+AML_THRESHOLDS_IDR = {
+    "daily": float(os.environ.get('AML_DAILY_THRESHOLD_IDR', 500000000)),
+    "monthly": float(os.environ.get('AML_MONTHLY_THRESHOLD_IDR', 1000000000)),
+}
+CUSTOMER_PERIOD_TOTALS_JOB_TIMEOUT_MINUTES = 30
+CUSTOMER_STATS_JOB_TIMEOUT_MINUTES = 30
+
+# Responses smaller than this (bytes) are sent uncompressed
+GZIP_MINIMUM_SIZE = 1024
+
 security = HTTPBearer()
 
-app = FastAPI()
+def json_default(value):
+    """Fallback for types neither encoder handles natively (dates and NumPy for stdlib json, Decimal, ObjectId)"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+def dumps_json(content, indent: bool = False) -> bytes:
+    """Serialize to JSON bytes with orjson when installed, stdlib json otherwise"""
+    if orjson is not None:
+        # No OPT_UTC_Z: raw documents keep the "+00:00" offset jsonable_encoder's isoformat() gave them
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(content, default=json_default, option=option)
+    return json.dumps(
+        content, default=json_default, ensure_ascii=False, allow_nan=False,
+        indent=2 if indent else None, separators=None if indent else (",", ":")
+    ).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    Default response class. Routes may also return it directly with raw Mongo documents
+    (datetimes included) to skip FastAPI's jsonable_encoder pass.
+    """
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+def project_trusted_rows(model, rows: list) -> list:
+    """
+    Trim documents this app wrote itself to the model's fields (what response_model
+    would emit) without validating them. Missing optional fields get their static
+    default; a row missing a required or factory-default field goes through model
+    validation instead.
+    """
+    fields = model.model_fields
+    names = tuple(fields)
+    pick = operator.itemgetter(*names)
+    defaults = {
+        name: field.default for name, field in fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+    items = []
+    for row in rows:
+        try:
+            items.append(dict(zip(names, pick({**defaults, **row}))))
+        except KeyError:
+            items.append(model.model_validate(row).model_dump(mode="json"))
+    return items
+
+def trusted_list_response(model, rows: list) -> FastJSONResponse:
+    """
+    Fast path for list endpoints: returning a Response skips FastAPI's per-row
+    validate-then-serialize pass. Keep response_model on the route for the OpenAPI schema.
+    """
+    return FastJSONResponse(project_trusted_rows(model, rows))
+
+# Projection profiles for list and report endpoints, selected with ?fields=summary|full.
+# "full" returns every model field; "summary" only what list views and the transaction form
+# read, so Mongo sends, decodes and we serialize far less per row.
+PROJECTION_PROFILES = {
+    "transactions": {
+        "summary": [
+            "id", "transaction_number", "voucher_number", "customer_id", "customer_code", "customer_name",
+            "branch_id", "user_id", "transaction_type", "currency_id", "currency_code", "amount",
+            "exchange_rate", "total_idr", "transaction_date", "accounting_date_wita", "created_at"
+        ],
+    },
+    "customers": {
+        "summary": [
+            "id", "customer_code", "customer_type", "branch_id", "name", "entity_name", "identity_type",
+            "identity_number", "npwp", "phone", "pic_phone", "is_pep", "created_at"
+        ],
+    },
+}
+
+def get_projection(collection: str, fields: str = "full") -> dict:
+    """Mongo projection for a profile; "full" drops only _id and internal fields"""
+    if fields == "full":
+        projection = {"_id": 0}
+        if collection == "customers":
+            projection["search_keys"] = 0
+        return projection
+    profile = PROJECTION_PROFILES[collection].get(fields)
+    if profile is None:
+        available = ", ".join(["full", *PROJECTION_PROFILES[collection]])
+        raise HTTPException(status_code=400, detail=f"Unknown fields profile '{fields}'. Use one of: {available}")
+    return {"_id": 0, **{name: 1 for name in profile}}
+
+def profile_list_response(model, rows: list, fields: str = "full") -> FastJSONResponse:
+    """Full rows keep the response_model shape; summary rows are returned as projected"""
+    if fields == "full":
+        return trusted_list_response(model, rows)
+    return FastJSONResponse(rows)
+
+app = FastAPI(default_response_class=FastJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # ============= HEALTH CHECK =============
@@ -88,9 +282,9 @@ async def health_check():
     try:
         # Test database connection
         await db.command('ping')
-        return {"status": "healthy", "database": "connected"}
+        return {"status": "healthy", "database": "connected", "activity_log": activity_log_writer.stats()}
     except Exception as e:
-        return {"status": "unhealthy", "database": str(e)}
+        return {"status": "unhealthy", "database": str(e), "activity_log": activity_log_writer.stats()}
 
 # ============= MODELS =============
 
@@ -248,6 +442,7 @@ class Transaction(BaseModel):
     amount: float
     exchange_rate: float
     total_idr: float
+    total_idr_minor: Optional[int] = None  # total_idr in sen (exact); see MONEY section
     notes: Optional[str] = None
     delivery_channel: Optional[str] = None
     payment_method: Optional[str] = None
@@ -276,6 +471,7 @@ class CashBookEntry(BaseModel):
     date: datetime
     entry_type: str
     amount: float
+    amount_minor: Optional[int] = None  # amount in sen (exact)
     description: str
     reference_type: Optional[str] = None
     reference_id: Optional[str] = None
@@ -406,6 +602,64 @@ class DashboardStats(BaseModel):
     total_branches: int
     recent_transactions: List[Transaction]
 
+# ============= MONEY (FIXED-POINT) =============
+# Money is stored twice: the float fields the API and UI use, plus exact integer minor
+# units (1/100: sen for IDR, cents for valas) in "<field>_minor". total_idr is computed in
+# Decimal and rounded half-up to the sen once, the float is derived from the integer, and
+# sums / comparisons run on the integers. Integer-valued float64 arrays sum exactly up to
+# 2^53 minor units (about 90 trillion IDR), so np.bincount/np.sum stay exact at full speed.
+# Documents written before /admin/migrate-money-minor-units fall back to the float field.
+
+MONEY_SCALE = 100
+
+def decimal_minor(*factors: float) -> int:
+    """Product of float factors in minor units, computed in Decimal (shortest repr) and rounded half-up"""
+    value = Decimal(MONEY_SCALE)
+    for factor in factors:
+        value *= Decimal(repr(float(factor)))
+    return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_minor(value) -> int:
+    """Float amount -> integer minor units (1.005 -> 101, like the Decimal total_idr)"""
+    return decimal_minor(value or 0)
+
+def to_minor_array(values: np.ndarray) -> np.ndarray:
+    """to_minor over an array, as integer-valued float64"""
+    return np.fromiter((to_minor(value) for value in values.tolist()), np.float64, len(values))
+
+def from_minor(units: int) -> float:
+    return units / MONEY_SCALE
+
+def money_product_minor(amount: float, exchange_rate: float) -> int:
+    """amount x exchange_rate in IDR minor units, computed in Decimal and rounded half-up"""
+    return decimal_minor(amount, exchange_rate)
+
+def compute_total_idr(amount: float, exchange_rate: float) -> tuple:
+    """(total_idr, total_idr_minor) for a transaction"""
+    units = money_product_minor(amount, exchange_rate)
+    return from_minor(units), units
+
+def doc_minor(doc: dict, field: str) -> int:
+    """Minor units of a money field, from "<field>_minor" when the document has it"""
+    units = doc.get(f"{field}_minor")
+    return units if units is not None else to_minor(doc.get(field))
+
+def minor_column(docs: list, field: str) -> np.ndarray:
+    """Minor units of a money field for many documents, as integer-valued float64"""
+    units = np.fromiter(
+        (doc.get(f"{field}_minor", np.nan) for doc in docs), np.float64, len(docs)
+    )
+    missing = np.isnan(units)
+    if missing.any():
+        values = np.fromiter(
+            (doc.get(field) or 0.0 for doc, absent in zip(docs, missing) if absent), np.float64
+        )
+        units[missing] = to_minor_array(values)
+    return units
+
+def sum_minor(docs: list, field: str) -> int:
+    return int(minor_column(docs, field).sum())
+
 # ============= HELPER FUNCTIONS =============
 
 def hash_password(password: str) -> str:
@@ -422,8 +676,91 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await get_user_from_token(credentials.credentials)
+
+class PresenceTracker:
+    """
+    Debounced last_seen heartbeat. touch() is called on every authenticated request but
+    writes users.last_seen at most once per interval per user, in the background.
+    The /users/online-status payload is cached briefly since every admin view asks for it,
+    and sweep() pushes user_online / user_offline when users cross the online window.
+    """
+    
+    def __init__(self, write_interval: int, online_window: timedelta, status_ttl: int):
+        self.write_interval = write_interval
+        self.online_window = online_window
+        self.status_ttl = status_ttl
+        self._last_write = {}  # user_id -> time.monotonic() of the last write
+        self._pending = set()  # keep references to in-flight write tasks
+        self._status = {}  # include_offline -> (expires, payload)
+        self._online_ids = None  # online users at the last sweep
+    
+    def touch(self, user_id: str):
+        now = time.monotonic()
+        last = self._last_write.get(user_id)
+        if last is not None and now - last < self.write_interval:
+            return
+        self._last_write[user_id] = now
+        task = asyncio.create_task(self._write(user_id))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+    
+    async def _write(self, user_id: str):
+        try:
+            await db.users.update_one({"id": user_id}, {"$set": {"last_seen": datetime.now(timezone.utc)}})
+        except Exception as e:
+            self._last_write.pop(user_id, None)  # retry on the next request
+            logging.error(f"Failed to update last_seen for {user_id}: {e}")
+    
+    def online_since(self) -> datetime:
+        return datetime.now(timezone.utc) - self.online_window
+    
+    def cached_status(self, include_offline: bool) -> Optional[dict]:
+        expires, payload = self._status.get(include_offline, (0.0, None))
+        return payload if time.monotonic() < expires else None
+    
+    def cache_status(self, include_offline: bool, payload: dict):
+        self._status[include_offline] = (time.monotonic() + self.status_ttl, payload)
+    
+    def invalidate(self):
+        self._status.clear()
+    
+    async def sweep(self):
+        """Publish online-status deltas since the last sweep (every worker, to its own SSE clients)"""
+        if not event_broker.subscriber_count:
+            self._online_ids = None  # nobody listening - start over on the next sweep
+            return
+        online_users = await db.users.find(
+            {"is_active": True, "last_seen": {"$gte": self.online_since()}},
+            {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1, "last_login": 1}
+        ).to_list(None)
+        online_ids = {user["id"] for user in online_users}
+        if self._online_ids is not None and online_ids != self._online_ids:
+            for user in online_users:
+                if user["id"] not in self._online_ids:
+                    event_broker.publish("user_online", user, admin_only=True)
+            for user_id in self._online_ids - online_ids:
+                event_broker.publish("user_offline", {"id": user_id}, admin_only=True)
+            self.invalidate()
+        self._online_ids = online_ids
+
+presence = PresenceTracker(
+    LAST_SEEN_WRITE_INTERVAL_SECONDS, timedelta(minutes=ONLINE_WINDOW_MINUTES), ONLINE_STATUS_CACHE_SECONDS
+)
+
+async def presence_sweep_loop():
+    while True:
+        try:
+            await presence.sweep()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Presence sweep failed: {e}")
+        await asyncio.sleep(PRESENCE_SWEEP_SECONDS)
+
+async def get_user_from_token(token: str) -> User:
+    """Resolve a JWT (Authorization: Bearer) to a user"""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
@@ -432,12 +769,54 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user = await db.users.find_one({"id": user_id}, {"_id": 0})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
+        presence.touch(user_id)
         return User(**user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def get_transaction_branch_code(branch: Optional[dict]) -> str:
+    """Branch part of a transaction number - first part before dash, or full code up to 3 chars"""
+    if not branch:
+        return "00"
+    raw_code = branch.get("code", "00")
+    return raw_code.split("-")[0][:3].upper() if "-" in raw_code else raw_code[:3].upper()
+
+async def allocate_transaction_sequence(type_indicator: str, date_str: str, count: int = 1) -> int:
+    """
+    Reserve `count` consecutive sequence numbers for transaction numbers of this type (J/B)
+    and day (DDMMYY) and return the first one. Backed by an atomic $inc on one counter
+    document per (type, day), so concurrent requests never get the same number.
+    Bulk imports reserve their whole range with one call.
+    """
+    counter_id = f"{type_indicator}-{date_str}"
+    if not await db.transaction_counters.find_one({"_id": counter_id}, {"_id": 1}):
+        # First number of this day - continue after numbers issued before the counter existed
+        # Pattern: TRX-MBA-J-XXXXX-XXX-DDMMYY or TRX-MBA-B-XXXXX-XXX-DDMMYY
+        existing = await db.transactions.count_documents({
+            "transaction_number": {
+                "$regex": f"^TRX-MBA-{type_indicator}-.*-{date_str}"
+            }
+        })
+        now = datetime.now(timezone.utc)
+        try:
+            await db.transaction_counters.insert_one({
+                "_id": counter_id,
+                "seq": existing,
+                "created_at": now,
+                "expires_at": now + timedelta(days=TRANSACTION_COUNTER_TTL_DAYS)
+            })
+        except DuplicateKeyError:
+            pass  # Another request created it first
+    
+    counter = await db.transaction_counters.find_one_and_update(
+        {"_id": counter_id},
+        {"$inc": {"seq": count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"] - count + 1
+
 async def generate_transaction_number(transaction_type: str, branch_id: str, suffix: str = None, base_seq: int = None):
     """
     Generate transaction number with format: TRX-MBA-J/B-XXXXX-BRANCHCODE-DDMMYY[-a/b/c]
@@ -464,11 +843,7 @@ async def generate_transaction_number(transaction_type: str, branch_id: str, suf
     
     # Get branch code - use first part before dash, or full code up to 3 chars
     branch = await db.branches.find_one({"id": branch_id}, {"_id": 0})
-    if branch:
-        raw_code = branch.get("code", "00")
-        branch_code = raw_code.split("-")[0][:3].upper() if "-" in raw_code else raw_code[:3].upper()
-    else:
-        branch_code = "00"
+    branch_code = get_transaction_branch_code(branch)
     
     # Format date as DDMMYY
     date_str = now.strftime('%d%m%y')
@@ -478,22 +853,7 @@ async def generate_transaction_number(transaction_type: str, branch_id: str, suf
         # For multi-currency: use provided base sequence
         seq_number = str(base_seq).zfill(5)
     else:
-        # Count existing transactions for TODAY and THIS TYPE (J or B)
-        today_date = now.strftime('%Y-%m-%d')
-        
-        # Build regex pattern to match transaction numbers for today and this type
-        # Pattern: TRX-MBA-J-XXXXX-XXX-DDMMYY or TRX-MBA-B-XXXXX-XXX-DDMMYY
-        txn_pattern = f"TRX-MBA-{type_indicator}-"
-        date_pattern = f"-{date_str}"
-        
-        # Count transactions with this type indicator and today's date in the transaction_number
-        count = await db.transactions.count_documents({
-            "transaction_number": {
-                "$regex": f"^{txn_pattern}.*{date_pattern}"
-            }
-        })
-        
-        seq_number = str(count + 1).zfill(5)
+        seq_number = str(await allocate_transaction_sequence(type_indicator, date_str)).zfill(5)
     
     # Build transaction number
     txn_number = f"TRX-MBA-{type_indicator}-{seq_number}-{branch_code}-{date_str}"
@@ -515,9 +875,929 @@ async def log_user_activity(user_id: str, user_name: str, user_email: str, actio
         ip_address=ip_address,
         user_agent=user_agent
     )
-    log_dict = log_entry.model_dump()
-    log_dict["timestamp"] = log_dict["timestamp"].isoformat()
-    await db.user_activity_logs.insert_one(log_dict)
+    log_dict = log_entry.model_dump()  # timestamp stays a datetime (indexed, range-queryable)
+    if activity_log_writer.running:
+        activity_log_writer.enqueue(log_dict)
+    else:
+        # Outside the app lifecycle (scripts, startup) - write directly
+        await db.user_activity_logs.insert_one(log_dict)
+
+class ActivityLogWriter:
+    """
+    Background writer for user_activity_logs. Requests only enqueue (no awaited write);
+    a single task flushes batches with insert_many on size or age. A batch whose write
+    fails is kept and retried with backoff, and stop() finishes the write in flight and
+    drains whatever is still queued on shutdown.
+    """
+    
+    def __init__(self, batch_size: int, flush_seconds: float, max_queue_size: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = asyncio.Queue(maxsize=max_queue_size)
+        self._batch = []  # taken off the queue, not yet written
+        self._task = None
+        self._writing = None  # insert_many in flight - shielded from cancellation
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def enqueue(self, entry: dict):
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            # Database unreachable for a long time - drop rather than grow without bound
+            self.dropped += 1
+            logging.warning("Activity log queue full, dropping entry")
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        retries = 0
+        while True:
+            if not self._batch:  # a batch that failed to write is retried first
+                self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_seconds
+            while len(self._batch) < self.batch_size:
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            if await self._flush():
+                retries = 0
+            else:
+                retries += 1
+                await asyncio.sleep(min(2 ** retries, ACTIVITY_LOG_RETRY_MAX_SECONDS))
+    
+    async def _flush(self) -> bool:
+        """Write the pending batch; False if it failed and was put back for a retry"""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return True
+        # Shielded so stop() cancelling the flush task cannot abandon a batch mid-write
+        self._writing = asyncio.ensure_future(self._write(batch))
+        return await asyncio.shield(self._writing)
+    
+    async def _write(self, batch: list) -> bool:
+        try:
+            await db.user_activity_logs.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # insert_many assigned the _ids on the first attempt, so duplicate-key errors are
+            # entries an earlier failed attempt already wrote; other rejections would fail again
+            write_errors = e.details.get("writeErrors", [])
+            duplicates = sum(1 for error in write_errors if error.get("code") == 11000)
+            inserted = e.details.get("nInserted", 0)
+            self.written += inserted + duplicates
+            self.failed += len(write_errors) - duplicates
+            if len(write_errors) > duplicates:
+                logging.error(f"Activity log entries rejected: {len(write_errors) - duplicates}")
+            if inserted:
+                publish_activity_logged(inserted)
+            return True
+        except Exception as e:
+            self._batch = batch + self._batch
+            logging.warning(f"Failed to write {len(batch)} activity log entries, retrying: {e}")
+            return False
+        self.written += len(batch)
+        publish_activity_logged(len(batch))
+        return True
+    
+    async def stop(self):
+        """Stop the flush task and write everything still pending"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writing and not self._writing.done():
+            await self._writing  # written, or put back into the batch
+        while not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+            if len(self._batch) >= self.batch_size:
+                await self._flush()
+        if not await self._flush():
+            # Last attempt at shutdown - nothing will retry these
+            self.failed += len(self._batch)
+            logging.error(f"Lost {len(self._batch)} activity log entries at shutdown")
+            self._batch = []
+    
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() + len(self._batch),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+activity_log_writer = ActivityLogWriter(ACTIVITY_LOG_BATCH_SIZE, ACTIVITY_LOG_FLUSH_SECONDS, ACTIVITY_LOG_MAX_QUEUE)
+
+# Conditional GET (ETag / If-None-Match)
+# Every write to a versioned collection bumps a counter document in collection_versions.
+# Read endpoints derive a weak ETag from the counters they depend on (one small indexed read),
+# so a matching If-None-Match is answered with 304 before the real query runs. The counters
+# live in Mongo, so every worker sees every other worker's writes.
+
+class CollectionVersions:
+    """Write counters per collection (collection_versions, one document per collection)"""
+    
+    async def bump(self, collection: str):
+        # The epoch is set when a counter document is (re)created, so a counter that was
+        # dropped and starts again from 1 never reproduces an ETag a client still holds
+        await db.collection_versions.update_one(
+            {"_id": collection},
+            {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+            upsert=True
+        )
+    
+    async def etag(self, collections, scope: str = "") -> str:
+        docs = await db.collection_versions.find({"_id": {"$in": list(collections)}}).to_list(None)
+        versions = {d["_id"]: f"{d.get('epoch', '')}.{d.get('version', 0)}" for d in docs}
+        parts = ",".join(f"{c}:{versions.get(c, 0)}" for c in collections)
+        digest = hashlib.sha1(f"{parts}|{scope}".encode()).hexdigest()[:20]
+        return f'W/"{digest}"'
+
+collection_versions = CollectionVersions()
+
+class NotModified(Exception):
+    """Raised by versioned_etag() to short-circuit a request with 304"""
+    def __init__(self, etag: str):
+        self.etag = etag
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified):
+    return Response(status_code=304, headers={"ETag": exc.etag, "Cache-Control": "private, no-cache"})
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the client's If-None-Match already names this ETag (weak comparison)"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+def versioned_etag(*collections: str):
+    """
+    Route dependency for read endpoints whose payload only changes when `collections` are
+    written. The ETag also covers the caller's role/branch and the query string, since
+    those select what the endpoint returns.
+    """
+    async def check(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+        scope = f"{current_user.role}|{current_user.branch_id}|{sorted(request.query_params.multi_items())}"
+        etag = await collection_versions.etag(collections, scope)
+        if etag_matches(request, etag):
+            raise NotModified(etag)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+    return check
+
+# Idempotency keys (idempotency_keys collection)
+# The first request with a given Idempotency-Key claims the key; client retries with the
+# same key get its response replayed instead of creating duplicate transactions. The owner
+# renews its claim every IDEMPOTENCY_HEARTBEAT_SECONDS, so only a claim whose worker died
+# goes stale and can be taken over. The handler gets a before_write() callback and calls it
+# right before its first write: it checks the claim is still ours and marks the key as
+# written, after which the request is never run again. The response is stored only once
+# every write (cashbook, stats, alerts) has succeeded; a request that fails after writing
+# is recorded as failed, so a retry reports that instead of replaying success or writing twice.
+
+async def skip_before_write():
+    pass
+
+async def run_idempotent(idempotency_key: Optional[str], user_id: str, endpoint: str, payload: BaseModel, handler, response: Response):
+    """Run handler(before_write) at most once per (user, Idempotency-Key) and replay its stored result"""
+    if not idempotency_key:
+        return await handler(skip_before_write)
+    
+    request_hash = hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+    record_filter = {"user_id": user_id, "key": idempotency_key}
+    owner = str(uuid.uuid4())
+    
+    for _ in range(IDEMPOTENCY_CLAIM_ATTEMPTS):
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({
+                **record_filter,
+                "endpoint": endpoint,
+                "request_hash": request_hash,
+                "status": "in_progress",
+                "owner": owner,
+                "created_at": now,
+                "heartbeat_at": now,
+                "expires_at": now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+            })
+            break
+        except DuplicateKeyError:
+            pass
+        existing = await db.idempotency_keys.find_one(record_filter, {"_id": 0})
+        if not existing:
+            continue  # expired between insert and lookup - claim it again
+        if existing["endpoint"] != endpoint or existing["request_hash"] != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key sudah dipakai untuk request yang berbeda")
+        if existing["status"] == "completed":
+            response.headers["Idempotent-Replayed"] = "true"
+            return existing["response"]
+        if existing["status"] == "failed" or existing.get("written_at"):
+            raise HTTPException(
+                status_code=409,
+                detail="Request dengan Idempotency-Key ini gagal setelah transaksi disimpan - "
+                       "periksa data transaksi sebelum mengulang dengan key baru"
+            )
+        # Still in progress - unless its worker died (no heartbeat), then this request takes the key over
+        taken_over = await db.idempotency_keys.find_one_and_update(
+            {**record_filter, "status": "in_progress", "written_at": {"$exists": False},
+             "heartbeat_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_STALE_SECONDS)}},
+            {"$set": {"owner": owner, "heartbeat_at": now}}
+        )
+        if taken_over:
+            break
+        # Retry-After tells the client to retry with the same key
+        raise HTTPException(
+            status_code=409,
+            detail="Request dengan Idempotency-Key ini masih diproses",
+            headers={"Retry-After": "2"}
+        )
+    else:
+        raise HTTPException(status_code=409, detail="Request dengan Idempotency-Key ini masih diproses",
+                            headers={"Retry-After": "2"})
+    
+    owned_filter = {**record_filter, "owner": owner}
+    written = False
+    
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_HEARTBEAT_SECONDS)
+            await db.idempotency_keys.update_one(owned_filter, {"$set": {"heartbeat_at": datetime.now(timezone.utc)}})
+    
+    async def before_write():
+        nonlocal written
+        claimed = await db.idempotency_keys.find_one_and_update(
+            {**owned_filter, "status": "in_progress", "written_at": {"$exists": False}},
+            {"$set": {"written_at": datetime.now(timezone.utc)}}
+        )
+        if not claimed:
+            raise HTTPException(status_code=409, detail="Idempotency-Key ini sudah diambil alih oleh request lain")
+        written = True
+    
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        result = await handler(before_write)
+    except Exception as e:
+        if written:
+            # Something is stored - never run this request again, report the failure instead
+            await db.idempotency_keys.update_one(
+                owned_filter, {"$set": {"status": "failed", "error": str(getattr(e, "detail", e))}}
+            )
+        else:
+            # Nothing stored - the request may be retried with the same key
+            await db.idempotency_keys.delete_one(owned_filter)
+        raise
+    finally:
+        heartbeat_task.cancel()
+    
+    await db.idempotency_keys.update_one(
+        owned_filter,
+        {"$set": {"status": "completed", "response": jsonable_encoder(result)}}
+    )
+    return result
+
+# Customer search helpers
+CUSTOMER_SEARCH_FIELDS = ["name", "entity_name", "identity_number", "customer_code", "phone"]
+CUSTOMER_SEARCH_MAX_LIMIT = 50
+
+def normalize_search_text(value) -> str:
+    """Lowercase and drop everything except letters/digits ("0812-3456" -> "08123456")"""
+    if value is None:
+        return ""
+    return re.sub(r"[^0-9a-z]", "", str(value).lower())
+
+def build_customer_search_keys(customer: dict) -> List[str]:
+    """
+    Build normalized prefix keys for customer lookup, stored in customers.search_keys.
+    Each searchable field contributes its full normalized value plus every word,
+    so "Budi Santoso" can be found by "budi", "budisan" or "santo".
+    """
+    keys = set()
+    for field in CUSTOMER_SEARCH_FIELDS:
+        value = customer.get(field)
+        if not value:
+            continue
+        full = normalize_search_text(value)
+        if full:
+            keys.add(full)
+        for word in str(value).split():
+            token = normalize_search_text(word)
+            if token:
+                keys.add(token)
+    return sorted(keys)
+
+def normalize_datetime(value):
+    """Convert a stored date (datetime or ISO string) to a naive datetime, or None"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None) if value.tzinfo is not None else value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+def build_date_range_filter(field: str, start_dt: Optional[datetime] = None, end_dt: Optional[datetime] = None) -> dict:
+    """
+    Mongo filter for a naive [start_dt, end_dt] range on a date field that may be stored
+    either as datetime or (legacy) ISO string. Both branches can use an index on the field.
+    """
+    dt_range = {}
+    str_range = {}
+    if start_dt:
+        dt_range["$gte"] = start_dt
+        str_range["$gte"] = start_dt.isoformat()
+    if end_dt:
+        dt_range["$lte"] = end_dt
+        str_range["$lte"] = end_dt.isoformat()
+    if not dt_range:
+        return {}
+    return {"$or": [{field: dt_range}, {field: str_range}]}
+
+# Customer statistics (customer_stats collection)
+# One document per customer per calendar year, maintained on transaction writes:
+# {customer_id, year, total_buy_idr, total_sell_idr, total_transactions, last_transaction_date}
+# Writes only ever apply atomic $inc deltas. History from before the stats existed is
+# filled in by the customer stats rebuild job, never from the write path.
+
+def typed_date_range_filters(field: str, start_dt: Optional[datetime] = None, end_dt: Optional[datetime] = None) -> list:
+    """
+    The datetime and the (legacy) ISO string halves of a date range as two filters.
+    Mongo sorts the two BSON types separately, so ordered reads query each on its own.
+    """
+    dt_range = {"$type": "date"}
+    str_range = {"$type": "string"}
+    if start_dt:
+        dt_range["$gte"] = start_dt
+        str_range["$gte"] = start_dt.isoformat()
+    if end_dt:
+        dt_range["$lte"] = end_dt
+        str_range["$lte"] = end_dt.isoformat()
+    return [{field: dt_range}, {field: str_range}]
+
+async def find_newest_first(collection, query: dict, field: str, projection: dict, skip: int, limit: int,
+                            start_dt: Optional[datetime] = None, end_dt: Optional[datetime] = None) -> list:
+    """
+    One page of documents ordered newest first by a date field holding datetimes and
+    ISO strings: the first skip+limit of each type are merged in Python.
+    """
+    window = skip + limit
+    documents = []
+    for date_filter in typed_date_range_filters(field, start_dt, end_dt):
+        documents += await collection.find({**query, **date_filter}, projection).sort(
+            field, -1
+        ).limit(window).to_list(window)
+    documents.sort(key=lambda doc: normalize_datetime(doc.get(field)) or datetime.min, reverse=True)
+    return documents[skip:window]
+
+async def apply_customer_stats_changes(added: tuple = (), removed: tuple = ()):
+    """
+    Add created/updated transactions to, and remove updated/deleted ones from, their
+    customers' yearly stats: one atomic upsert $inc per customer/year with the net change.
+    """
+    changes = {}
+    for sign, transactions in ((1, added), (-1, removed)):
+        for txn in transactions:
+            txn_date = normalize_datetime(txn.get("transaction_date"))
+            if not txn.get("customer_id") or not txn_date or txn.get("is_deleted"):
+                continue
+            change = changes.setdefault((txn["customer_id"], txn_date.year), {
+                "buy_units": 0, "sell_units": 0, "count": 0, "latest": None, "removed": False
+            })
+            units = doc_minor(txn, "total_idr") * sign
+            if txn.get("transaction_type") in ["beli", "buy"]:
+                change["buy_units"] += units
+            elif txn.get("transaction_type") in ["jual", "sell"]:
+                change["sell_units"] += units
+            change["count"] += sign
+            if sign > 0:
+                change["latest"] = max(change["latest"] or txn_date, txn_date)
+            else:
+                change["removed"] = True
+    
+    for (customer_id, year), change in changes.items():
+        stats_filter = {"customer_id": customer_id, "year": year}
+        update = {
+            "$inc": {
+                "total_buy_idr": from_minor(change["buy_units"]),
+                "total_sell_idr": from_minor(change["sell_units"]),
+                "total_transactions": change["count"]
+            },
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        }
+        if change["latest"] and not change["removed"]:
+            update["$max"] = {"last_transaction_date": change["latest"]}
+        try:
+            await db.customer_stats.update_one(stats_filter, update, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent first write for this customer/year won the upsert - the document exists now
+            await db.customer_stats.update_one(stats_filter, update, upsert=True)
+        
+        if change["removed"]:
+            # $max cannot move last_transaction_date back - read the newest remaining transaction
+            newest = await find_newest_first(
+                db.transactions, {"customer_id": customer_id, "is_deleted": {"$ne": True}}, "transaction_date",
+                {"_id": 0, "transaction_date": 1}, 0, 1,
+                datetime(year, 1, 1), datetime(year, 12, 31, 23, 59, 59, 999999)
+            )
+            await db.customer_stats.update_one(stats_filter, {"$set": {
+                "last_transaction_date": normalize_datetime(newest[0]["transaction_date"]) if newest else None
+            }})
+
+async def record_customer_stats(transaction: dict):
+    """Add a newly created transaction to its customer's yearly stats in O(1)"""
+    await apply_customer_stats_changes(added=(transaction,))
+
+async def rebuild_customer_stats() -> dict:
+    """
+    Recompute every customer's yearly stats from the transactions (backfill for data
+    written before the stats existed, or repair after manual changes). Transactions
+    written while the rebuild runs may be counted from a stale read, so run it when the
+    branches are quiet.
+    """
+    rebuilt_at = datetime.now(timezone.utc).isoformat()
+    totals = {}
+    async for txn in db.transactions.find(
+        {"is_deleted": {"$ne": True}},
+        {"_id": 0, "customer_id": 1, "transaction_type": 1, "transaction_date": 1, "total_idr": 1, "total_idr_minor": 1}
+    ):
+        txn_date = normalize_datetime(txn.get("transaction_date"))
+        if not txn.get("customer_id") or not txn_date:
+            continue
+        stats = totals.setdefault((txn["customer_id"], txn_date.year), {
+            "buy_units": 0, "sell_units": 0, "count": 0, "latest": txn_date
+        })
+        if txn.get("transaction_type") in ["beli", "buy"]:
+            stats["buy_units"] += doc_minor(txn, "total_idr")
+        elif txn.get("transaction_type") in ["jual", "sell"]:
+            stats["sell_units"] += doc_minor(txn, "total_idr")
+        stats["count"] += 1
+        stats["latest"] = max(stats["latest"], txn_date)
+    
+    operations = []
+    for (customer_id, year), stats in totals.items():
+        operations.append(UpdateOne(
+            {"customer_id": customer_id, "year": year},
+            {"$set": {
+                "total_buy_idr": from_minor(stats["buy_units"]),
+                "total_sell_idr": from_minor(stats["sell_units"]),
+                "total_transactions": stats["count"],
+                "last_transaction_date": stats["latest"],
+                "updated_at": rebuilt_at
+            }},
+            upsert=True
+        ))
+        if len(operations) >= 1000:
+            await db.customer_stats.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.customer_stats.bulk_write(operations, ordered=False)
+    
+    reset = await db.customer_stats.update_many(
+        {"updated_at": {"$lt": rebuilt_at}},
+        {"$set": {"total_buy_idr": 0.0, "total_sell_idr": 0.0, "total_transactions": 0,
+                  "last_transaction_date": None, "updated_at": rebuilt_at}}
+    )
+    return {"stats_rebuilt": len(totals), "stats_reset": reset.modified_count}
+
+async def run_customer_stats_job(job_id: str):
+    await update_job(job_id, status="running")
+    try:
+        result = await rebuild_customer_stats()
+        await update_job(job_id, status="completed", result=result)
+        logger.info(f"Rebuilt customer stats: {result}")
+    except Exception as e:
+        logging.error(f"Customer stats rebuild failed: {e}")
+        await update_job(job_id, status="failed", error=str(e))
+
+async def start_customer_stats_job(current_user: Optional[User] = None) -> dict:
+    active = await find_active_job("customer_stats_rebuild", CUSTOMER_STATS_JOB_TIMEOUT_MINUTES)
+    if active:
+        return active
+    job = await create_job("customer_stats_rebuild", current_user)
+    start_background_task(run_customer_stats_job(job["id"]))
+    return job
+
+# In-process pub/sub for the /events/stream SSE channel
+
+class EventBroker:
+    """Fan out events to connected SSE clients, scoped by branch like the REST endpoints"""
+    
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = {}  # queue -> (branch_id, is_admin); admins see every branch
+    
+    def subscribe(self, branch_id: Optional[str], is_admin: bool) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._subscribers[queue] = (branch_id, is_admin)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+    
+    def publish(self, event: str, data: dict, branch_id: Optional[str] = None, admin_only: bool = False,
+                broadcast: bool = False):
+        """
+        Deliver to admins and to the subscribers of branch_id. An event without a branch
+        reaches admins only, unless it is published with broadcast=True (meant for everyone).
+        """
+        for queue, (sub_branch_id, is_admin) in list(self._subscribers.items()):
+            if not is_admin:
+                if admin_only:
+                    continue
+                if not broadcast and (branch_id is None or sub_branch_id != branch_id):
+                    continue
+            try:
+                queue.put_nowait({"event": event, "data": data})
+            except asyncio.QueueFull:
+                # Slow client - drop the event rather than block the writer
+                logging.warning(f"SSE queue full, dropping {event} event")
+    
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+event_broker = EventBroker()
+
+def alert_cursor(alert: dict) -> str:
+    """
+    Feed cursor (created_at, id) of an alert: UTC to the millisecond Mongo stores, so
+    cursors compare in order as plain strings
+    """
+    created_at = alert["created_at"]
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return f"{created_at.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]}Z|{alert['id']}"
+
+def parse_alert_cursor(cursor: str) -> tuple:
+    """(created_at, id) of a feed cursor - 400 if it is not one"""
+    try:
+        created_at, alert_id = cursor.split("|", 1)
+        return datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S.%fZ'), alert_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid notification cursor")
+
+def alert_to_notification(alert: dict) -> dict:
+    """Shape an alerts document as a notification feed item"""
+    created_at = alert.get("created_at")
+    if isinstance(created_at, datetime) and created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return {
+        "id": alert["id"],
+        "cursor": alert_cursor(alert),
+        "type": alert["type"],
+        "title": alert["title"],
+        "message": alert["message"],
+        "transaction_id": alert.get("transaction_id"),
+        "amount": alert.get("amount"),
+        "timestamp": created_at.isoformat() if isinstance(created_at, datetime) else created_at
+    }
+
+def publish_transaction_created(transaction: dict):
+    """Dashboard delta for a new transaction (skipped when the change stream publishes instead)"""
+    if EVENT_SOURCE == "change_stream":
+        return
+    event_broker.publish(
+        "transaction_created",
+        {k: v for k, v in transaction.items() if k != "_id"},
+        branch_id=transaction.get("branch_id")
+    )
+
+def publish_transaction_changed(event: str, transaction: dict):
+    """transaction_updated / transaction_deleted - the dashboard re-reads its stats"""
+    if EVENT_SOURCE == "change_stream":
+        return
+    event_broker.publish(
+        event,
+        {"id": transaction.get("id"), "branch_id": transaction.get("branch_id")},
+        branch_id=transaction.get("branch_id")
+    )
+
+def publish_activity_logged(count: int):
+    """New activity log entries were written (admin activity view re-reads the log)"""
+    if EVENT_SOURCE == "change_stream":
+        return
+    event_broker.publish("activity_logged", {"count": count}, admin_only=True)
+
+def publish_notification(alert: dict):
+    """Push a freshly inserted alert to the notification bell"""
+    if EVENT_SOURCE == "change_stream":
+        return
+    event_broker.publish("notification", alert_to_notification(alert), branch_id=alert.get("branch_id"))
+
+def publish_notification_retracted(alert: dict):
+    """Tell open notification bells to drop an alert whose transaction was deleted"""
+    if EVENT_SOURCE == "change_stream":
+        return
+    event_broker.publish("notification_retracted", {"id": alert["id"]}, branch_id=alert.get("branch_id"))
+
+def publish_user_online(user: dict):
+    """Online-status delta after a login (admin only, like /users/online-status)"""
+    if EVENT_SOURCE == "change_stream":
+        return
+    event_broker.publish("user_online", {
+        "id": user["id"],
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "role": user.get("role"),
+        "last_login": user.get("last_login")
+    }, admin_only=True)
+
+async def watch_change_stream_events():
+    """
+    Publish SSE events from MongoDB change streams so every worker sees every write.
+    """
+    pipeline = [{"$match": {
+        "$or": [
+            {"ns.coll": {"$in": ["transactions", "alerts", "user_activity_logs"]}, "operationType": "insert"},
+            {"ns.coll": "transactions", "operationType": {"$in": ["update", "delete"]}},
+            {"ns.coll": "alerts", "operationType": "update", "updateDescription.updatedFields.retracted_at": {"$exists": True}},
+            {"ns.coll": "users", "operationType": "update", "updateDescription.updatedFields.last_login": {"$exists": True}}
+        ]
+    }}]
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    document = change.get("fullDocument") or {}
+                    collection = change["ns"]["coll"]
+                    if collection == "transactions" and change["operationType"] != "insert":
+                        deleted = change["operationType"] == "delete" or document.get("is_deleted")
+                        event_broker.publish(
+                            "transaction_deleted" if deleted else "transaction_updated",
+                            {"id": document.get("id"), "branch_id": document.get("branch_id")},
+                            branch_id=document.get("branch_id")
+                        )
+                    elif collection == "user_activity_logs":
+                        event_broker.publish("activity_logged", {"count": 1}, admin_only=True)
+                    elif collection == "transactions":
+                        event_broker.publish(
+                            "transaction_created",
+                            {k: v for k, v in document.items() if k != "_id"},
+                            branch_id=document.get("branch_id")
+                        )
+                    elif collection == "alerts" and change["operationType"] == "update":
+                        event_broker.publish("notification_retracted", {"id": document.get("id")}, branch_id=document.get("branch_id"))
+                    elif collection == "alerts":
+                        event_broker.publish("notification", alert_to_notification(document), branch_id=document.get("branch_id"))
+                    elif collection == "users" and document:
+                        event_broker.publish("user_online", {
+                            "id": document["id"],
+                            "name": document.get("name"),
+                            "email": document.get("email"),
+                            "role": document.get("role"),
+                            "last_login": document.get("last_login")
+                        }, admin_only=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Change stream error, retrying in 5s: {e}")
+            await asyncio.sleep(5)
+
+# Alerts collection - notification feed written once at transaction time.
+# Transient alerts carry expires_at (TTL index); compliance alerts have none and are kept.
+
+def build_large_transaction_alert(transaction: dict, now: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "type": "large_transaction",
+        "title": "Transaksi Besar",
+        "message": f"Transaksi {transaction.get('currency_code')} senilai {transaction['total_idr']:,.0f} IDR oleh {transaction.get('customer_name')}",
+        "customer_id": transaction.get("customer_id"),
+        "customer_name": transaction.get("customer_name"),
+        "branch_id": transaction.get("branch_id"),
+        "transaction_id": transaction.get("id"),
+        "amount": transaction["total_idr"],
+        "created_at": now,
+        "expires_at": now + timedelta(days=NOTIFICATION_RETENTION_DAYS)
+    }
+
+async def record_large_transaction_alerts(transactions: list) -> List[dict]:
+    """Write a large_transaction alert for each transaction at/above the threshold, in one insert"""
+    now = datetime.now(timezone.utc)
+    alerts = [
+        build_large_transaction_alert(transaction, now)
+        for transaction in transactions
+        if transaction.get("total_idr", 0) >= LARGE_TRANSACTION_THRESHOLD_IDR
+    ]
+    if not alerts:
+        return []
+    await db.alerts.insert_many(alerts)
+    for alert in alerts:
+        publish_notification(alert)
+        alert.pop("_id", None)
+    return alerts
+
+async def record_large_transaction_alert(transaction: dict):
+    """Write a large_transaction alert when a single transaction reaches the threshold"""
+    alerts = await record_large_transaction_alerts([transaction])
+    return alerts[0] if alerts else None
+
+async def retract_transaction_alerts(transaction_ids: list, alert_type: Optional[str] = None,
+                                     reason: str = "transaction_deleted") -> int:
+    """
+    Retract the alerts raised by deleted transactions (or only the alert_type ones, e.g. a
+    large_transaction alert of a transaction edited below the threshold): they are kept for
+    the audit trail with retracted_at set, and drop out of the notification feed and the AML report.
+    """
+    if not transaction_ids:
+        return 0
+    query = {"transaction_id": {"$in": transaction_ids}, "retracted_at": {"$exists": False}}
+    if alert_type:
+        query["type"] = alert_type
+    alerts = await db.alerts.find(query, {"_id": 0, "id": 1, "branch_id": 1}).to_list(None)
+    if not alerts:
+        return 0
+    await db.alerts.update_many(
+        {"id": {"$in": [alert["id"] for alert in alerts]}},
+        {"$set": {"retracted_at": datetime.now(timezone.utc), "retracted_reason": reason}}
+    )
+    for alert in alerts:
+        publish_notification_retracted(alert)
+    return len(alerts)
+
+# AML threshold monitor (customer_period_totals collection)
+# Running IDR totals per customer per WITA day and month, updated with one atomic
+# $inc per period on every transaction write - no history rescans.
+
+def get_aml_period_keys(txn_date) -> dict:
+    """Daily (YYYY-MM-DD) and monthly (YYYY-MM) period keys in WITA for a transaction date"""
+    if isinstance(txn_date, str):
+        txn_date = datetime.fromisoformat(txn_date.replace('Z', '+00:00'))
+    if txn_date.tzinfo is None:
+        txn_date = txn_date.replace(tzinfo=timezone.utc)
+    wita_date = txn_date.astimezone(WITA)
+    return {
+        "daily": wita_date.strftime('%Y-%m-%d'),
+        "monthly": wita_date.strftime('%Y-%m')
+    }
+
+async def apply_customer_threshold_changes(added: tuple = (), removed: tuple = ()) -> List[dict]:
+    """
+    Add created/updated transactions to, and remove updated/deleted ones from, their
+    customers' daily and monthly totals: one atomic $inc per period with the net change,
+    so an edit never dips a total below its threshold and back. When a total moves
+    across its AML threshold, an alert is written to the alerts collection and returned.
+    """
+    changes = {}
+    for sign, transactions in ((1, added), (-1, removed)):
+        for txn in transactions:
+            if not txn.get("customer_id") or not txn.get("transaction_date") or txn.get("is_deleted"):
+                continue
+            for period_type, period_key in get_aml_period_keys(txn["transaction_date"]).items():
+                change = changes.setdefault((txn["customer_id"], period_type, period_key), {
+                    "units": 0, "count": 0, "transaction": txn
+                })
+                change["units"] += doc_minor(txn, "total_idr") * sign
+                change["count"] += sign
+                if sign > 0:
+                    change["transaction"] = txn  # alerts point at the transaction that moved the total
+    
+    alerts = []
+    for (customer_id, period_type, period_key), change in changes.items():
+        if change["units"] == 0 and change["count"] == 0:
+            continue
+        transaction = change["transaction"]
+        amount = from_minor(change["units"])
+        period_filter = {"customer_id": customer_id, "period_type": period_type, "period_key": period_key}
+        update = {
+            "$inc": {"total_idr": amount, "transaction_count": change["count"]},
+            "$setOnInsert": {
+                "branch_id": transaction.get("branch_id"),
+                "customer_name": transaction.get("customer_name")
+            }
+        }
+        try:
+            before = await db.customer_period_totals.find_one_and_update(
+                period_filter, update, projection={"_id": 0, "total_idr": 1},
+                upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent first write to this period won the upsert - the document exists now
+            before = await db.customer_period_totals.find_one_and_update(
+                period_filter, update, projection={"_id": 0, "total_idr": 1},
+                upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        previous_total = before.get("total_idr", 0) if before else 0
+        new_total = previous_total + amount
+        threshold = AML_THRESHOLDS_IDR[period_type]
+        
+        if previous_total < threshold <= new_total:
+            period_label = "harian" if period_type == "daily" else "bulanan"
+            alert = {
+                "id": str(uuid.uuid4()),
+                "type": f"customer_threshold_{period_type}",
+                "title": f"Ambang Batas {period_label.capitalize()} Nasabah",
+                "message": f"Total transaksi {period_label} {transaction.get('customer_name', '')} "
+                           f"({period_key}) mencapai {new_total:,.0f} IDR, melewati batas {threshold:,.0f} IDR",
+                "customer_id": customer_id,
+                "customer_name": transaction.get("customer_name"),
+                "branch_id": transaction.get("branch_id"),
+                "transaction_id": transaction.get("id"),
+                "period_type": period_type,
+                "period_key": period_key,
+                "threshold_idr": threshold,
+                "amount": new_total,
+                "created_at": datetime.now(timezone.utc)
+            }
+            await db.alerts.insert_one(alert)
+            publish_notification(alert)
+            alert.pop("_id", None)
+            alerts.append(alert)
+    
+    return alerts
+
+async def track_customer_thresholds(transaction: dict, sign: int = 1) -> List[dict]:
+    """Add (sign=1) or remove (sign=-1) one transaction from its customer's period totals"""
+    if sign > 0:
+        return await apply_customer_threshold_changes(added=(transaction,))
+    return await apply_customer_threshold_changes(removed=(transaction,))
+
+async def rebuild_customer_period_totals() -> dict:
+    """
+    Recompute every customer's daily and monthly totals from the transactions (backfill
+    for data written before the monitor existed, or repair after manual changes).
+    Periods that no longer have transactions are reset to 0. Transactions written while
+    the rebuild runs may be counted from a stale read, so run it when the branches are quiet.
+    """
+    rebuilt_at = datetime.now(timezone.utc)
+    totals = {}
+    async for txn in db.transactions.find(
+        {"is_deleted": {"$ne": True}},
+        {"_id": 0, "customer_id": 1, "customer_name": 1, "branch_id": 1, "transaction_date": 1,
+         "total_idr": 1, "total_idr_minor": 1}
+    ):
+        if not txn.get("customer_id") or not txn.get("transaction_date"):
+            continue
+        try:
+            period_keys = get_aml_period_keys(txn["transaction_date"])
+        except ValueError:
+            continue
+        for period_type, period_key in period_keys.items():
+            period = totals.setdefault((txn["customer_id"], period_type, period_key), {
+                "units": 0,
+                "transaction_count": 0,
+                "branch_id": txn.get("branch_id"),
+                "customer_name": txn.get("customer_name")
+            })
+            period["units"] += doc_minor(txn, "total_idr")
+            period["transaction_count"] += 1
+    
+    operations = []
+    for (customer_id, period_type, period_key), period in totals.items():
+        operations.append(UpdateOne(
+            {"customer_id": customer_id, "period_type": period_type, "period_key": period_key},
+            {"$set": {
+                "total_idr": from_minor(period["units"]),
+                "transaction_count": period["transaction_count"],
+                "rebuilt_at": rebuilt_at
+            }, "$setOnInsert": {"branch_id": period["branch_id"], "customer_name": period["customer_name"]}},
+            upsert=True
+        ))
+        if len(operations) >= 1000:
+            await db.customer_period_totals.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.customer_period_totals.bulk_write(operations, ordered=False)
+    
+    reset = await db.customer_period_totals.update_many(
+        {"rebuilt_at": {"$ne": rebuilt_at}},
+        {"$set": {"total_idr": 0.0, "transaction_count": 0, "rebuilt_at": rebuilt_at}}
+    )
+    return {"periods_rebuilt": len(totals), "periods_reset": reset.modified_count}
+
+async def run_customer_period_totals_job(job_id: str):
+    await update_job(job_id, status="running")
+    try:
+        result = await rebuild_customer_period_totals()
+        await update_job(job_id, status="completed", result=result)
+        logger.info(f"Rebuilt customer period totals: {result}")
+    except Exception as e:
+        logging.error(f"Customer period totals rebuild failed: {e}")
+        await update_job(job_id, status="failed", error=str(e))
+
+async def start_customer_period_totals_job(current_user: Optional[User] = None) -> dict:
+    active = await find_active_job("customer_period_totals_rebuild", CUSTOMER_PERIOD_TOTALS_JOB_TIMEOUT_MINUTES)
+    if active:
+        return active
+    job = await create_job("customer_period_totals_rebuild", current_user)
+    start_background_task(run_customer_period_totals_job(job["id"]))
+    return job
 
 # Helper function to get SIPESAT period dates
 def get_sipesat_period_dates(year: int, period: int):
@@ -588,10 +1868,13 @@ async def login(credentials: UserLogin):
     )
     
     # Update last login time
+    user["last_login"] = datetime.now(timezone.utc).isoformat()
     await db.users.update_one(
         {"id": user["id"]},
-        {"$set": {"last_login": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"last_login": user["last_login"]}}
     )
+    presence.invalidate()
+    publish_user_online(user)
     
     user_obj = User(**user)
     return {"token": token, "user": user_obj}
@@ -616,9 +1899,10 @@ async def create_branch(branch_data: BranchCreate, current_user: User = Depends(
     branch_dict["created_at"] = branch_dict["created_at"].isoformat()
     
     await db.branches.insert_one(branch_dict)
+    await collection_versions.bump("branches")
     return branch
 
-@api_router.get("/branches", response_model=List[Branch])
+@api_router.get("/branches", response_model=List[Branch], dependencies=[Depends(versioned_etag("branches"))])
 async def get_branches(current_user: User = Depends(get_current_user)):
     branches = await db.branches.find({"is_active": True}, {"_id": 0}).to_list(1000)
     for branch in branches:
@@ -635,6 +1919,7 @@ async def update_branch(branch_id: str, branch_data: BranchCreate, current_user:
         {"id": branch_id},
         {"$set": branch_data.model_dump()}
     )
+    await collection_versions.bump("branches")
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Branch not found")
@@ -650,6 +1935,7 @@ async def delete_branch(branch_id: str, current_user: User = Depends(get_current
         raise HTTPException(status_code=403, detail="Only admin can delete branches")
     
     result = await db.branches.update_one({"id": branch_id}, {"$set": {"is_active": False}})
+    await collection_versions.bump("branches")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Branch not found")
     return {"message": "Branch deleted successfully"}
@@ -666,9 +1952,10 @@ async def create_currency(currency_data: CurrencyCreate, current_user: User = De
     currency_dict["created_at"] = currency_dict["created_at"].isoformat()
     
     await db.currencies.insert_one(currency_dict)
+    await collection_versions.bump("currencies")
     return currency
 
-@api_router.get("/currencies", response_model=List[Currency])
+@api_router.get("/currencies", response_model=List[Currency], dependencies=[Depends(versioned_etag("currencies"))])
 async def get_currencies(current_user: User = Depends(get_current_user)):
     currencies = await db.currencies.find({"is_active": True}, {"_id": 0}).to_list(1000)
     for currency in currencies:
@@ -685,6 +1972,7 @@ async def update_currency(currency_id: str, currency_data: CurrencyCreate, curre
         {"id": currency_id},
         {"$set": currency_data.model_dump()}
     )
+    await collection_versions.bump("currencies")
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Currency not found")
@@ -700,6 +1988,7 @@ async def delete_currency(currency_id: str, current_user: User = Depends(get_cur
         raise HTTPException(status_code=403, detail="Only admin can delete currencies")
     
     result = await db.currencies.update_one({"id": currency_id}, {"$set": {"is_active": False}})
+    await collection_versions.bump("currencies")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Currency not found")
     return {"message": "Currency deleted successfully"}
@@ -714,12 +2003,20 @@ async def create_customer(customer_data: CustomerCreate, current_user: User = De
     customer = Customer(**customer_data.model_dump())
     customer_dict = customer.model_dump()
     customer_dict["created_at"] = customer_dict["created_at"].isoformat()
+    customer_dict["search_keys"] = build_customer_search_keys(customer_dict)
     
     await db.customers.insert_one(customer_dict)
+    await collection_versions.bump("customers")
     return customer
 
 @api_router.get("/customers", response_model=List[Customer])
-async def get_customers(current_user: User = Depends(get_current_user)):
+async def get_customers(fields: str = "full", current_user: User = Depends(get_current_user)):
+    """fields: projection profile - "full" (default) or "summary" (list columns only)"""
+    customers = await list_active_customers(current_user, fields)
+    return profile_list_response(Customer, customers, fields)
+
+async def list_active_customers(current_user: User, fields: str = "full") -> list:
+    projection = get_projection("customers", fields)
     query = {"is_active": {"$ne": False}}  # Only show active customers (soft delete support)
     
     # Role-based access: Admin sees all, Kasir/Teller only see their branch customers
@@ -727,12 +2024,48 @@ async def get_customers(current_user: User = Depends(get_current_user)):
         query["branch_id"] = current_user.branch_id
     
     # Sort by most recent first (for dropdown)
-    customers = await db.customers.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    customers = await db.customers.find(query, projection).sort("created_at", -1).to_list(1000)
     for customer in customers:
         if isinstance(customer.get("created_at"), str):
             customer["created_at"] = datetime.fromisoformat(customer["created_at"])
     return customers
 
+@api_router.get("/customers/search", response_model=List[Customer])
+async def search_customers(
+    q: Optional[str] = None,
+    limit: int = 10,
+    fields: str = "full",
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Teller lookup for the transaction form.
+    Matches the start of name, entity name, identity number, customer code or phone
+    (case/punctuation insensitive) through the indexed customers.search_keys field,
+    so cost depends on the result size, not on the total number of customers.
+    Without q, returns the most recently created customers.
+    fields: projection profile - "full" (default) or "summary".
+    """
+    limit = max(1, min(limit, CUSTOMER_SEARCH_MAX_LIMIT))
+    projection = get_projection("customers", fields)
+    
+    query = {"is_active": {"$ne": False}}
+    if current_user.role != UserRole.ADMIN:
+        query["branch_id"] = current_user.branch_id
+    
+    term = normalize_search_text(q)
+    if term:
+        # Anchored, case-sensitive regex on normalized keys = index range scan
+        query["search_keys"] = {"$regex": f"^{re.escape(term)}"}
+        cursor = db.customers.find(query, projection).limit(limit)
+    else:
+        cursor = db.customers.find(query, projection).sort("created_at", -1).limit(limit)
+    
+    customers = await cursor.to_list(limit)
+    for customer in customers:
+        if isinstance(customer.get("created_at"), str):
+            customer["created_at"] = datetime.fromisoformat(customer["created_at"])
+    return profile_list_response(Customer, customers, fields)
+
 @api_router.get("/customers/{customer_id}", response_model=Customer)
 async def get_customer(customer_id: str, current_user: User = Depends(get_current_user)):
     customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
@@ -755,10 +2088,14 @@ async def update_customer(customer_id: str, customer_data: CustomerCreate, curre
     if current_user.role != UserRole.ADMIN and existing["branch_id"] != current_user.branch_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
+    update_data = customer_data.model_dump()
+    update_data["search_keys"] = build_customer_search_keys({**existing, **update_data})
+    
     await db.customers.update_one(
         {"id": customer_id},
-        {"$set": customer_data.model_dump()}
+        {"$set": update_data}
     )
+    await collection_versions.bump("customers")
     
     updated = await db.customers.find_one({"id": customer_id}, {"_id": 0})
     if isinstance(updated.get("created_at"), str):
@@ -775,57 +2112,51 @@ async def delete_customer(customer_id: str, current_user: User = Depends(get_cur
         {"id": customer_id}, 
         {"$set": {"is_active": False, "deleted_at": datetime.now(timezone.utc).isoformat()}}
     )
+    await collection_versions.bump("customers")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
     return {"message": "Customer deleted successfully"}
 
 @api_router.get("/customers/{customer_id}/transactions")
-async def get_customer_transactions(customer_id: str, current_user: User = Depends(get_current_user)):
-    """Get all transactions for a specific customer (YTD view)"""
-    from datetime import datetime as dt
-    
-    customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+async def get_customer_transactions(
+    customer_id: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 100,
+    fields: str = "full",
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get a customer's transaction history (default: current year) one page at a time,
+    newest first, plus the YTD summary from customer_stats.
+    start_date / end_date: YYYY-MM-DD bounds for the history.
+    fields: projection profile for the transaction rows - "full" (default) or "summary".
+    """
+    projection = get_projection("transactions", fields)
+    customer = await db.customers.find_one({"id": customer_id}, {"_id": 0, "search_keys": 0})
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     if current_user.role != UserRole.ADMIN and customer["branch_id"] != current_user.branch_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Helper function to normalize transaction_date
-    def normalize_date(txn_date):
-        if txn_date is None:
-            return None
-        if isinstance(txn_date, dt):
-            if txn_date.tzinfo is not None:
-                return txn_date.replace(tzinfo=None)
-            return txn_date
-        if isinstance(txn_date, str):
-            try:
-                parsed = dt.fromisoformat(txn_date.replace('Z', '+00:00'))
-                return parsed.replace(tzinfo=None)
-            except:
-                return None
-        return None
+    page = max(1, page)
+    page_size = max(1, min(page_size, 500))
     
-    # Get current year start
     current_year = datetime.now(timezone.utc).year
-    year_start_dt = dt(current_year, 1, 1, 0, 0, 0)
-    
-    # Fetch all transactions for this customer (filter in Python to handle mixed date types)
-    all_transactions = await db.transactions.find(
-        {"customer_id": customer_id, "is_deleted": {"$ne": True}}, 
-        {"_id": 0}
-    ).to_list(10000)
+    try:
+        start_dt = datetime.fromisoformat(start_date + "T00:00:00") if start_date else datetime(current_year, 1, 1)
+        end_dt = datetime.fromisoformat(end_date + "T23:59:59") if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
-    # Filter transactions from current year
-    transactions = []
-    for txn in all_transactions:
-        txn_date = normalize_date(txn.get("transaction_date"))
-        if txn_date and txn_date >= year_start_dt:
-            transactions.append(txn)
+    query = {"customer_id": customer_id, "is_deleted": {"$ne": True}}
     
-    # Sort by transaction_date descending
-    transactions.sort(key=lambda x: normalize_date(x.get("transaction_date")) or dt.min, reverse=True)
+    total = await db.transactions.count_documents({**query, **build_date_range_filter("transaction_date", start_dt, end_dt)})
+    transactions = await find_newest_first(
+        db.transactions, query, "transaction_date", projection, (page - 1) * page_size, page_size, start_dt, end_dt
+    )
     
     # Normalize datetime fields for response
     for transaction in transactions:
@@ -834,25 +2165,44 @@ async def get_customer_transactions(customer_id: str, current_user: User = Depen
         if isinstance(transaction.get("transaction_date"), str):
             transaction["transaction_date"] = datetime.fromisoformat(transaction["transaction_date"].replace('Z', '+00:00'))
     
-    # Calculate YTD summary
-    total_buy = sum(t["total_idr"] for t in transactions if t.get("transaction_type") in ["beli", "buy"])
-    total_sell = sum(t["total_idr"] for t in transactions if t.get("transaction_type") in ["jual", "sell"])
+    # YTD summary from incrementally maintained stats (none yet: no transactions this year)
+    stats = await db.customer_stats.find_one({"customer_id": customer_id, "year": current_year}, {"_id": 0}) or {
+        "total_transactions": 0, "total_buy_idr": 0.0, "total_sell_idr": 0.0, "last_transaction_date": None
+    }
     
     return {
         "customer": customer,
         "transactions": transactions,
+        "pagination": {
+            "page": page,
+            "page_size": page_size,
+            "total": total,
+            "total_pages": (total + page_size - 1) // page_size
+        },
         "ytd_summary": {
-            "total_transactions": len(transactions),
-            "total_buy_idr": total_buy,
-            "total_sell_idr": total_sell,
-            "net_total_idr": total_sell - total_buy
+            "total_transactions": stats["total_transactions"],
+            "total_buy_idr": stats["total_buy_idr"],
+            "total_sell_idr": stats["total_sell_idr"],
+            "net_total_idr": stats["total_sell_idr"] - stats["total_buy_idr"],
+            "last_transaction_date": stats.get("last_transaction_date")
         }
     }
 
 # ============= TRANSACTION ENDPOINTS =============
 
 @api_router.post("/transactions", response_model=Transaction)
-async def create_transaction(transaction_data: TransactionCreate, current_user: User = Depends(get_current_user)):
+async def create_transaction(
+    transaction_data: TransactionCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
+    return await run_idempotent(
+        idempotency_key, current_user.id, "POST /transactions", transaction_data,
+        lambda before_write: create_single_transaction(transaction_data, current_user, before_write), response
+    )
+
+async def create_single_transaction(transaction_data: TransactionCreate, current_user: User, before_write=skip_before_write):
     customer = await db.customers.find_one({"id": transaction_data.customer_id}, {"_id": 0})
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -867,8 +2217,9 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
     
     if current_user.role != UserRole.ADMIN and customer["branch_id"] != current_user.branch_id:
         raise HTTPException(status_code=403, detail="Access denied")
+    await ensure_mutasi_days_unlocked(customer["branch_id"], transaction_data.transaction_date or datetime.now(timezone.utc))
     
-    total_idr = transaction_data.amount * transaction_data.exchange_rate
+    total_idr, total_idr_minor = compute_total_idr(transaction_data.amount, transaction_data.exchange_rate)
     
     # Get or generate customer code (MBA + 8 random digits)
     customer_code = customer.get("customer_code")
@@ -876,11 +2227,15 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
         # Generate new code for old customers
         import random
         customer_code = f"MBA{random.randint(10000000, 99999999)}"
-        # Update customer with new code
+        # Update customer with new code (and its search keys, so the code is searchable)
         await db.customers.update_one(
             {"id": transaction_data.customer_id},
-            {"$set": {"customer_code": customer_code}}
+            {"$set": {
+                "customer_code": customer_code,
+                "search_keys": build_customer_search_keys({**customer, "customer_code": customer_code})
+            }}
         )
+        await collection_versions.bump("customers")
     
     customer_name = customer.get("name") or customer.get("entity_name", "")
     
@@ -905,6 +2260,7 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
         amount=transaction_data.amount,
         exchange_rate=transaction_data.exchange_rate,
         total_idr=total_idr,
+        total_idr_minor=total_idr_minor,
         notes=transaction_data.notes,
         delivery_channel=transaction_data.delivery_channel,
         payment_method=transaction_data.payment_method,
@@ -918,6 +2274,7 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
     # Keep transaction_date as datetime object for proper MongoDB queries
     # MongoDB can store datetime natively and query comparisons work correctly
     
+    await before_write()
     await db.transactions.insert_one(transaction_dict)
     
     # Sell/Jual = Money receives IDR = DEBIT (cash in)
@@ -928,6 +2285,7 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
         date=transaction.transaction_date,
         entry_type=entry_type,
         amount=total_idr,
+        amount_minor=total_idr_minor,
         description=f"Transaction {transaction.transaction_number}",
         reference_type="transaction",
         reference_id=transaction.id
@@ -937,6 +2295,11 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
     # Keep date as datetime object for proper MongoDB queries
     await db.cashbook_entries.insert_one(cashbook_dict)
     
+    await record_customer_stats(transaction_dict)
+    await track_customer_thresholds(transaction_dict)
+    await record_large_transaction_alert(transaction_dict)
+    publish_transaction_created(transaction.model_dump(mode="json"))
+    
     return transaction
 
 @api_router.get("/transactions", response_model=List[Transaction])
@@ -946,10 +2309,14 @@ async def get_transactions(
     period_date: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    fields: str = "full",
     current_user: User = Depends(get_current_user)
 ):
+    """fields: projection profile - "full" (default) or "summary" (list columns only)"""
     from datetime import datetime as dt
     
+    projection = get_projection("transactions", fields)
+    
     # Helper function to normalize transaction_date for comparison
     def normalize_date(txn_date):
         if txn_date is None:
@@ -989,7 +2356,7 @@ async def get_transactions(
         base_query["currency_id"] = currency_id
     
     # Fetch all matching transactions
-    all_transactions = await db.transactions.find(base_query, {"_id": 0}).to_list(100000)
+    all_transactions = await db.transactions.find(base_query, projection).to_list(100000)
     
     # Filter by date in Python to handle mixed date formats
     filtered_transactions = []
@@ -1046,7 +2413,7 @@ async def get_transactions(
         if isinstance(transaction.get("transaction_date"), str):
             transaction["transaction_date"] = datetime.fromisoformat(transaction["transaction_date"].replace('Z', '+00:00'))
     
-    return filtered_transactions
+    return profile_list_response(Transaction, filtered_transactions, fields)
 
 @api_router.get("/transactions/{transaction_id}", response_model=Transaction)
 async def get_transaction(transaction_id: str, current_user: User = Depends(get_current_user)):
@@ -1071,6 +2438,7 @@ async def update_transaction(transaction_id: str, transaction_data: TransactionC
     existing = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Transaction not found")
+    await ensure_mutasi_days_unlocked(existing["branch_id"], existing.get("transaction_date"))
     
     # Get customer and currency info
     customer = await db.customers.find_one({"id": transaction_data.customer_id}, {"_id": 0})
@@ -1081,7 +2449,7 @@ async def update_transaction(transaction_id: str, transaction_data: TransactionC
     if not currency:
         raise HTTPException(status_code=404, detail="Currency not found")
     
-    total_idr = transaction_data.amount * transaction_data.exchange_rate
+    total_idr, total_idr_minor = compute_total_idr(transaction_data.amount, transaction_data.exchange_rate)
     customer_name = customer.get("name") or customer.get("entity_name", "")
     
     update_data = {
@@ -1094,6 +2462,7 @@ async def update_transaction(transaction_id: str, transaction_data: TransactionC
         "amount": transaction_data.amount,
         "exchange_rate": transaction_data.exchange_rate,
         "total_idr": total_idr,
+        "total_idr_minor": total_idr_minor,
         "notes": transaction_data.notes,
         "delivery_channel": transaction_data.delivery_channel,
         "payment_method": transaction_data.payment_method,
@@ -1117,6 +2486,7 @@ async def update_transaction(transaction_id: str, transaction_data: TransactionC
         # Update cashbook entry dengan data transaksi yang baru
         cashbook_update = {
             "amount": total_idr,
+            "amount_minor": total_idr_minor,
             "entry_type": entry_type
         }
         await db.cashbook_entries.update_one(
@@ -1125,6 +2495,18 @@ async def update_transaction(transaction_id: str, transaction_data: TransactionC
         )
     
     updated = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
+    await apply_customer_stats_changes(added=(updated,), removed=(existing,))
+    if not existing.get("is_deleted"):
+        await apply_customer_threshold_changes(added=(updated,), removed=(existing,))
+        # The single-transaction alert follows the edited total across the threshold either way
+        was_large = existing.get("total_idr", 0) >= LARGE_TRANSACTION_THRESHOLD_IDR
+        is_large = updated.get("total_idr", 0) >= LARGE_TRANSACTION_THRESHOLD_IDR
+        if is_large and not was_large:
+            await record_large_transaction_alert(updated)
+        elif was_large and not is_large:
+            await retract_transaction_alerts([transaction_id], "large_transaction", "transaction_edited")
+    publish_transaction_changed("transaction_updated", updated)
+    
     if isinstance(updated.get("created_at"), str):
         updated["created_at"] = datetime.fromisoformat(updated["created_at"])
     if isinstance(updated.get("transaction_date"), str):
@@ -1139,6 +2521,7 @@ async def delete_transaction(transaction_id: str, current_user: User = Depends(g
     existing = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Transaction not found")
+    await ensure_mutasi_days_unlocked(existing["branch_id"], existing.get("transaction_date"))
     
     # Soft delete - preserve transaction history for audit trail
     await db.transactions.update_one(
@@ -1152,91 +2535,53 @@ async def delete_transaction(transaction_id: str, current_user: User = Depends(g
         {"$set": {"is_deleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()}}
     )
     
+    await apply_customer_stats_changes(removed=(existing,))
+    if not existing.get("is_deleted"):
+        await track_customer_thresholds(existing, sign=-1)
+    await retract_transaction_alerts([transaction_id])
+    publish_transaction_changed("transaction_deleted", existing)
+    
     return {"message": "Transaction deleted successfully"}
 
 # ============= CASHBOOK ENDPOINTS =============
 
-@api_router.get("/cashbook")
-async def get_cashbook(
-    branch_id: Optional[str] = None, 
-    period_date: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
+async def fetch_cashbook_entries(query: dict, period_date: Optional[str]) -> tuple:
     """
-    Get cashbook entries for a specific period (day).
-    Opening balance = closing balance of previous day.
+    (entries, {branch_id: net minor units before the day}) for the cashbook entries matching
+    query. The day's range is part of the query for datetime and legacy ISO string dates alike;
+    earlier entries are only streamed for their amounts. Without period_date: every entry.
     """
-    from datetime import datetime as dt
-    
-    # Helper function to normalize date to datetime for comparison
-    def normalize_date(entry_date):
-        """Convert date to naive datetime object for comparison"""
-        if entry_date is None:
-            return None
-        if isinstance(entry_date, dt):
-            if entry_date.tzinfo is not None:
-                return entry_date.replace(tzinfo=None)
-            return entry_date
-        if isinstance(entry_date, str):
-            try:
-                parsed = dt.fromisoformat(entry_date.replace('Z', '+00:00'))
-                return parsed.replace(tzinfo=None)
-            except:
-                return None
-        return None
-    
-    target_branch_id = None
-    
-    if current_user.role != UserRole.ADMIN:
-        target_branch_id = current_user.branch_id
-    elif branch_id:
-        target_branch_id = branch_id
-    
-    # Fetch ALL cashbook entries for the branch and filter in Python
-    # This handles mixed date formats (datetime objects and ISO strings)
-    all_query = {"is_deleted": {"$ne": True}}
-    if target_branch_id:
-        all_query["branch_id"] = target_branch_id
-    
-    all_entries = await db.cashbook_entries.find(all_query, {"_id": 0}).to_list(10000)
-    
-    # Get initial opening balance from branch
-    initial_balance = 0.0
-    if target_branch_id:
-        branch_doc = await db.branches.find_one({"id": target_branch_id}, {"_id": 0})
-        if branch_doc:
-            initial_balance = branch_doc.get("opening_balance", 0.0)
-    
+    query = {"is_deleted": {"$ne": True}, **query}
+    if not period_date:
+        return await db.cashbook_entries.find(query, {"_id": 0}).to_list(None), {}
+    
+    period_start = datetime.fromisoformat(period_date + "T00:00:00")
+    period_end = datetime.fromisoformat(period_date + "T23:59:59")
+    entries = await db.cashbook_entries.find(
+        {**query, **build_date_range_filter("date", period_start, period_end)}, {"_id": 0}
+    ).to_list(None)
+    
+    previous = {}
+    earlier = {"$or": [{"date": {"$lt": period_start}}, {"date": {"$lt": period_start.isoformat()}}]}
+    async for entry in db.cashbook_entries.find(
+        {**query, **earlier}, {"_id": 0, "branch_id": 1, "entry_type": 1, "amount": 1, "amount_minor": 1}
+    ):
+        sign = {"debit": 1, "credit": -1}.get(entry.get("entry_type"), 0)
+        previous[entry.get("branch_id")] = previous.get(entry.get("branch_id"), 0) + sign * doc_minor(entry, "amount")
+    return entries, previous
+
+def summarize_cashbook(entries: list, initial_balance: float, previous_minor: int, period_date: Optional[str]) -> dict:
+    """Cashbook response for one day's entries; money totals come with their exact "<field>_minor" units"""
     if period_date:
-        # Parse period date boundaries
-        period_start = dt.fromisoformat(period_date + "T00:00:00")
-        period_end = dt.fromisoformat(period_date + "T23:59:59")
-        
-        # Filter entries for this period and calculate previous period totals
-        prev_entries = []
-        current_entries = []
-        
-        for entry in all_entries:
-            entry_date = normalize_date(entry.get("date"))
-            if entry_date:
-                if entry_date < period_start:
-                    prev_entries.append(entry)
-                elif period_start <= entry_date <= period_end:
-                    current_entries.append(entry)
-        
-        # Calculate opening balance from previous entries
-        prev_debit = sum(e["amount"] for e in prev_entries if e["entry_type"] == "debit")
-        prev_credit = sum(e["amount"] for e in prev_entries if e["entry_type"] == "credit")
-        opening_balance = initial_balance + prev_debit - prev_credit
-        
-        entries = current_entries
+        # Opening balance = branch opening balance + everything booked before the day (exact, in sen)
+        opening_minor = to_minor(initial_balance) + previous_minor
+        opening_balance = from_minor(opening_minor)
     else:
-        # No period filter - return all entries
+        opening_minor = to_minor(initial_balance)
         opening_balance = initial_balance
-        entries = all_entries
     
     # Sort entries by date
-    entries.sort(key=lambda x: normalize_date(x.get("date")) or dt.min)
+    entries.sort(key=lambda x: normalize_datetime(x.get("date")) or datetime.min)
     
     # Normalize datetime fields for JSON response
     for entry in entries:
@@ -1245,25 +2590,127 @@ async def get_cashbook(
         if isinstance(entry.get("date"), str):
             entry["date"] = datetime.fromisoformat(entry["date"].replace('Z', '+00:00'))
     
-    total_debit = sum(e["amount"] for e in entries if e["entry_type"] == "debit")
-    total_credit = sum(e["amount"] for e in entries if e["entry_type"] == "credit")
-    closing_balance = opening_balance + total_debit - total_credit
+    debit_minor = sum_minor([e for e in entries if e["entry_type"] == "debit"], "amount")
+    credit_minor = sum_minor([e for e in entries if e["entry_type"] == "credit"], "amount")
+    balance_minor = opening_minor + debit_minor - credit_minor
     
     return {
         "entries": entries,
         "opening_balance": opening_balance,
-        "total_debit": total_debit,
-        "total_credit": total_credit,
-        "balance": closing_balance,
+        "total_debit": from_minor(debit_minor),
+        "total_credit": from_minor(credit_minor),
+        "balance": from_minor(balance_minor),
+        "opening_balance_minor": opening_minor,
+        "total_debit_minor": debit_minor,
+        "total_credit_minor": credit_minor,
+        "balance_minor": balance_minor,
         "period_date": period_date
     }
 
+async def build_cashbook(target_branch_id: Optional[str], period_date: Optional[str]) -> dict:
+    """Cashbook of one branch (all branches mixed when target_branch_id is None) for a day"""
+    query = {"branch_id": target_branch_id} if target_branch_id else {}
+    entries, previous = await fetch_cashbook_entries(query, period_date)
+    
+    # Get initial opening balance from branch
+    initial_balance = 0.0
+    if target_branch_id:
+        branch_doc = await db.branches.find_one({"id": target_branch_id}, {"_id": 0, "opening_balance": 1})
+        if branch_doc:
+            initial_balance = branch_doc.get("opening_balance", 0.0)
+    
+    return summarize_cashbook(entries, initial_balance, sum(previous.values()), period_date)
+
+@api_router.get("/cashbook")
+async def get_cashbook(
+    branch_id: Optional[str] = None, 
+    period_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get cashbook entries for a specific period (day).
+    Opening balance = closing balance of previous day.
+    """
+    target_branch_id = None
+    
+    if current_user.role != UserRole.ADMIN:
+        target_branch_id = current_user.branch_id
+    elif branch_id:
+        target_branch_id = branch_id
+    
+    return FastJSONResponse(await build_cashbook(target_branch_id, period_date))
+
+async def gather_per_branch(branches: list, build) -> list:
+    """await build(branch) for every branch concurrently, at most CONSOLIDATED_BRANCH_CONCURRENCY at once"""
+    semaphore = asyncio.Semaphore(CONSOLIDATED_BRANCH_CONCURRENCY)
+    
+    async def run(branch):
+        async with semaphore:
+            return await build(branch)
+    
+    return await asyncio.gather(*(run(branch) for branch in branches))
+
+@api_router.get("/cashbook/consolidated")
+async def get_consolidated_cashbook(
+    period_date: Optional[str] = None,
+    include_entries: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Cashbook of every active branch for a day in one call (admin only): per-branch
+    opening/debit/credit/closing rows plus a total row. Entries only with include_entries=true.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admin can view consolidated reports")
+    
+    branches = await db.branches.find({"is_active": True}, {"_id": 0}).sort("code", 1).to_list(1000)
+    # One query for every branch's entries, split per branch here
+    entries, previous = await fetch_cashbook_entries({"branch_id": {"$in": [b["id"] for b in branches]}}, period_date)
+    entries_by_branch = {}
+    for entry in entries:
+        entries_by_branch.setdefault(entry["branch_id"], []).append(entry)
+    results = [
+        summarize_cashbook(
+            entries_by_branch.get(branch["id"], []), branch.get("opening_balance", 0.0),
+            previous.get(branch["id"], 0), period_date
+        )
+        for branch in branches
+    ]
+    
+    rows = []
+    for branch, cashbook in zip(branches, results):
+        row = {
+            "branch_id": branch["id"],
+            "branch_code": branch.get("code"),
+            "branch_name": branch.get("name"),
+            "opening_balance": cashbook["opening_balance"],
+            "total_debit": cashbook["total_debit"],
+            "total_credit": cashbook["total_credit"],
+            "balance": cashbook["balance"],
+            "entry_count": len(cashbook["entries"])
+        }
+        if include_entries:
+            row["entries"] = cashbook["entries"]
+        rows.append(row)
+    
+    total = {
+        field: from_minor(sum(cashbook[f"{field}_minor"] for cashbook in results))
+        for field in ("opening_balance", "total_debit", "total_credit", "balance")
+    }
+    total["entry_count"] = sum(row["entry_count"] for row in rows)
+    return FastJSONResponse({"period_date": period_date, "branches": rows, "total": total})
+
 @api_router.post("/cashbook", response_model=CashBookEntry)
 async def create_cashbook_entry(entry_data: CashBookEntryCreate, current_user: User = Depends(get_current_user)):
     if current_user.role != UserRole.ADMIN and entry_data.branch_id != current_user.branch_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    entry = CashBookEntry(**entry_data.model_dump(), date=datetime.now(timezone.utc))
+    amount_minor = to_minor(entry_data.amount)
+    entry = CashBookEntry(
+        **{**entry_data.model_dump(), "amount": from_minor(amount_minor)},
+        amount_minor=amount_minor,
+        date=datetime.now(timezone.utc)
+    )
     entry_dict = entry.model_dump()
     entry_dict["created_at"] = entry_dict["created_at"].isoformat()
     # Keep date as datetime object for proper MongoDB queries (don't convert to ISO string)
@@ -1297,7 +2744,8 @@ async def update_cashbook_entry(
         {"id": entry_id},
         {"$set": {
             "entry_type": entry_type,
-            "amount": amount,
+            "amount": from_minor(to_minor(amount)),
+            "amount_minor": to_minor(amount),
             "description": description,
             "updated_at": datetime.now(timezone.utc).isoformat()
         }}
@@ -1331,6 +2779,214 @@ async def delete_cashbook_entry(entry_id: str, current_user: User = Depends(get_
     
     return {"message": "Entry deleted successfully"}
 
+# ============= MUTASI VALAS KERNEL =============
+# Columnar mutasi math: transactions are loaded once into arrays (date, currency index,
+# buy/sell flags, amount, total_idr) and grouped with np.bincount into a bucket x currency
+# matrix, a bucket being one day or one report period. The stock formulas then run per
+# bucket on whole currency vectors. Amounts are summed as integer minor units (exact, see
+# MONEY section); Stock Akhir carried to the next day is booked to the sen, like snapshots.
+
+TXN_BUY_TYPES = ("beli", "buy")
+TXN_SELL_TYPES = ("jual", "sell")
+EPOCH_NAIVE = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+DAY_MICROSECONDS = 86400 * 1000000
+LAST_SECOND_MICROSECONDS = 86399 * 1000000  # the report day ends at 23:59:59
+NAT = np.datetime64("NaT", "us")
+MUTASI_KERNEL_FIELDS = (
+    "beginning_stock_valas", "beginning_stock_idr", "purchase_valas", "purchase_idr", "sale_valas", "sale_idr",
+    "ending_stock_valas", "ending_stock_idr", "avg_rate", "profit_loss"
+)
+MUTASI_TRANSACTION_PROJECTION = {
+    "_id": 0, "transaction_date": 1, "currency_code": 1, "transaction_type": 1,
+    "amount": 1, "amount_minor": 1, "total_idr": 1, "total_idr_minor": 1
+}
+
+def normalize_transaction_dates(values: list) -> np.ndarray:
+    """
+    Vectorized normalize_transaction_date: naive wall-clock datetime64[us] (any UTC offset
+    is dropped, not applied), NaT where the value is missing or unparseable.
+    """
+    result = np.full(len(values), NAT)
+    datetime_index, datetime_us, string_index, strings = [], [], [], []
+    for i, value in enumerate(values):
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.replace(tzinfo=None)
+            datetime_index.append(i)
+            datetime_us.append((value - EPOCH_NAIVE) // ONE_MICROSECOND)
+        elif isinstance(value, str):
+            if value.endswith("Z"):
+                value = value[:-1]
+            elif len(value) > 19 and value[-6] in "+-" and value[-3] == ":":
+                value = value[:-6]
+            string_index.append(i)
+            strings.append(value)
+    if datetime_index:
+        result[datetime_index] = np.array(datetime_us, dtype=np.int64).view("datetime64[us]")
+    if string_index:
+        try:
+            result[string_index] = np.array(strings, dtype="datetime64[us]")
+        except ValueError:
+            # At least one malformed string - parse one by one so only those become NaT
+            for i, value in zip(string_index, strings):
+                try:
+                    result[i] = np.datetime64(datetime.fromisoformat(value).replace(tzinfo=None), "us")
+                except ValueError:
+                    pass
+    return result
+
+def load_mutasi_columns(transactions: list, currency_codes: list) -> dict:
+    """Transaction dicts -> column arrays; currencies outside currency_codes get index -1"""
+    count = len(transactions)
+    index = {code: i for i, code in enumerate(currency_codes)}
+    types = [t.get("transaction_type") for t in transactions]
+    return {
+        "date": normalize_transaction_dates([t.get("transaction_date") for t in transactions]),
+        "currency": np.fromiter((index.get(t.get("currency_code"), -1) for t in transactions), np.int64, count),
+        "is_buy": np.fromiter((kind in TXN_BUY_TYPES for kind in types), bool, count),
+        "is_sell": np.fromiter((kind in TXN_SELL_TYPES for kind in types), bool, count),
+        "amount": minor_column(transactions, "amount"),
+        "total_idr": minor_column(transactions, "total_idr"),
+    }
+
+async def fetch_mutasi_columns(target_branch_id: Optional[str], currencies: list) -> dict:
+    """Column arrays of every non-deleted transaction of a branch (all branches when None)"""
+    # Fetch ALL transactions (no cap), only the kernel's fields; dates are normalized in the
+    # kernel to handle mixed formats (historical data may have inconsistent transaction_date types)
+    currency_codes = [currency["code"] for currency in currencies]
+    all_txn_query = {"is_deleted": {"$ne": True}, "currency_code": {"$in": currency_codes}}
+    if target_branch_id:
+        all_txn_query["branch_id"] = target_branch_id
+    
+    all_transactions = await db.transactions.find(all_txn_query, MUTASI_TRANSACTION_PROJECTION).to_list(None)
+    return load_mutasi_columns(all_transactions, currency_codes)
+
+def mutasi_bucket_sums(columns: dict, n_currencies: int, bucket: np.ndarray, n_buckets: int) -> dict:
+    """
+    Per bucket x currency purchase/sale valas and IDR plus transaction counts.
+    bucket holds each transaction's bucket number, -1 for transactions outside every bucket.
+    """
+    valid = (bucket >= 0) & (columns["currency"] >= 0)
+    cell = bucket * n_currencies + columns["currency"]
+    size = n_buckets * n_currencies
+    
+    def grouped(mask, minor_units=None):
+        if minor_units is None:
+            return np.bincount(cell[mask], minlength=size).reshape(n_buckets, n_currencies)
+        # Integer-valued weights: the sums are exact, converted back to units once
+        return np.bincount(cell[mask], weights=minor_units[mask], minlength=size).reshape(n_buckets, n_currencies) / MONEY_SCALE
+    
+    buy = valid & columns["is_buy"]
+    sell = valid & columns["is_sell"]
+    return {
+        "purchase_valas": grouped(buy, columns["amount"]),
+        "purchase_idr": grouped(buy, columns["total_idr"]),
+        "sale_valas": grouped(sell, columns["amount"]),
+        "sale_idr": grouped(sell, columns["total_idr"]),
+        "transaction_count": grouped(valid),
+    }
+
+def mutasi_opening_from_history(columns: dict, n_currencies: int, before: datetime) -> tuple:
+    """
+    Stock Awal from every transaction before `before` (currencies without a snapshot):
+    purchases minus sales, valued at the average purchase rate. Not clamped here.
+    """
+    bucket = np.where(columns["date"] < np.datetime64(before, "us"), 0, -1)
+    sums = mutasi_bucket_sums(columns, n_currencies, bucket, 1)
+    purchase_valas, purchase_idr = sums["purchase_valas"][0], sums["purchase_idr"][0]
+    ending_valas = purchase_valas - sums["sale_valas"][0]
+    avg_rate = np.divide(purchase_idr, purchase_valas, out=np.zeros(n_currencies), where=purchase_valas > 0)
+    return ending_valas, ending_valas * avg_rate
+
+def mutasi_step(opening_valas, opening_idr, purchase_valas, purchase_idr, sale_valas, sale_idr) -> dict:
+    """One bucket of the mutasi formulas for all currencies at once (see calculate_mutasi_valas)"""
+    negative_opening = opening_valas < 0
+    beginning_valas = np.where(negative_opening, 0.0, opening_valas)
+    beginning_idr = np.where(negative_opening | (opening_idr < 0), 0.0, opening_idr)
+    
+    ending_valas = np.maximum(beginning_valas + purchase_valas - sale_valas, 0.0)
+    valas_in = beginning_valas + purchase_valas
+    idr_in = beginning_idr + purchase_idr
+    avg_rate = np.divide(idr_in, valas_in, out=np.zeros_like(valas_in), where=valas_in > 0)
+    ending_idr = np.maximum(ending_valas * avg_rate, 0.0)
+    return {
+        "beginning_stock_valas": beginning_valas,
+        "beginning_stock_idr": beginning_idr,
+        "purchase_valas": purchase_valas,
+        "purchase_idr": purchase_idr,
+        "sale_valas": sale_valas,
+        "sale_idr": sale_idr,
+        "ending_stock_valas": ending_valas,
+        "ending_stock_idr": ending_idr,
+        "avg_rate": avg_rate,
+        "profit_loss": (ending_idr + sale_idr) - (beginning_idr + purchase_idr),
+    }
+
+def compute_mutasi_period(columns: dict, n_currencies: int, start: Optional[datetime], end: Optional[datetime],
+                          opening_valas: np.ndarray, opening_idr: np.ndarray) -> dict:
+    """Mutasi arrays for one period [start, end]; without both bounds every transaction counts"""
+    if start is not None and end is not None:
+        dates = columns["date"]
+        in_period = (dates >= np.datetime64(start, "us")) & (dates <= np.datetime64(end, "us"))
+        bucket = np.where(in_period, 0, -1)
+    else:
+        bucket = np.zeros(len(columns["currency"]), dtype=np.int64)
+    sums = mutasi_bucket_sums(columns, n_currencies, bucket, 1)
+    result = mutasi_step(
+        opening_valas, opening_idr,
+        sums["purchase_valas"][0], sums["purchase_idr"][0], sums["sale_valas"][0], sums["sale_idr"][0]
+    )
+    result["transaction_count"] = sums["transaction_count"][0]
+    return result
+
+def compute_mutasi_daily(columns: dict, n_currencies: int, first_day: datetime, days: int,
+                         opening_valas: Optional[np.ndarray] = None,
+                         opening_idr: Optional[np.ndarray] = None) -> dict:
+    """
+    Day x currency mutasi matrix for `days` consecutive days from first_day (00:00), with
+    Stock Awal of each day = Stock Akhir of the day before, as the daily snapshots chain
+    it (booked to the sen). Day one opens from the given arrays, or from history when none
+    are given. Same day window as the single-day report (00:00:00 - 23:59:59).
+    """
+    if opening_valas is None:
+        opening_valas, opening_idr = mutasi_opening_from_history(columns, n_currencies, first_day)
+    
+    # Microseconds since first_day; NaT becomes int64 min, i.e. before every day
+    offset = (columns["date"] - np.datetime64(first_day, "us")).astype(np.int64)
+    day = offset // DAY_MICROSECONDS
+    in_window = (day >= 0) & (day < days) & (offset - day * DAY_MICROSECONDS <= LAST_SECOND_MICROSECONDS)
+    bucket = np.where(in_window, day, -1)
+    sums = mutasi_bucket_sums(columns, n_currencies, bucket, days)
+    
+    matrix = {field: np.empty((days, n_currencies)) for field in MUTASI_KERNEL_FIELDS}
+    for i in range(days):
+        step = mutasi_step(
+            opening_valas, opening_idr,
+            sums["purchase_valas"][i], sums["purchase_idr"][i], sums["sale_valas"][i], sums["sale_idr"][i]
+        )
+        for field in MUTASI_KERNEL_FIELDS:
+            matrix[field][i] = step[field]
+        opening_valas = to_minor_array(step["ending_stock_valas"]) / MONEY_SCALE
+        opening_idr = to_minor_array(step["ending_stock_idr"]) / MONEY_SCALE
+    matrix["transaction_count"] = sums["transaction_count"]
+    return matrix
+
+def mutasi_rows(currencies: list, arrays: dict, index: int = None) -> list:
+    """Kernel arrays -> the endpoint's per-currency dicts (unrounded); index selects a day row"""
+    if index is not None:
+        arrays = {field: values[index] for field, values in arrays.items()}
+    columns = {field: values.tolist() for field, values in arrays.items()}
+    return [
+        {
+            "currency_code": currency["code"],
+            "currency_name": currency["name"],
+            "currency_symbol": currency.get("symbol", ""),
+            **{field: columns[field][i] for field in columns}
+        }
+        for i, currency in enumerate(currencies)
+    ]
+
 # ============= MUTASI VALAS ENDPOINTS =============
 
 @api_router.get("/mutasi-valas/calculate")
@@ -1339,6 +2995,8 @@ async def calculate_mutasi_valas(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     branch_id: Optional[str] = None,
+    recompute: bool = False,
+    aggregate: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -1355,27 +3013,54 @@ async def calculate_mutasi_valas(
     6. Average Rate = (Stock Awal Rupiah + Rupiah Pembelian) / (Stock Awal Valas + Pembelian Valas)
     7. Stock Akhir (Rupiah) = Stock Akhir Valas * Average Rate
     8. Laba/Rugi = (Rupiah Stock Akhir + Rupiah Penjualan) - (Rupiah Stock Awal + Rupiah Pembelian)
+    
+    A locked day is served from the result stored by lock-day without recomputation;
+    recompute=true bypasses it (the stored result is not changed).
+    
+    aggregate=daily (with start_date, end_date and a branch) builds the period from daily
+    results instead: see compose_mutasi_period.
     """
-    from datetime import datetime as dt, timedelta
+    # If period_date is provided, use it as single day period
+    if period_date:
+        start_date = period_date
+        end_date = period_date
     
-    # Helper function to normalize transaction_date to datetime for comparison
-    def normalize_transaction_date(txn_date):
-        """Convert transaction_date to datetime object for comparison, handling both string and datetime"""
-        if txn_date is None:
-            return None
-        if isinstance(txn_date, dt):
-            # Already datetime, make it naive for comparison
-            if txn_date.tzinfo is not None:
-                return txn_date.replace(tzinfo=None)
-            return txn_date
-        if isinstance(txn_date, str):
-            # Parse ISO string, removing timezone info for consistent comparison
-            try:
-                parsed = dt.fromisoformat(txn_date.replace('Z', '+00:00'))
-                return parsed.replace(tzinfo=None)
-            except:
-                return None
-        return None
+    # Branch filter
+    if current_user.role != UserRole.ADMIN:
+        target_branch_id = current_user.branch_id
+    elif branch_id:
+        target_branch_id = branch_id
+    else:
+        target_branch_id = None
+    
+    if aggregate:
+        if aggregate != "daily":
+            raise HTTPException(status_code=400, detail="aggregate hanya mendukung 'daily'")
+        if period_date or not (start_date and end_date and target_branch_id):
+            raise HTTPException(status_code=400, detail="aggregate=daily membutuhkan start_date, end_date dan branch_id")
+        return await compose_mutasi_period(start_date, end_date, target_branch_id)
+    
+    # Locked day: the full-day result is final, a single indexed read
+    if period_date and target_branch_id and not recompute:
+        locked = await get_locked_mutasi_result(target_branch_id, period_date)
+        if locked is not None:
+            return locked
+    
+    return await build_mutasi_valas(target_branch_id, period_date, start_date, end_date)
+
+async def build_mutasi_valas(
+    target_branch_id: Optional[str],
+    period_date: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    currencies: Optional[list] = None
+) -> list:
+    """
+    Mutasi rows for one branch (global when target_branch_id is None); see calculate_mutasi_valas.
+    A single-day run (period_date) also saves the day's stock snapshots.
+    currencies can be passed in when the caller already fetched the active currencies.
+    """
+    from datetime import datetime as dt, timedelta
     
     def get_previous_date(date_str: str) -> str:
         """Get the previous day's date string"""
@@ -1383,11 +3068,6 @@ async def calculate_mutasi_valas(
         prev_date = date_obj - timedelta(days=1)
         return prev_date.strftime("%Y-%m-%d")
     
-    # If period_date is provided, use it as single day period
-    if period_date:
-        start_date = period_date
-        end_date = period_date
-    
     # Convert date strings to datetime objects for proper comparison (naive, no timezone)
     start_datetime = None
     end_datetime = None
@@ -1396,16 +3076,9 @@ async def calculate_mutasi_valas(
     if end_date:
         end_datetime = dt.fromisoformat(end_date + "T23:59:59")
     
-    # Branch filter
-    if current_user.role != UserRole.ADMIN:
-        target_branch_id = current_user.branch_id
-    elif branch_id:
-        target_branch_id = branch_id
-    else:
-        target_branch_id = None
-    
     # Get all currencies
-    currencies = await db.currencies.find({"is_active": True}, {"_id": 0}).to_list(1000)
+    if currencies is None:
+        currencies = await db.currencies.find({"is_active": True}, {"_id": 0}).to_list(1000)
     
     # Get branch initial balances
     branch_initial_balances = {}
@@ -1416,199 +3089,79 @@ async def calculate_mutasi_valas(
             branch_initial_balances = branch.get("currency_balances", {})
             branch_initial_idr = branch.get("currency_balances_idr", {})
     
-    # Fetch ALL transactions and filter in Python to handle mixed date formats (string/datetime)
-    # This is necessary because historical data may have inconsistent transaction_date types
-    all_txn_query = {"is_deleted": {"$ne": True}}
-    if target_branch_id:
-        all_txn_query["branch_id"] = target_branch_id
+    columns = await fetch_mutasi_columns(target_branch_id, currencies)
+    n_currencies = len(currencies)
     
-    all_transactions = await db.transactions.find(all_txn_query, {"_id": 0}).to_list(10000)
-    
-    # Get previous period ending stock from SNAPSHOT (exact values, no recalculation)
-    previous_ending_stocks = {}
-    previous_ending_idr = {}
-    previous_avg_rates = {}
-    snapshot_currencies_found = set()  # Track which currencies have snapshots
+    # Stock Awal - no previous data for a currency = start from 0
+    # NEVER use branch_initial_balances - always start from 0 or previous data
+    opening_valas = np.zeros(n_currencies)
+    opening_idr = np.zeros(n_currencies)
     
     if start_date and target_branch_id:
-        # First, try to get snapshot from the previous day
-        prev_date_str = get_previous_date(start_date)
+        # For currencies WITHOUT snapshot, calculate from ALL previous transactions
+        # DO NOT use branch_initial_balances as fallback (that's only for true first day)
+        opening_valas, opening_idr = mutasi_opening_from_history(columns, n_currencies, start_datetime)
         
-        # Query snapshots for previous day
+        # Get previous period ending stock from SNAPSHOT (exact values, no recalculation)
         snapshots = await db.daily_stock_snapshots.find({
             "branch_id": target_branch_id,
-            "date": prev_date_str
+            "date": get_previous_date(start_date)
         }, {"_id": 0}).to_list(1000)
         
-        if snapshots:
-            # Use EXACT values from snapshot - NO RECALCULATION
-            for snap in snapshots:
-                currency_code = snap["currency_code"]
-                previous_ending_stocks[currency_code] = snap["ending_stock_valas"]
-                previous_ending_idr[currency_code] = snap["ending_stock_idr"]
-                previous_avg_rates[currency_code] = snap.get("avg_rate", 0)
-                snapshot_currencies_found.add(currency_code)
-        
-        # For currencies WITHOUT snapshot, calculate from ALL previous transactions
-        # DO NOT use branch_initial_balances as fallback (that's only for true first day)
-        prev_transactions = []
-        for t in all_transactions:
-            t_date = normalize_transaction_date(t.get("transaction_date"))
-            if t_date and t_date < start_datetime:
-                prev_transactions.append(t)
-        
-        for currency in currencies:
-            currency_code = currency["code"]
-            
-            # Skip if already have snapshot for this currency
-            if currency_code in snapshot_currencies_found:
-                continue
-            
-            # Calculate from previous transactions only (NO initial balance - EVER)
-            # Initial balance from Settings is ONLY for display reference, not calculation
-            prev_currency_txns = [t for t in prev_transactions if t.get("currency_code") == currency_code]
-            
-            # ALWAYS start from 0 - Stock Awal is ONLY from previous transactions
-            # This ensures: No transactions = 0, some transactions = calculated value
-            initial_valas = 0.0
-            initial_idr = 0.0
-            
-            prev_buy_valas = sum(t["amount"] for t in prev_currency_txns if t.get("transaction_type") in ["beli", "buy"])
-            prev_buy_idr = sum(t["total_idr"] for t in prev_currency_txns if t.get("transaction_type") in ["beli", "buy"])
-            prev_sell_valas = sum(t["amount"] for t in prev_currency_txns if t.get("transaction_type") in ["jual", "sell"])
-            
-            prev_ending_valas = initial_valas + prev_buy_valas - prev_sell_valas
-            
-            # Calculate previous avg rate
-            total_valas_in = initial_valas + prev_buy_valas
-            total_idr_in = initial_idr + prev_buy_idr
-            if total_valas_in > 0:
-                prev_avg_rate = total_idr_in / total_valas_in
-            else:
-                prev_avg_rate = 0
-            
-            # IMPORTANT: Use avg_rate * valas for IDR to maintain consistency
-            prev_ending_idr = prev_ending_valas * prev_avg_rate
-            
-            previous_ending_stocks[currency_code] = prev_ending_valas
-            previous_ending_idr[currency_code] = prev_ending_idr
-            previous_avg_rates[currency_code] = prev_avg_rate
-    
-    # Filter current period transactions using Python comparison
-    transactions = []
-    if start_datetime and end_datetime:
-        for t in all_transactions:
-            t_date = normalize_transaction_date(t.get("transaction_date"))
-            if t_date and start_datetime <= t_date <= end_datetime:
-                transactions.append(t)
-    else:
-        transactions = all_transactions
-    
-    # Calculate mutasi per currency
-    mutasi_data = []
+        currency_index = {currency["code"]: i for i, currency in enumerate(currencies)}
+        for snap in snapshots:
+            i = currency_index.get(snap["currency_code"])
+            if i is not None:
+                opening_valas[i] = from_minor(doc_minor(snap, "ending_stock_valas"))
+                opening_idr[i] = from_minor(doc_minor(snap, "ending_stock_idr"))
+    
+    # Calculate mutasi for all currencies at once (negative stock clamped to 0 throughout)
+    mutasi_data = mutasi_rows(
+        currencies,
+        compute_mutasi_period(columns, n_currencies, start_datetime, end_datetime, opening_valas, opening_idr)
+    )
     
-    for currency in currencies:
-        currency_code = currency["code"]
-        
-        # 1. Stock Awal = Stock Akhir periode sebelumnya (dari snapshot atau kalkulasi)
-        # NEVER use branch_initial_balances - always start from 0 or previous data
-        if start_date and currency_code in previous_ending_stocks:
-            beginning_stock_valas = previous_ending_stocks[currency_code]
-            beginning_stock_idr = previous_ending_idr[currency_code]
-        else:
-            # No previous data for this currency = start from 0
-            beginning_stock_valas = 0.0
-            beginning_stock_idr = 0.0
-        
-        # IMPORTANT: Convert negative Stock Awal to 0 BEFORE any calculations
-        # This ensures all subsequent calculations are consistent
-        if beginning_stock_valas < 0:
-            beginning_stock_valas = 0.0
-            beginning_stock_idr = 0.0
-        if beginning_stock_idr < 0:
-            beginning_stock_idr = 0.0
-        
-        # Filter transactions for this currency in current period
-        currency_transactions = [t for t in transactions if t.get("currency_code") == currency_code]
-        
-        # 2. Pembelian (beli dari nasabah)
-        purchase_valas = sum(t["amount"] for t in currency_transactions if t.get("transaction_type") in ["beli", "buy"])
-        purchase_idr = sum(t["total_idr"] for t in currency_transactions if t.get("transaction_type") in ["beli", "buy"])
-        
-        # 3. Penjualan (jual ke nasabah)
-        sale_valas = sum(t["amount"] for t in currency_transactions if t.get("transaction_type") in ["jual", "sell"])
-        sale_idr = sum(t["total_idr"] for t in currency_transactions if t.get("transaction_type") in ["jual", "sell"])
-        
-        # 4. Stock Akhir (Valas) = Stock Awal + Pembelian - Penjualan
-        ending_stock_valas = beginning_stock_valas + purchase_valas - sale_valas
-        
-        # Convert negative Stock Akhir to 0 for consistency
-        if ending_stock_valas < 0:
-            ending_stock_valas = 0.0
-        
-        # 5. Average Rate = (Stock Awal Rupiah + Rupiah Pembelian) / (Stock Awal Valas + Pembelian Valas)
-        total_valas_in = beginning_stock_valas + purchase_valas
-        total_idr_in = beginning_stock_idr + purchase_idr
-        
-        if total_valas_in > 0:
-            avg_rate = total_idr_in / total_valas_in
-        else:
-            avg_rate = 0
-        
-        # 6. Stock Akhir (Rupiah) = Stock Akhir Valas * Average Rate
-        ending_stock_idr = ending_stock_valas * avg_rate
-        
-        # Convert negative Stock Akhir IDR to 0
-        if ending_stock_idr < 0:
-            ending_stock_idr = 0.0
-        
-        # 7. Laba/Rugi = (Rupiah Stock Akhir + Rupiah Penjualan) - (Rupiah Stock Awal + Rupiah Pembelian)
-        # Now calculated with corrected (non-negative) values
-        profit_loss = (ending_stock_idr + sale_idr) - (beginning_stock_idr + purchase_idr)
-        
-        # Store values (already corrected for negatives)
-        mutasi_item = {
-            "currency_code": currency_code,
-            "currency_name": currency["name"],
-            "currency_symbol": currency.get("symbol", ""),
-            "beginning_stock_valas": beginning_stock_valas,
-            "beginning_stock_idr": beginning_stock_idr,
-            "purchase_valas": purchase_valas,
-            "purchase_idr": purchase_idr,
-            "sale_valas": sale_valas,
-            "sale_idr": sale_idr,
-            "ending_stock_valas": ending_stock_valas,
-            "ending_stock_idr": ending_stock_idr,
-            "avg_rate": avg_rate,
-            "profit_loss": profit_loss,
-            "transaction_count": len(currency_transactions)
+    # Auto-save snapshot for the current period (if period_date is specified)
+    # This ensures Stock Akhir today = Stock Awal tomorrow. Only snapshots whose values
+    # changed are written, and the snapshots' ETag version moves once, only after a write.
+    if period_date and target_branch_id:
+        stored = {
+            snap["currency_code"]: snap
+            for snap in await db.daily_stock_snapshots.find(
+                {"branch_id": target_branch_id, "date": period_date},
+                {"_id": 0, "currency_code": 1, "ending_stock_valas_minor": 1, "ending_stock_idr_minor": 1, "avg_rate": 1}
+            ).to_list(1000)
         }
-        
-        mutasi_data.append(mutasi_item)
-        
-        # Auto-save snapshot for the current period (if period_date is specified)
-        # This ensures Stock Akhir today = Stock Awal tomorrow
-        if period_date and target_branch_id and (
-            purchase_valas > 0 or sale_valas > 0 or beginning_stock_valas > 0
-        ):
-            # Save snapshot - convert negative values to 0 for clean continuity
-            snapshot_valas = max(0.0, ending_stock_valas)  # Never save negative
-            snapshot_idr = max(0.0, ending_stock_idr)      # Never save negative
-            
-            await db.daily_stock_snapshots.update_one(
+        operations = []
+        for mutasi_item in mutasi_data:
+            if not (
+                mutasi_item["purchase_valas"] > 0 or mutasi_item["sale_valas"] > 0 or mutasi_item["beginning_stock_valas"] > 0
+            ):
+                continue
+            # Save snapshot - values are already non-negative; booked to the sen for exact continuity
+            ending_valas_minor = to_minor(mutasi_item["ending_stock_valas"])
+            ending_idr_minor = to_minor(mutasi_item["ending_stock_idr"])
+            previous = stored.get(mutasi_item["currency_code"])
+            if previous and previous.get("ending_stock_valas_minor") == ending_valas_minor and \
+                    previous.get("ending_stock_idr_minor") == ending_idr_minor and \
+                    previous.get("avg_rate") == mutasi_item["avg_rate"]:
+                continue
+            operations.append(UpdateOne(
                 {
                     "branch_id": target_branch_id,
                     "date": period_date,
-                    "currency_code": currency_code
+                    "currency_code": mutasi_item["currency_code"]
                 },
                 {
                     "$set": {
                         "branch_id": target_branch_id,
                         "date": period_date,
-                        "currency_code": currency_code,
-                        "ending_stock_valas": snapshot_valas,
-                        "ending_stock_idr": snapshot_idr,
-                        "avg_rate": avg_rate,
+                        "currency_code": mutasi_item["currency_code"],
+                        "ending_stock_valas": from_minor(ending_valas_minor),
+                        "ending_stock_idr": from_minor(ending_idr_minor),
+                        "ending_stock_valas_minor": ending_valas_minor,
+                        "ending_stock_idr_minor": ending_idr_minor,
+                        "avg_rate": mutasi_item["avg_rate"],
                         "updated_at": datetime.now(timezone.utc).isoformat()
                     },
                     "$setOnInsert": {
@@ -1618,7 +3171,11 @@ async def calculate_mutasi_valas(
                     }
                 },
                 upsert=True
-            )
+            ))
+        if operations:
+            result = await db.daily_stock_snapshots.bulk_write(operations, ordered=False)
+            if result.modified_count or result.upserted_count:
+                await collection_versions.bump("daily_stock_snapshots")
     
     # Return data with display rounding for UI
     # IMPORTANT: Always convert negative stock values to 0 for clean reports
@@ -1654,6 +3211,234 @@ async def calculate_mutasi_valas(
     
     return mutasi_data
 
+async def get_locked_mutasi_result(branch_id: str, date: str) -> Optional[list]:
+    """Stored mutasi rows of a locked day, or None if the day isn't locked"""
+    stored = await db.daily_mutasi_results.find_one(
+        {"branch_id": branch_id, "date": date},
+        {"_id": 0, "mutasi_data": 1}
+    )
+    return stored["mutasi_data"] if stored else None
+
+def mutasi_day(transaction_date) -> Optional[str]:
+    """YYYY-MM-DD day a transaction counts toward in mutasi valas (naive wall-clock date)"""
+    day = normalize_datetime(transaction_date)
+    return day.strftime("%Y-%m-%d") if day else None
+
+async def find_locked_mutasi_days(branch_id: str, days) -> list:
+    """
+    Which of `days` are locked for the branch: a stored mutasi result, or a locked stock
+    snapshot (days locked before lock-day stored results have only the snapshots).
+    """
+    days = sorted({day for day in days if day})
+    if not days:
+        return []
+    query = {"branch_id": branch_id, "date": {"$in": days}}
+    stored, snapshots = await asyncio.gather(
+        db.daily_mutasi_results.find(query, {"_id": 0, "date": 1}).to_list(len(days)),
+        db.daily_stock_snapshots.find({**query, "is_locked": True}, {"_id": 0, "date": 1}).to_list(None)
+    )
+    return sorted({doc["date"] for doc in stored + snapshots})
+
+async def ensure_mutasi_days_unlocked(branch_id: str, *transaction_dates):
+    """
+    409 for a transaction write dated on a day locked by lock-day - the stored result and
+    snapshots would silently stop matching the transactions. Manual cashbook entries are not
+    checked: mutasi valas is computed from transactions only, so they cannot change a locked day.
+    """
+    locked = await find_locked_mutasi_days(branch_id, [mutasi_day(value) for value in transaction_dates])
+    if locked:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Mutasi valas tanggal {', '.join(locked)} sudah dikunci - transaksi pada tanggal tersebut tidak dapat diubah"
+        )
+
+MUTASI_PERIOD_MAX_DAYS = 366
+MUTASI_SUM_FIELDS = {
+    "purchase_valas": 2, "purchase_idr": 0, "sale_valas": 2, "sale_idr": 0, "profit_loss": 0
+}
+MUTASI_STOCK_FIELDS = {
+    "beginning_stock_valas": 2, "beginning_stock_idr": 0, "ending_stock_valas": 2, "ending_stock_idr": 0
+}
+
+async def compose_mutasi_period(start_date: str, end_date: str, branch_id: str, currencies: Optional[list] = None) -> list:
+    """
+    Mutasi valas for a period composed from daily results: Stock Awal from the first day,
+    Stock Akhir / avg rate from the last day, Pembelian / Penjualan / Laba-Rugi summed.
+    
+    Locked days come from daily_mutasi_results in one range read. The branch's transactions
+    are loaded into columns once, and each run of consecutive unlocked days is one
+    compute_mutasi_daily call on them, opening from the snapshot of the day before the run
+    (history for currencies without one) like the single-day report. A fully locked month
+    or year is O(days) with no transaction scan. Because every day carries its own Stock
+    Awal, the stock figures follow the daily chain (as on the daily report) rather than one
+    average rate over the whole period.
+    currencies can be passed in when the caller already fetched the active currencies.
+    """
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Format tanggal harus YYYY-MM-DD")
+    day_count = (end - start).days + 1
+    if day_count < 1:
+        raise HTTPException(status_code=400, detail="end_date harus sama atau setelah start_date")
+    if day_count > MUTASI_PERIOD_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Periode maksimal {MUTASI_PERIOD_MAX_DAYS} hari")
+    
+    stored = await db.daily_mutasi_results.find(
+        {"branch_id": branch_id, "date": {"$gte": start_date, "$lte": end_date}},
+        {"_id": 0, "date": 1, "mutasi_data": 1}
+    ).to_list(MUTASI_PERIOD_MAX_DAYS)
+    locked_days = {doc["date"]: doc["mutasi_data"] for doc in stored}
+    
+    # Split the range into locked days and runs of unlocked days (first offset, day count)
+    segments = []
+    gap_start = None
+    for offset in range(day_count + 1):
+        day = (start + timedelta(days=offset)).strftime("%Y-%m-%d") if offset < day_count else None
+        if day is not None and day not in locked_days:
+            gap_start = offset if gap_start is None else gap_start
+            continue
+        if gap_start is not None:
+            segments.append((gap_start, offset - gap_start))
+            gap_start = None
+        if day is not None:
+            segments.append(day)
+    
+    gaps = [segment for segment in segments if isinstance(segment, tuple)]
+    gap_rows = {}
+    if gaps:
+        if currencies is None:
+            currencies = await db.currencies.find({"is_active": True}, {"_id": 0}).to_list(1000)
+        n_currencies = len(currencies)
+        currency_index = {currency["code"]: i for i, currency in enumerate(currencies)}
+        columns = await fetch_mutasi_columns(branch_id, currencies)
+        
+        # Ending stock snapshots of the day before each run, in one read
+        previous_days = {
+            (start + timedelta(days=first - 1)).strftime("%Y-%m-%d"): (first, days) for first, days in gaps
+        }
+        snapshots = await db.daily_stock_snapshots.find(
+            {"branch_id": branch_id, "date": {"$in": list(previous_days)}}, {"_id": 0}
+        ).to_list(None)
+        snapshots_by_run = {}
+        for snap in snapshots:
+            snapshots_by_run.setdefault(previous_days[snap["date"]], []).append(snap)
+        
+        for first, days in gaps:
+            first_day = start + timedelta(days=first)
+            opening_valas, opening_idr = mutasi_opening_from_history(columns, n_currencies, first_day)
+            for snap in snapshots_by_run.get((first, days), []):
+                i = currency_index.get(snap["currency_code"])
+                if i is not None:
+                    opening_valas[i] = from_minor(doc_minor(snap, "ending_stock_valas"))
+                    opening_idr[i] = from_minor(doc_minor(snap, "ending_stock_idr"))
+            matrix = compute_mutasi_daily(columns, n_currencies, first_day, days, opening_valas, opening_idr)
+            gap_rows[(first, days)] = [mutasi_rows(currencies, matrix, i) for i in range(days)]
+    
+    period = {}
+    for segment in segments:
+        for rows in gap_rows[segment] if isinstance(segment, tuple) else [locked_days[segment]]:
+            for row in rows:
+                item = period.get(row["currency_code"])
+                if item is None:
+                    period[row["currency_code"]] = dict(row)
+                    continue
+                for field in MUTASI_SUM_FIELDS:
+                    item[field] += row[field]
+                item["transaction_count"] += row["transaction_count"]
+                for field in ("ending_stock_valas", "ending_stock_idr", "avg_rate"):
+                    item[field] = row[field]
+    
+    for item in period.values():
+        for field, digits in {**MUTASI_STOCK_FIELDS, **MUTASI_SUM_FIELDS, "avg_rate": 2}.items():
+            item[field] = round(item[field], digits)
+        item["transaction_count"] = int(item["transaction_count"])
+    return list(period.values())
+
+def total_mutasi_rows(branch_rows: list) -> list:
+    """
+    Per-currency totals over several branches' mutasi rows. Stock, purchase, sale and
+    profit figures are summed; the average rate is re-derived from the summed values.
+    """
+    totals = {}
+    for rows in branch_rows:
+        for row in rows:
+            total = totals.get(row["currency_code"])
+            if total is None:
+                totals[row["currency_code"]] = dict(row)
+                continue
+            for field in (*MUTASI_STOCK_FIELDS, *MUTASI_SUM_FIELDS, "transaction_count"):
+                total[field] += row[field]
+    
+    for total in totals.values():
+        for field, digits in {**MUTASI_STOCK_FIELDS, **MUTASI_SUM_FIELDS}.items():
+            total[field] = round(total[field], digits)
+        valas_in = total["beginning_stock_valas"] + total["purchase_valas"]
+        idr_in = total["beginning_stock_idr"] + total["purchase_idr"]
+        total["avg_rate"] = round(idr_in / valas_in, 2) if valas_in > 0 else 0
+    return list(totals.values())
+
+@api_router.get("/mutasi-valas/consolidated")
+async def get_consolidated_mutasi_valas(
+    period_date: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    aggregate: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Mutasi valas of every active branch in one call (admin only), with a total row per
+    currency. Same period parameters as /mutasi-valas/calculate. Currencies are fetched
+    once and locked days of all branches come from one read; the remaining branches are
+    computed concurrently (CONSOLIDATED_BRANCH_CONCURRENCY at a time).
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admin can view consolidated reports")
+    if aggregate and (aggregate != "daily" or period_date or not (start_date and end_date)):
+        raise HTTPException(status_code=400, detail="aggregate=daily membutuhkan start_date dan end_date")
+    if period_date:
+        start_date = period_date
+        end_date = period_date
+    
+    branches, currencies = await asyncio.gather(
+        db.branches.find({"is_active": True}, {"_id": 0, "id": 1, "code": 1, "name": 1}).sort("code", 1).to_list(1000),
+        db.currencies.find({"is_active": True}, {"_id": 0}).to_list(1000)
+    )
+    
+    locked_results = {}
+    if period_date:
+        stored = await db.daily_mutasi_results.find(
+            {"date": period_date, "branch_id": {"$in": [branch["id"] for branch in branches]}},
+            {"_id": 0, "branch_id": 1, "mutasi_data": 1}
+        ).to_list(len(branches) or 1)
+        locked_results = {doc["branch_id"]: doc["mutasi_data"] for doc in stored}
+    
+    async def build(branch):
+        if aggregate:
+            return await compose_mutasi_period(start_date, end_date, branch["id"], currencies)
+        if branch["id"] in locked_results:
+            return locked_results[branch["id"]]
+        return await build_mutasi_valas(branch["id"], period_date, start_date, end_date, currencies)
+    
+    results = await gather_per_branch(branches, build)
+    
+    return {
+        "period_date": period_date,
+        "start_date": start_date,
+        "end_date": end_date,
+        "branches": [
+            {
+                "branch_id": branch["id"],
+                "branch_code": branch.get("code"),
+                "branch_name": branch.get("name"),
+                "mutasi_data": rows
+            }
+            for branch, rows in zip(branches, results)
+        ],
+        "total": total_mutasi_rows(results)
+    }
+
 @api_router.post("/mutasi-valas/lock-day")
 async def lock_mutasi_valas_day(
     period_date: str,
@@ -1663,16 +3448,21 @@ async def lock_mutasi_valas_day(
     """
     Lock a day's stock snapshot - prevents changes and ensures consistency.
     Call this at end of day to finalize stock values.
+    The full-day mutasi result is stored too, so reads of a locked day don't recompute.
+    Locking an already locked day again recomputes and replaces the stored result.
     """
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Only admin can lock daily stock")
     
     target_branch_id = branch_id or current_user.branch_id
+    if not target_branch_id:
+        raise HTTPException(status_code=400, detail="branch_id wajib diisi")
     
     # First calculate and save snapshots for this day
     mutasi = await calculate_mutasi_valas(
         period_date=period_date,
         branch_id=target_branch_id,
+        recompute=True,
         current_user=current_user
     )
     
@@ -1689,6 +3479,26 @@ async def lock_mutasi_valas_day(
             }
         }
     )
+    await collection_versions.bump("daily_stock_snapshots")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    await db.daily_mutasi_results.update_one(
+        {"branch_id": target_branch_id, "date": period_date},
+        {
+            "$set": {
+                "mutasi_data": mutasi,
+                "locked_by": current_user.id,
+                "updated_at": now
+            },
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "branch_id": target_branch_id,
+                "date": period_date,
+                "created_at": now
+            }
+        },
+        upsert=True
+    )
     
     return {
         "message": f"Stock untuk tanggal {period_date} berhasil dikunci",
@@ -1696,7 +3506,7 @@ async def lock_mutasi_valas_day(
         "mutasi_data": mutasi
     }
 
-@api_router.get("/mutasi-valas/snapshots")
+@api_router.get("/mutasi-valas/snapshots", dependencies=[Depends(versioned_etag("daily_stock_snapshots"))])
 async def get_stock_snapshots(
     date: Optional[str] = None,
     branch_id: Optional[str] = None,
@@ -1733,6 +3543,9 @@ async def reset_stock_snapshots(
         query["date"] = date
     
     result = await db.daily_stock_snapshots.delete_many(query)
+    await collection_versions.bump("daily_stock_snapshots")
+    # Deleted snapshots unlock their days - drop the stored results with them
+    await db.daily_mutasi_results.delete_many(query)
     
     return {
         "message": f"Deleted {result.deleted_count} snapshots",
@@ -1903,8 +3716,11 @@ async def get_transaction_report(
     start_date: str,
     end_date: str,
     branch_id: Optional[str] = None,
+    fields: str = "full",
     current_user: User = Depends(get_current_user)
 ):
+    """fields: projection profile for the transaction rows - "full" (default) or "summary" """
+    projection = get_projection("transactions", fields)
     query = {
         "transaction_date": {
             "$gte": start_date,
@@ -1917,7 +3733,7 @@ async def get_transaction_report(
     elif branch_id:
         query["branch_id"] = branch_id
     
-    transactions = await db.transactions.find(query, {"_id": 0}).sort("transaction_date", -1).to_list(10000)
+    transactions = await db.transactions.find(query, projection).sort("transaction_date", -1).to_list(10000)
     
     for transaction in transactions:
         if isinstance(transaction.get("created_at"), str):
@@ -2039,40 +3855,205 @@ async def get_analytics_trends(current_user: User = Depends(get_current_user)):
         }
     }
 
+# ============= SERVER-SENT EVENTS =============
+
+@api_router.post("/events/ticket")
+async def create_stream_ticket(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Single-use ticket for opening /events/stream (EventSource cannot send the Authorization
+    header, and the JWT must not end up in URLs / access logs). Valid for SSE_TICKET_TTL_SECONDS.
+    """
+    payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+    ticket = secrets.token_urlsafe(32)
+    now = datetime.now(timezone.utc)
+    await db.stream_tickets.insert_one({
+        "ticket_hash": hashlib.sha256(ticket.encode()).hexdigest(),
+        "user_id": current_user.id,
+        "session_expires_at": datetime.fromtimestamp(payload["exp"], timezone.utc),
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=SSE_TICKET_TTL_SECONDS)
+    })
+    return {"ticket": ticket, "expires_in": SSE_TICKET_TTL_SECONDS}
+
+async def load_stream_user(user_id: str) -> Optional[User]:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+    if not user or not user.get("is_active", True):
+        return None
+    return User(**user)
+
+@api_router.get("/events/stream")
+async def stream_events(request: Request, ticket: str):
+    """
+    Server-sent events replacing dashboard / notification / online-status polling.
+    Opened with a ticket from POST /events/ticket (consumed on use). The user is re-checked
+    every SSE_AUTH_RECHECK_SECONDS; when the login session expires or the user is deactivated
+    an auth_expired event is sent and the stream is closed.
+    Events:
+    - transaction_created: the new transaction (dashboard delta)
+    - transaction_updated / transaction_deleted: {id, branch_id} of an edited / deleted transaction
+    - notification: same shape as /notifications/recent items
+    - notification_retracted: {id} of an alert whose transaction was deleted
+    - user_online: user who just logged in (admin only)
+    - activity_logged: new activity log entries were written (admin only)
+    """
+    now = datetime.now(timezone.utc)
+    stored = await db.stream_tickets.find_one_and_delete(
+        {"ticket_hash": hashlib.sha256(ticket.encode()).hexdigest(), "expires_at": {"$gt": now}}
+    )
+    if not stored:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    current_user = await load_stream_user(stored["user_id"])
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    session_expires_at = stored["session_expires_at"]
+    if session_expires_at.tzinfo is None:
+        session_expires_at = session_expires_at.replace(tzinfo=timezone.utc)
+    
+    is_admin = current_user.role == UserRole.ADMIN
+    queue = event_broker.subscribe(None if is_admin else current_user.branch_id, is_admin)
+    
+    async def event_generator():
+        next_check = time.monotonic() + SSE_AUTH_RECHECK_SECONDS
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + SSE_AUTH_RECHECK_SECONDS
+                    if datetime.now(timezone.utc) >= session_expires_at or \
+                            await load_stream_user(current_user.id) is None:
+                        yield "event: auth_expired\ndata: {}\n\n"
+                        break
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    presence.touch(current_user.id)  # an open stream counts as online
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {message['event']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
+        finally:
+            event_broker.unsubscribe(queue)
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        # Content-Encoding: identity keeps GZipMiddleware from buffering events in the compressor
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Content-Encoding": "identity"}
+    )
+
 # ============= NOTIFICATIONS =============
 
 @api_router.get("/notifications/recent")
-async def get_recent_notifications(current_user: User = Depends(get_current_user)):
-    query = {}
+async def get_recent_notifications(
+    after: Optional[str] = None,
+    overlap: bool = False,
+    limit: int = 10,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Notification feed from the alerts collection (newest first), ordered by (created_at, id).
+    after: cursor of a notification the client already has - only later alerts are
+    returned, so a poll with nothing new is a single index seek. These are the oldest
+    `limit` alerts after the cursor; a full page means there are more, so the client
+    asks again after the page's newest cursor until it gets a short page.
+    overlap: start NOTIFICATION_CURSOR_OVERLAP_SECONDS before the cursor instead - the
+    first page of each poll, so an alert another worker stamped slightly earlier but
+    wrote later is not skipped. Already-seen alerts come back; clients dedupe by id.
+    Without after, returns the newest alerts from the last 24 hours.
+    Retracted alerts (transaction deleted) are left out.
+    """
+    query = {"retracted_at": {"$exists": False}}
     if current_user.role != UserRole.ADMIN:
         query["branch_id"] = current_user.branch_id
     
-    # Get large transactions (> 50 million IDR) from last 24 hours
-    yesterday = datetime.now(timezone.utc) - timedelta(hours=24)
+    if after:
+        after_created_at, after_id = parse_alert_cursor(after)
+        if overlap:
+            query["created_at"] = {"$gte": after_created_at - timedelta(seconds=NOTIFICATION_CURSOR_OVERLAP_SECONDS)}
+        else:
+            query["$or"] = [
+                {"created_at": {"$gt": after_created_at}},
+                {"created_at": after_created_at, "id": {"$gt": after_id}}
+            ]
+    else:
+        query["created_at"] = {"$gte": datetime.now(timezone.utc) - timedelta(hours=24)}
     
-    large_transactions = await db.transactions.find({
-        **query,
-        "total_idr": {"$gte": 50000000},
-        "transaction_date": {"$gte": yesterday.isoformat()}
-    }, {"_id": 0}).sort("transaction_date", -1).limit(10).to_list(10)
+    limit = max(1, min(limit, 50))
+    if after:
+        alerts = await db.alerts.find(query).sort([("created_at", 1), ("id", 1)]).limit(limit).to_list(limit)
+        alerts.reverse()
+    else:
+        alerts = await db.alerts.find(query).sort([("created_at", -1), ("id", -1)]).limit(limit).to_list(limit)
     
-    notifications = []
-    for t in large_transactions:
-        if isinstance(t.get("transaction_date"), str):
-            t["transaction_date"] = datetime.fromisoformat(t["transaction_date"])
-        
-        notifications.append({
-            "id": t["id"],
-            "type": "large_transaction",
-            "title": "Transaksi Besar",
-            "message": f"Transaksi {t['currency_code']} senilai {t['total_idr']:,.0f} IDR oleh {t['customer_name']}",
-            "transaction_id": t["id"],
-            "amount": t["total_idr"],
-            "timestamp": t["transaction_date"].isoformat()
-        })
+    notifications = [alert_to_notification(alert) for alert in alerts]
     
     return notifications
 
+@api_router.get("/reports/aml-alerts")
+async def get_aml_alerts(
+    period_type: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    limit: int = 100,
+    include_retracted: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Customers whose cumulative daily/monthly transactions crossed the AML thresholds.
+    period_type: 'daily' or 'monthly' (default both)
+    include_retracted: also list alerts whose transaction was deleted (retracted_at set)
+    """
+    query = {"type": {"$in": [f"customer_threshold_{p}" for p in AML_THRESHOLDS_IDR]}}
+    if not include_retracted:
+        query["retracted_at"] = {"$exists": False}
+    if period_type:
+        if period_type not in AML_THRESHOLDS_IDR:
+            raise HTTPException(status_code=400, detail="period_type must be 'daily' or 'monthly'")
+        query["type"] = f"customer_threshold_{period_type}"
+    if customer_id:
+        query["customer_id"] = customer_id
+    
+    if current_user.role != UserRole.ADMIN:
+        query["branch_id"] = current_user.branch_id
+    elif branch_id:
+        query["branch_id"] = branch_id
+    
+    limit = max(1, min(limit, 1000))
+    alerts = await db.alerts.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+    
+    return {
+        "thresholds": AML_THRESHOLDS_IDR,
+        "alerts": alerts
+    }
+
+@api_router.post("/admin/customer-period-totals/rebuild", status_code=202)
+async def rebuild_customer_period_totals_endpoint(current_user: User = Depends(get_current_user)):
+    """
+    Rebuild the AML daily/monthly customer totals from the transactions (Admin only).
+    Runs as a background job; poll GET /jobs/{job_id}.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    job = await start_customer_period_totals_job(current_user)
+    return {"message": "Customer period totals rebuild started", "job_id": job["id"], "status": job["status"]}
+
+@api_router.post("/admin/customer-stats/rebuild", status_code=202)
+async def rebuild_customer_stats_endpoint(current_user: User = Depends(get_current_user)):
+    """
+    Rebuild every customer's yearly stats from the transactions (Admin only).
+    Runs as a background job; poll GET /jobs/{job_id}.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    job = await start_customer_stats_job(current_user)
+    return {"message": "Customer stats rebuild started", "job_id": job["id"], "status": job["status"]}
+
 # ============= SIPESAT (Sistem Informasi Pengguna Jasa Terpadu) =============
 
 @api_router.get("/reports/sipesat")
@@ -2272,6 +4253,7 @@ async def lock_sipesat_report(
     else:
         sipesat_report["id"] = str(uuid.uuid4())
         await db.sipesat_reports.insert_one(sipesat_report)
+    await collection_versions.bump("sipesat_reports")
     
     # Log activity
     await log_user_activity(
@@ -2288,7 +4270,7 @@ async def lock_sipesat_report(
         "locked_customers": len(customer_ids)
     }
 
-@api_router.get("/reports/sipesat/status")
+@api_router.get("/reports/sipesat/status", dependencies=[Depends(versioned_etag("sipesat_reports"))])
 async def get_sipesat_status(
     year: int,
     branch_id: Optional[str] = None,
@@ -2345,53 +4327,260 @@ async def get_activity_logs(
     if action:
         query["action"] = action
     if start_date and end_date:
-        query["timestamp"] = {"$gte": start_date, "$lte": end_date + "T23:59:59"}
+        try:
+            query.update(build_date_range_filter(
+                "timestamp",
+                datetime.fromisoformat(start_date + "T00:00:00"),
+                datetime.fromisoformat(end_date + "T23:59:59")
+            ))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
     logs = await db.user_activity_logs.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    for log in logs:
+        # Stored as naive UTC; send an explicit offset so the browser doesn't read it as local time
+        if isinstance(log.get("timestamp"), datetime):
+            log["timestamp"] = log["timestamp"].replace(tzinfo=timezone.utc)
     
     return logs
 
+# Activity log retention
+# Entries older than ACTIVITY_LOG_RETENTION_DAYS are appended to one gzip JSON-lines file per
+# month (user_activity_logs_YYYY-MM.jsonl.gz) and then deleted, so the collection stays small
+# while the audit trail is kept. Runs daily; a lease in job_locks keeps multiple workers from
+# archiving the same entries at once.
+
+ACTIVITY_LOG_ARCHIVE_NAME = re.compile(r"^user_activity_logs_\d{4}-\d{2}\.jsonl\.gz$")
+
+async def acquire_job_lease(name: str, seconds: int) -> bool:
+    """Take the named lease for `seconds` unless another worker holds an unexpired one"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_locks.find_one_and_update(
+            {"_id": name, "$or": [{"locked_until": {"$lt": now}}, {"locked_until": {"$exists": False}}]},
+            {"$set": {"locked_until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_job_lease(name: str):
+    await db.job_locks.update_one({"_id": name}, {"$set": {"locked_until": datetime.now(timezone.utc)}})
+
+def append_archive_lines(path: Path, lines: list):
+    """Append JSON lines as a new gzip member (readable with gzip.open as one stream)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "ab") as archive:
+        archive.write(b"".join(line + b"\n" for line in lines))
+
+async def convert_activity_log_timestamps(batch_size: int = 1000) -> dict:
+    """Convert legacy ISO-string activity log timestamps to datetimes (indexed range queries)"""
+    operations = []
+    converted = 0
+    skipped = 0
+    async for log in db.user_activity_logs.find({"timestamp": {"$type": "string"}}, {"_id": 1, "timestamp": 1}):
+        timestamp = normalize_datetime(log["timestamp"])
+        if timestamp is None:
+            skipped += 1
+            continue
+        operations.append(UpdateOne({"_id": log["_id"]}, {"$set": {"timestamp": timestamp}}))
+        if len(operations) >= batch_size:
+            await db.user_activity_logs.bulk_write(operations, ordered=False)
+            converted += len(operations)
+            operations = []
+    if operations:
+        await db.user_activity_logs.bulk_write(operations, ordered=False)
+        converted += len(operations)
+    return {"converted": converted, "unparseable": skipped}
+
+async def run_activity_log_timestamp_job(job_id: str):
+    await update_job(job_id, status="running")
+    try:
+        result = await convert_activity_log_timestamps()
+        await update_job(job_id, status="completed", result=result)
+        logger.info(f"Converted activity log timestamps: {result}")
+    except Exception as e:
+        logging.error(f"Activity log timestamp migration failed: {e}")
+        await update_job(job_id, status="failed", error=str(e))
+
+async def start_activity_log_timestamp_job(current_user: Optional[User] = None) -> dict:
+    active = await find_active_job("activity_log_timestamp_migration", ACTIVITY_LOG_TIMESTAMP_JOB_TIMEOUT_MINUTES)
+    if active:
+        return active
+    job = await create_job("activity_log_timestamp_migration", current_user)
+    start_background_task(run_activity_log_timestamp_job(job["id"]))
+    return job
+
+async def archive_activity_logs(older_than_days: int = ACTIVITY_LOG_RETENTION_DAYS, batch_size: int = 5000) -> dict:
+    """Move activity log entries older than the cutoff into monthly archives"""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=older_than_days)
+    query = build_date_range_filter("timestamp", None, cutoff)
+    archived = 0
+    months = set()
+    while True:
+        entries = await db.user_activity_logs.find(query).sort("timestamp", 1).limit(batch_size).to_list(batch_size)
+        if not entries:
+            break
+        by_month = {}
+        for entry in entries:
+            timestamp = normalize_datetime(entry.get("timestamp")) or cutoff
+            document = {k: v for k, v in entry.items() if k != "_id"}
+            document["timestamp"] = timestamp.replace(tzinfo=timezone.utc)
+            by_month.setdefault(timestamp.strftime("%Y-%m"), []).append(dumps_json(document))
+        # Write before deleting: a crash in between re-archives the batch, never loses it
+        for month, lines in by_month.items():
+            await asyncio.to_thread(append_archive_lines, ACTIVITY_LOG_ARCHIVE_DIR / f"user_activity_logs_{month}.jsonl.gz", lines)
+        await db.user_activity_logs.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+        archived += len(entries)
+        months.update(by_month)
+    if archived:
+        logging.info(f"Archived {archived} activity log entries ({', '.join(sorted(months))})")
+    return {"archived": archived, "months": sorted(months), "cutoff": cutoff.isoformat()}
+
+async def activity_log_retention_loop():
+    while True:
+        try:
+            if await acquire_job_lease("activity_log_archive", 3600):
+                try:
+                    await archive_activity_logs()
+                finally:
+                    await release_job_lease("activity_log_archive")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Activity log archival failed: {e}")
+        await asyncio.sleep(ACTIVITY_LOG_ARCHIVE_INTERVAL_HOURS * 3600)
+
+@api_router.post("/admin/activity-logs/archive")
+async def run_activity_log_archive(
+    older_than_days: int = ACTIVITY_LOG_RETENTION_DAYS,
+    current_user: User = Depends(get_current_user)
+):
+    """Archive activity log entries older than `older_than_days` now (Admin only)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
+    if not await acquire_job_lease("activity_log_archive", 3600):
+        raise HTTPException(status_code=409, detail="Archival is already running")
+    try:
+        return await archive_activity_logs(older_than_days)
+    finally:
+        await release_job_lease("activity_log_archive")
+
+@api_router.post("/admin/activity-logs/migrate-timestamps", status_code=202)
+async def migrate_activity_log_timestamps(current_user: User = Depends(get_current_user)):
+    """
+    Convert legacy ISO-string activity log timestamps to datetimes (Admin only).
+    Runs as a background job (also started at boot when string timestamps exist); poll GET /jobs/{job_id}.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    job = await start_activity_log_timestamp_job(current_user)
+    return {"message": "Activity log timestamp migration started", "job_id": job["id"], "status": job["status"]}
+
+@api_router.get("/admin/activity-logs/archives")
+async def list_activity_log_archives(current_user: User = Depends(get_current_user)):
+    """List monthly activity log archives (Admin only)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if not ACTIVITY_LOG_ARCHIVE_DIR.exists():
+        return []
+    return [
+        {"filename": path.name, "month": path.name[len("user_activity_logs_"):-len(".jsonl.gz")], "size": path.stat().st_size}
+        for path in sorted(ACTIVITY_LOG_ARCHIVE_DIR.iterdir(), reverse=True)
+        if ACTIVITY_LOG_ARCHIVE_NAME.match(path.name)
+    ]
+
+@api_router.get("/admin/activity-logs/archives/{filename}")
+async def download_activity_log_archive(filename: str, current_user: User = Depends(get_current_user)):
+    """Download one monthly archive (gzip JSON lines)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    path = ACTIVITY_LOG_ARCHIVE_DIR / filename
+    if not ACTIVITY_LOG_ARCHIVE_NAME.match(filename) or not path.exists():
+        raise HTTPException(status_code=404, detail="Archive not found")
+    # Content-Encoding: identity keeps GZipMiddleware from compressing the gzip file again
+    return FileResponse(path, media_type="application/gzip", filename=filename, headers={"Content-Encoding": "identity"})
+
 @api_router.get("/users/online-status")
-async def get_users_online_status(current_user: User = Depends(get_current_user)):
-    """Get online/offline status of users based on last login"""
+async def get_users_online_status(include_offline: bool = True, current_user: User = Depends(get_current_user)):
+    """
+    Online/offline status of users from the last_seen heartbeat (online = seen within
+    ONLINE_WINDOW_MINUTES). Online users come from an indexed range query on last_seen;
+    include_offline=false skips listing everyone else. The result is cached for
+    ONLINE_STATUS_CACHE_SECONDS; changes in between are pushed as user_online / user_offline.
+    """
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Only admin can view user status")
     
-    users = await db.users.find({"is_active": True}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    
-    # Consider user online if last login within 30 minutes
-    thirty_mins_ago = datetime.now(timezone.utc) - timedelta(minutes=30)
+    cached = presence.cached_status(include_offline)
+    if cached is not None:
+        return cached
+    
+    projection = {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1, "last_login": 1, "last_seen": 1}
+    online_since = presence.online_since()
+    online_users = await db.users.find(
+        {"is_active": True, "last_seen": {"$gte": online_since}}, projection
+    ).sort("last_seen", -1).to_list(1000)
+    offline_users = []
+    if include_offline:
+        offline_users = await db.users.find(
+            {"is_active": True, "$or": [{"last_seen": {"$lt": online_since}}, {"last_seen": {"$exists": False}}]},
+            projection
+        ).sort("last_seen", -1).to_list(1000)
     
     user_status = []
-    for user in users:
-        last_login = user.get("last_login")
-        is_online = False
-        
-        if last_login:
-            if isinstance(last_login, str):
-                last_login_dt = datetime.fromisoformat(last_login.replace('Z', '+00:00'))
-            else:
-                last_login_dt = last_login
-            
-            is_online = last_login_dt > thirty_mins_ago
-        
+    for user, is_online in [(u, True) for u in online_users] + [(u, False) for u in offline_users]:
+        last_seen = user.get("last_seen")
+        if isinstance(last_seen, datetime) and last_seen.tzinfo is None:
+            last_seen = last_seen.replace(tzinfo=timezone.utc)
         user_status.append({
             "id": user["id"],
             "name": user["name"],
             "email": user["email"],
             "role": user["role"],
             "is_online": is_online,
-            "last_login": last_login
+            "last_login": user.get("last_login"),
+            "last_seen": last_seen
         })
     
-    # Sort: online users first, then by last login
-    user_status.sort(key=lambda x: (not x["is_online"], x["last_login"] or ""), reverse=True)
-    
-    return {
+    result = {
         "users": user_status,
-        "online_count": sum(1 for u in user_status if u["is_online"]),
-        "total_count": len(user_status)
+        "online_count": len(online_users),
+        "total_count": len(user_status) if include_offline else await db.users.count_documents({"is_active": True})
     }
+    presence.cache_status(include_offline, result)
+    return result
+
+# ============= TRANSACTION FORM BOOTSTRAP =============
+
+@api_router.get(
+    "/bootstrap",
+    dependencies=[Depends(versioned_etag("customers", "currencies", "branches", "company_settings"))]
+)
+async def get_bootstrap_data(response: Response, fields: str = "full", current_user: User = Depends(get_current_user)):
+    """
+    All reference data the transaction form needs in one request:
+    customers, currencies, branches and company settings (same content as the
+    individual endpoints). Served with an ETag - send If-None-Match to get 304
+    when nothing changed. fields: projection profile for customers ("full" or "summary").
+    """
+    customers, currencies, branches, company_settings = await asyncio.gather(
+        list_active_customers(current_user, fields),
+        get_currencies(current_user=current_user),
+        get_branches(current_user=current_user),
+        get_company_settings(current_user=current_user)
+    )
+    
+    return FastJSONResponse({
+        "customers": project_trusted_rows(Customer, customers) if fields == "full" else customers,
+        "currencies": project_trusted_rows(Currency, currencies),
+        "branches": project_trusted_rows(Branch, branches),
+        "company_settings": company_settings
+    }, headers=dict(response.headers))  # ETag set by versioned_etag
 
 # ============= DATABASE BACKUP =============
 
@@ -2400,10 +4589,6 @@ async def download_backup(current_user: User = Depends(get_current_user)):
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Only admin can download backup")
     
-    import json
-    from fastapi.responses import StreamingResponse
-    import io
-    
     # Export all collections
     backup_data = {
         "backup_date": datetime.now(timezone.utc).isoformat(),
@@ -2416,23 +4601,18 @@ async def download_backup(current_user: User = Depends(get_current_user)):
         "mutasi_valas": await db.mutasi_valas.find({}, {"_id": 0}).to_list(10000)
     }
     
-    # Convert to JSON
-    json_data = json.dumps(backup_data, indent=2, default=str)
-    
-    # Create file stream
-    file_stream = io.BytesIO(json_data.encode())
-    
     filename = f"mba_backup_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.json"
     
-    return StreamingResponse(
-        file_stream,
+    # Single body (not streamed) so GZipMiddleware can compress it with a Content-Length
+    return Response(
+        content=dumps_json(backup_data, indent=True),
         media_type="application/json",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 # ============= COMPANY SETTINGS ENDPOINTS =============
 
-@api_router.get("/settings/company")
+@api_router.get("/settings/company", dependencies=[Depends(versioned_etag("company_settings"))])
 async def get_company_settings(current_user: User = Depends(get_current_user)):
     settings = await db.company_settings.find_one({"id": "company_settings"}, {"_id": 0})
     if not settings:
@@ -2459,6 +4639,7 @@ async def update_company_settings(settings_update: CompanySettingsUpdate, curren
         {"$set": update_data},
         upsert=True
     )
+    await collection_versions.bump("company_settings")
     
     return await db.company_settings.find_one({"id": "company_settings"}, {"_id": 0})
 
@@ -2482,6 +4663,7 @@ async def update_branch_balances(branch_id: str, balance_update: BranchBalanceUp
         update_data["currency_balances_idr"] = balance_update.currency_balances_idr
     
     await db.branches.update_one({"id": branch_id}, {"$set": update_data})
+    await collection_versions.bump("branches")
     
     updated = await db.branches.find_one({"id": branch_id}, {"_id": 0})
     return updated
@@ -2503,9 +4685,19 @@ async def get_branch_balances(branch_id: str, current_user: User = Depends(get_c
 # ============= MULTI-CURRENCY TRANSACTION ENDPOINT =============
 
 @api_router.post("/transactions/multi")
-async def create_multi_transaction(transaction_data: MultiTransactionCreate, current_user: User = Depends(get_current_user)):
+async def create_multi_transaction(
+    transaction_data: MultiTransactionCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
     """Create multiple transactions for the same customer in one request"""
-    
+    return await run_idempotent(
+        idempotency_key, current_user.id, "POST /transactions/multi", transaction_data,
+        lambda before_write: create_multi_transaction_records(transaction_data, current_user, before_write), response
+    )
+
+async def create_multi_transaction_records(transaction_data: MultiTransactionCreate, current_user: User, before_write=skip_before_write):
     # Get customer
     customer = await db.customers.find_one({"id": transaction_data.customer_id}, {"_id": 0})
     if not customer:
@@ -2515,6 +4707,7 @@ async def create_multi_transaction(transaction_data: MultiTransactionCreate, cur
     branch = await db.branches.find_one({"id": customer["branch_id"]}, {"_id": 0})
     if not branch:
         raise HTTPException(status_code=404, detail="Branch not found")
+    await ensure_mutasi_days_unlocked(customer["branch_id"], transaction_data.transaction_date or datetime.now(timezone.utc))
     
     # Get customer name and code
     customer_name = customer.get("name") or customer.get("entity_name", "")
@@ -2533,7 +4726,8 @@ async def create_multi_transaction(transaction_data: MultiTransactionCreate, cur
     base_seq_str = base_txn_number.split('-')[3]  # Get "00001" part
     base_seq = int(base_seq_str)
     
-    created_transactions = []
+    transactions = []
+    cashbook_docs = []
     suffixes = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j']  # Support up to 10 currencies
     
     for idx, item in enumerate(transaction_data.items):
@@ -2542,67 +4736,387 @@ async def create_multi_transaction(transaction_data: MultiTransactionCreate, cur
         if not currency:
             continue
         
-        total_idr = item.amount * item.exchange_rate
+        total_idr, total_idr_minor = compute_total_idr(item.amount, item.exchange_rate)
+        
+        # For multi-currency: use base number with suffix (a, b, c, etc.)
+        if len(transaction_data.items) > 1:
+            # Generate with base_seq and suffix
+            txn_number = await generate_transaction_number(
+                item.transaction_type, 
+                customer["branch_id"], 
+                suffix=suffixes[idx],
+                base_seq=base_seq
+            )
+        else:
+            txn_number = base_txn_number
+        
+        transaction = Transaction(
+            transaction_number=txn_number,
+            voucher_number=batch_voucher,
+            customer_id=transaction_data.customer_id,
+            customer_code=customer_code,
+            customer_name=customer_name,
+            customer_identity_type=customer.get("identity_type", customer.get("entity_type", "")),
+            branch_id=customer["branch_id"],
+            branch_name=branch["name"],
+            user_id=current_user.id,
+            accountant_name=current_user.name,
+            transaction_type=item.transaction_type,
+            currency_id=item.currency_id,
+            currency_code=currency["code"],
+            amount=item.amount,
+            exchange_rate=item.exchange_rate,
+            total_idr=total_idr,
+            total_idr_minor=total_idr_minor,
+            notes=transaction_data.notes,
+            delivery_channel=transaction_data.delivery_channel,
+            payment_method=transaction_data.payment_method,
+            transaction_purpose=transaction_data.transaction_purpose,
+            transaction_date=transaction_data.transaction_date or datetime.now(timezone.utc)
+        )
+        
+        transactions.append(transaction)
+        
+        # Create cashbook entry for each transaction
+        # Sell (jual) = Money receives IDR = DEBIT (cash in)
+        # Buy (beli) = Money pays IDR = CREDIT (cash out)
+        entry_type = "debit" if item.transaction_type in ["jual", "sell"] else "credit"
+        cashbook_entry = CashBookEntry(
+            branch_id=customer["branch_id"],
+            date=transaction.transaction_date,
+            entry_type=entry_type,
+            amount=total_idr,
+            amount_minor=total_idr_minor,
+            description=f"{'Penjualan' if entry_type == 'debit' else 'Pembelian'} {currency['code']} - {customer_name}",
+            reference_type="transaction",
+            reference_id=transaction.id
+        )
+        cashbook_docs.append(cashbook_entry.model_dump())
+    
+    created_transactions = [transaction.model_dump() for transaction in transactions]
+    result = {
+        "message": f"Successfully created {len(created_transactions)} transactions",
+        "batch_voucher": batch_voucher,
+        "transactions": created_transactions
+    }
+    if not transactions:
+        return result
+    
+    # All transactions in one write
+    await before_write()
+    await db.transactions.insert_many([dict(txn) for txn in created_transactions])
+    await db.cashbook_entries.insert_many(cashbook_docs)
+    
+    await apply_customer_stats_changes(added=tuple(created_transactions))
+    await apply_customer_threshold_changes(added=tuple(created_transactions))
+    await record_large_transaction_alerts(created_transactions)
+    for transaction in transactions:
+        publish_transaction_created(transaction.model_dump(mode="json"))
+    
+    return result
+
+# ============= BULK TRANSACTION IMPORT =============
+
+def parse_transaction_import_file(filename: str, content: bytes) -> List[dict]:
+    """Read CSV, XLSX or JSON-lines upload into row dicts (blank cells become None)"""
+    import csv
+    import io
+    
+    name = (filename or "").lower()
+    rows = []
+    
+    if name.endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+        rows = [dict(row) for row in reader]
+    elif name.endswith(".xlsx"):
+        import zipfile
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+        try:
+            workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        except (zipfile.BadZipFile, InvalidFileException, KeyError) as e:
+            raise ValueError(f"bukan file xlsx yang valid ({e})")
+        sheet_rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(h).strip() if h is not None else "" for h in next(sheet_rows, [])]
+        for values in sheet_rows:
+            if values is None or all(v is None for v in values):
+                continue
+            rows.append(dict(zip(headers, values)))
+        workbook.close()
+    elif name.endswith((".jsonl", ".ndjson", ".json")):
+        for line_number, line in enumerate(content.decode("utf-8-sig").splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"baris {line_number}: JSON tidak valid ({e.msg})")
+            if not isinstance(row, dict):
+                raise ValueError(f"baris {line_number}: harus berupa objek JSON")
+            rows.append(row)
+    else:
+        raise HTTPException(status_code=400, detail="Format file tidak didukung. Gunakan .csv, .xlsx atau .jsonl")
+    
+    return [
+        {k.strip(): (None if v is None or (isinstance(v, str) and not v.strip()) else v)
+         for k, v in row.items() if k}
+        for row in rows
+    ]
+
+def validate_transaction_import_rows(
+    rows: List[dict], first_row_number: int, current_user: User,
+    customers_by_id: dict, customers_by_code: dict,
+    currencies_by_id: dict, currencies_by_code: dict, branches_by_id: dict
+):
+    """
+    Validate import rows against prefetched reference data (CPU only - runs in a thread).
+    Returns (valid_rows, errors); valid_rows are (row_number, TransactionCreate, customer, currency, branch).
+    """
+    errors = []
+    valid_rows = []  # (row_number, TransactionCreate, customer, currency, branch)
+    
+    for index, row in enumerate(rows):
+        row_number = index + first_row_number
+        row = dict(row)
+        
+        # Spreadsheet cells come back as numbers for text columns like voucher_number
+        for field in ["customer_id", "customer_code", "currency_id", "currency_code", "voucher_number", "notes"]:
+            value = row.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row[field] = str(int(value)) if float(value).is_integer() else str(value)
+        
+        # Resolve codes to ids
+        if not row.get("customer_id") and row.get("customer_code"):
+            customer = customers_by_code.get(row["customer_code"])
+            row["customer_id"] = customer["id"] if customer else None
+        if not row.get("currency_id") and row.get("currency_code"):
+            currency = currencies_by_code.get(str(row["currency_code"]).upper())
+            row["currency_id"] = currency["id"] if currency else None
+        
+        try:
+            data = TransactionCreate.model_validate(row)
+        except ValidationError as e:
+            errors.append({
+                "row": row_number,
+                "errors": [f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()]
+            })
+            continue
+        
+        row_errors = []
+        customer = customers_by_id.get(data.customer_id)
+        currency = currencies_by_id.get(data.currency_id)
+        branch = branches_by_id.get(customer["branch_id"]) if customer else None
+        if not customer:
+            row_errors.append("Customer not found")
+        if not currency:
+            row_errors.append("Currency not found")
+        if customer and not branch:
+            row_errors.append("Branch not found")
+        if customer and current_user.role != UserRole.ADMIN and customer["branch_id"] != current_user.branch_id:
+            row_errors.append("Access denied")
+        if data.transaction_type not in ["jual", "sell", "beli", "buy"]:
+            row_errors.append("transaction_type must be jual/beli")
+        if data.amount <= 0 or data.exchange_rate <= 0:
+            row_errors.append("amount and exchange_rate must be positive")
         
-        # For multi-currency: use base number with suffix (a, b, c, etc.)
-        if len(transaction_data.items) > 1:
-            # Generate with base_seq and suffix
-            txn_number = await generate_transaction_number(
-                item.transaction_type, 
-                customer["branch_id"], 
-                suffix=suffixes[idx],
-                base_seq=base_seq
-            )
+        if row_errors:
+            errors.append({"row": row_number, "errors": row_errors})
         else:
-            txn_number = base_txn_number
+            valid_rows.append((row_number, data, customer, currency, branch))
+    
+    return valid_rows, errors
+
+@api_router.post("/transactions/import")
+async def import_transactions(
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Bulk import transactions (offline outlets reconciling at end of day).
+    Each row uses the TransactionCreate fields; customer_code / currency_code may be
+    given instead of customer_id / currency_id. Rows are validated in batches against
+    prefetched customers/currencies/branches, transaction numbers are reserved per type
+    as ranges, and transactions + cashbook entries are written with insert_many.
+    Invalid rows are skipped and reported with their row number.
+    dry_run: validate only, write nothing.
+    """
+    content = await file.read()
+    try:
+        # Up to BULK_IMPORT_MAX_ROWS rows - parse off the event loop
+        rows = await asyncio.to_thread(parse_transaction_import_file, file.filename, content)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"File tidak dapat dibaca: {str(e)}")
+    
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Maksimal {BULK_IMPORT_MAX_ROWS} baris per import")
+    
+    # Prefetch reference data once for the whole file
+    customer_ids = {r["customer_id"] for r in rows if r.get("customer_id")}
+    customer_codes = {r["customer_code"] for r in rows if r.get("customer_code")}
+    customers = await db.customers.find(
+        {"$or": [{"id": {"$in": list(customer_ids)}}, {"customer_code": {"$in": list(customer_codes)}}]},
+        {"_id": 0, "search_keys": 0}
+    ).to_list(None)
+    customers_by_id = {c["id"]: c for c in customers}
+    customers_by_code = {c["customer_code"]: c for c in customers if c.get("customer_code")}
+    
+    currencies = await db.currencies.find({}, {"_id": 0}).to_list(1000)
+    currencies_by_id = {c["id"]: c for c in currencies}
+    currencies_by_code = {c["code"].upper(): c for c in currencies if c.get("is_active", True)}
+    
+    branches = await db.branches.find({}, {"_id": 0}).to_list(1000)
+    branches_by_id = {b["id"]: b for b in branches}
+    
+    # Row numbers as the user sees them (spreadsheets have a header row)
+    first_row_number = 1 if (file.filename or "").lower().endswith((".jsonl", ".ndjson", ".json")) else 2
+    
+    valid_rows, errors = await asyncio.to_thread(
+        validate_transaction_import_rows, rows, first_row_number, current_user,
+        customers_by_id, customers_by_code, currencies_by_id, currencies_by_code, branches_by_id
+    )
+    
+    # Rows dated on a day whose mutasi result is locked for their branch are rejected
+    today = mutasi_day(datetime.now(timezone.utc))
+    days_by_branch = {}
+    for _, data, customer, _, _ in valid_rows:
+        days_by_branch.setdefault(customer["branch_id"], set()).add(mutasi_day(data.transaction_date) or today)
+    locked_days = {
+        (branch_id, day)
+        for branch_id, days in days_by_branch.items()
+        for day in await find_locked_mutasi_days(branch_id, days)
+    }
+    if locked_days:
+        unlocked_rows = []
+        for valid_row in valid_rows:
+            row_number, data, customer, _, _ = valid_row
+            day = mutasi_day(data.transaction_date) or today
+            if (customer["branch_id"], day) in locked_days:
+                errors.append({"row": row_number, "errors": [f"Mutasi valas tanggal {day} sudah dikunci"]})
+            else:
+                unlocked_rows.append(valid_row)
+        valid_rows = unlocked_rows
+        errors.sort(key=lambda error: error["row"])
+    
+    if dry_run or not valid_rows:
+        return {
+            "dry_run": dry_run,
+            "total_rows": len(rows),
+            "imported": 0,
+            "valid": len(valid_rows),
+            "failed": len(errors),
+            "errors": errors
+        }
+    
+    # Reserve transaction number ranges per type (J/B) for today
+    now = datetime.now(timezone.utc)
+    date_str = now.strftime('%d%m%y')
+    next_seq = {}
+    for type_indicator in ["J", "B"]:
+        needed = sum(1 for _, d, _, _, _ in valid_rows if ("J" if d.transaction_type in ["jual", "sell"] else "B") == type_indicator)
+        if needed:
+            next_seq[type_indicator] = await allocate_transaction_sequence(type_indicator, date_str, needed)
+    
+    transaction_docs = []
+    cashbook_docs = []
+    for row_number, data, customer, currency, branch in valid_rows:
+        type_indicator = "J" if data.transaction_type in ["jual", "sell"] else "B"
+        seq = next_seq[type_indicator]
+        next_seq[type_indicator] += 1
         
+        trx_date = data.transaction_date or now
+        total_idr, total_idr_minor = compute_total_idr(data.amount, data.exchange_rate)
         transaction = Transaction(
-            transaction_number=txn_number,
-            voucher_number=batch_voucher,
-            customer_id=transaction_data.customer_id,
-            customer_code=customer_code,
-            customer_name=customer_name,
+            transaction_number=f"TRX-MBA-{type_indicator}-{str(seq).zfill(5)}-{get_transaction_branch_code(branch)}-{date_str}",
+            voucher_number=data.voucher_number if data.voucher_number else None,
+            customer_id=customer["id"],
+            customer_code=customer.get("customer_code"),
+            customer_name=customer.get("name") or customer.get("entity_name", ""),
             customer_identity_type=customer.get("identity_type", customer.get("entity_type", "")),
             branch_id=customer["branch_id"],
             branch_name=branch["name"],
             user_id=current_user.id,
             accountant_name=current_user.name,
-            transaction_type=item.transaction_type,
-            currency_id=item.currency_id,
+            transaction_type=data.transaction_type,
+            currency_id=data.currency_id,
             currency_code=currency["code"],
-            amount=item.amount,
-            exchange_rate=item.exchange_rate,
+            amount=data.amount,
+            exchange_rate=data.exchange_rate,
             total_idr=total_idr,
-            notes=transaction_data.notes,
-            delivery_channel=transaction_data.delivery_channel,
-            payment_method=transaction_data.payment_method,
-            transaction_purpose=transaction_data.transaction_purpose,
-            transaction_date=transaction_data.transaction_date or datetime.now(timezone.utc)
+            total_idr_minor=total_idr_minor,
+            notes=data.notes,
+            delivery_channel=data.delivery_channel,
+            payment_method=data.payment_method,
+            transaction_purpose=data.transaction_purpose,
+            transaction_date=trx_date,
+            accounting_date_wita=get_aml_period_keys(trx_date)["daily"]
         )
+        transaction_dict = transaction.model_dump()
+        transaction_dict["created_at"] = transaction_dict["created_at"].isoformat()
+        transaction_docs.append(transaction_dict)
         
-        await db.transactions.insert_one(transaction.model_dump())
-        
-        # Create cashbook entry for each transaction
-        # Sell (jual) = Money receives IDR = DEBIT (cash in)
-        # Buy (beli) = Money pays IDR = CREDIT (cash out)
-        entry_type = "debit" if item.transaction_type in ["jual", "sell"] else "credit"
+        # Sell/Jual = DEBIT (cash in), Buy/Beli = CREDIT (cash out)
         cashbook_entry = CashBookEntry(
             branch_id=customer["branch_id"],
             date=transaction.transaction_date,
-            entry_type=entry_type,
+            entry_type="debit" if type_indicator == "J" else "credit",
             amount=total_idr,
-            description=f"{'Penjualan' if entry_type == 'debit' else 'Pembelian'} {currency['code']} - {customer_name}",
+            amount_minor=total_idr_minor,
+            description=f"Transaction {transaction.transaction_number}",
             reference_type="transaction",
             reference_id=transaction.id
         )
-        await db.cashbook_entries.insert_one(cashbook_entry.model_dump())
+        cashbook_dict = cashbook_entry.model_dump()
+        cashbook_dict["created_at"] = cashbook_dict["created_at"].isoformat()
+        cashbook_docs.append(cashbook_dict)
+    
+    # Unordered inserts keep going past a rejected document - the rejected rows are reported
+    # (and get no cashbook entry or derived data) instead of failing the whole import
+    row_numbers = [row_number for row_number, _, _, _, _ in valid_rows]
+    imported_docs = []
+    for start in range(0, len(transaction_docs), BULK_IMPORT_BATCH_SIZE):
+        batch = transaction_docs[start:start + BULK_IMPORT_BATCH_SIZE]
+        rejected = {}
+        try:
+            await db.transactions.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            rejected = {error["index"]: error.get("errmsg", "") for error in e.details.get("writeErrors", [])}
+        for index, message in rejected.items():
+            errors.append({"row": row_numbers[start + index], "errors": [f"Transaksi gagal disimpan: {message}"]})
+        stored = [index for index in range(len(batch)) if index not in rejected]
+        imported_docs += [batch[index] for index in stored]
         
-        created_transactions.append(transaction.model_dump())
+        cashbook_batch = [cashbook_docs[start + index] for index in stored]
+        if not cashbook_batch:
+            continue
+        try:
+            await db.cashbook_entries.insert_many(cashbook_batch, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                index = stored[error["index"]]
+                errors.append({
+                    "row": row_numbers[start + index],
+                    "transaction_number": batch[index]["transaction_number"],
+                    "errors": [f"Transaksi tersimpan tetapi entri Buku Kas gagal: {error.get('errmsg', '')} - "
+                               "jalankan sinkronisasi Buku Kas"]
+                })
+    errors.sort(key=lambda error: error["row"])
+    
+    # Derived data for the stored rows: one stats $inc per customer/year, one threshold $inc
+    # per customer period, and the large-transaction alerts in one insert
+    await apply_customer_stats_changes(added=tuple(imported_docs))
+    await apply_customer_threshold_changes(added=tuple(imported_docs))
+    await record_large_transaction_alerts(imported_docs)
+    for transaction_dict in imported_docs:
+        publish_transaction_created(jsonable_encoder(transaction_dict, exclude={"_id"}))
     
     return {
-        "message": f"Successfully created {len(created_transactions)} transactions",
-        "batch_voucher": batch_voucher,
-        "transactions": created_transactions
+        "dry_run": False,
+        "total_rows": len(rows),
+        "imported": len(imported_docs),
+        "failed": len(rows) - len(imported_docs),
+        "errors": errors,
+        "transaction_numbers": [t["transaction_number"] for t in imported_docs]
     }
 
 # ============= DATA MIGRATION ENDPOINT =============
@@ -2658,113 +5172,290 @@ async def fix_cashbook_entries(current_user: User = Depends(get_current_user)):
         "fixed_entries": fixed_entries
     }
 
-@api_router.post("/migrate/sync-cashbook")
+# Cashbook repair jobs. Both repairs page through documents in id order, CASHBOOK_REPAIR_BATCH_SIZE
+# at a time, and write each page with one bulk_write. After every page the job's progress
+# ({phase, checkpoint, processed, total, stats}) is saved together with updated_at, which is
+# the job's heartbeat: a job whose heartbeat is older than CASHBOOK_REPAIR_STALE_MINUTES is
+# dead (failed, or left running by a restarted worker) and continues from its last checkpoint
+# when started again. The resume is claimed atomically on the old job, and a job that was
+# taken over stops at its next checkpoint, so two writers never work on the same repair.
+# Re-running a page is harmless: sync re-checks it and recalculate deletes before recreating.
+
+CASHBOOK_REPAIR_BATCH_SIZE = 1000
+CASHBOOK_REPAIR_STALE_MINUTES = 5
+CASHBOOK_REPAIR_START_LEASE_SECONDS = 30
+
+class JobTakenOver(Exception):
+    """A repair job's checkpoint found that another job has resumed it"""
+
+async def iterate_id_batches(collection, query: dict, projection: dict, after_id: Optional[str] = None):
+    """Yield pages of documents matching query in id order, starting after after_id"""
+    while True:
+        page_query = {**query, "id": {"$gt": after_id}} if after_id else query
+        batch = await collection.find(page_query, projection).sort("id", 1).to_list(CASHBOOK_REPAIR_BATCH_SIZE)
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1]["id"]
+
+async def save_repair_checkpoint(job_id: str, progress: dict, phase: str, batch: list):
+    """Save progress and heartbeat - unless another job has resumed this one, then stop"""
+    progress["phase"] = phase
+    progress["checkpoint"] = batch[-1]["id"]
+    progress["processed"] += len(batch)
+    result = await db.background_jobs.update_one(
+        {"id": job_id, "resumed_by": {"$exists": False}},
+        {"$set": {"progress": progress, "updated_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise JobTakenOver(job_id)
+
+async def start_phase(job_id: str, progress: dict, phase: str, collection, query: dict):
+    """Enter a phase (unless resuming inside it) with a fresh checkpoint and document total"""
+    if progress.get("phase") != phase:
+        progress.update(phase=phase, checkpoint=None, processed=0, total=await collection.count_documents(query))
+        await update_job(job_id, progress=progress)
+
+async def run_cashbook_repair_job(job_id: str, runner, params: dict, progress: dict):
+    await update_job(job_id, status="running", progress=progress)
+    try:
+        result = await runner(job_id, params, progress)
+        await update_job(job_id, status="completed", result=result)
+    except JobTakenOver:
+        logging.warning(f"Cashbook repair job {job_id} was resumed by another job, stopping")
+    except Exception as e:
+        logging.error(f"Cashbook repair job {job_id} failed: {e}")
+        await update_job(job_id, status="failed", error=str(e))
+
+async def start_cashbook_repair_job(job_type: str, runner, params: dict, resume: bool, current_user: User) -> dict:
+    """
+    Start a repair job, or return the one already queued/running (live heartbeat) for these
+    params. With resume, the last interrupted job for these params is continued from its
+    checkpoint (as a new job that points back to it). Starts are serialized across workers
+    with a job lease.
+    """
+    lease = f"{job_type}:{json.dumps(params, sort_keys=True)}"
+    if not await acquire_job_lease(lease, CASHBOOK_REPAIR_START_LEASE_SECONDS):
+        raise HTTPException(status_code=409, detail="Perbaikan Buku Kas sedang dimulai, coba lagi sebentar")
+    try:
+        active = await find_active_job(job_type, CASHBOOK_REPAIR_STALE_MINUTES, params, age_field="updated_at")
+        if active:
+            return active
+        
+        job_id = str(uuid.uuid4())
+        progress = {"phase": None, "checkpoint": None, "processed": 0, "total": None, "stats": {}}
+        interrupted = None
+        if resume:
+            stale_before = datetime.now(timezone.utc) - timedelta(minutes=CASHBOOK_REPAIR_STALE_MINUTES)
+            query = {
+                "type": job_type,
+                "status": {"$ne": "completed"},
+                "progress.phase": {"$ne": None},
+                "resumed_by": {"$exists": False},
+                # Failed, or its heartbeat stopped - a live job is never resumed
+                "$or": [{"status": "failed"}, {"updated_at": {"$lt": stale_before}}]
+            }
+            for key, value in params.items():
+                query[f"params.{key}"] = value
+            # Claimed atomically: of two resumes, only one gets the old job
+            interrupted = await db.background_jobs.find_one_and_update(
+                query,
+                {"$set": {"status": "failed", "resumed_by": job_id, "finished_at": datetime.now(timezone.utc)}},
+                projection={"_id": 0},
+                sort=[("created_at", -1)]
+            )
+        if interrupted:
+            progress = {**interrupted["progress"], "resumed_from": interrupted["id"]}
+            if not interrupted.get("error"):
+                await update_job(interrupted["id"], error="Interrupted")
+        
+        job = await create_job(job_type, current_user, params, job_id=job_id)
+        job["progress"] = progress
+        start_background_task(run_cashbook_repair_job(job["id"], runner, params, progress))
+        return job
+    finally:
+        await release_job_lease(lease)
+
+def repair_job_response(job: dict) -> dict:
+    return {
+        "message": "Cashbook repair started" if job["status"] == "queued" else "Cashbook repair already running",
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job.get("progress")
+    }
+
+def cashbook_date_filter(field: str, date: Optional[str]) -> dict:
+    if not date:
+        return {}
+    return {"$or": [
+        {field: {"$regex": f"^{date}"}},
+        {field: {"$gte": f"{date}T00:00:00", "$lte": f"{date}T23:59:59"}}
+    ]}
+
+async def run_sync_cashbook(job_id: str, params: dict, progress: dict) -> dict:
+    txn_query = cashbook_date_filter("transaction_date", params.get("date"))
+    cb_query = cashbook_date_filter("date", params.get("date"))
+    stats = progress["stats"]
+    for key in ("transactions_checked", "cashbook_entries_checked", "created", "updated", "deleted_orphans"):
+        stats.setdefault(key, 0)
+    
+    # 1. Create missing cashbook entries for transactions, fix amount / entry_type mismatches
+    if progress.get("phase") in (None, "transactions"):
+        await start_phase(job_id, progress, "transactions", db.transactions, txn_query)
+        async for transactions in iterate_id_batches(db.transactions, txn_query, {"_id": 0}, progress["checkpoint"]):
+            entries = await db.cashbook_entries.find(
+                {"reference_id": {"$in": [t["id"] for t in transactions]}},
+                {"_id": 0, "id": 1, "reference_id": 1, "amount": 1, "amount_minor": 1, "entry_type": 1}
+            ).to_list(None)
+            cb_by_ref = {e["reference_id"]: e for e in entries}
+            operations, created, updated = [], 0, 0
+            for txn in transactions:
+                entry_type = "debit" if txn.get('transaction_type') in ["jual", "sell"] else "credit"
+                units = doc_minor(txn, 'total_idr')
+                cb_entry = cb_by_ref.get(txn['id'])
+                if cb_entry is None:
+                    desc_prefix = "Penjualan" if entry_type == "debit" else "Pembelian"
+                    operations.append(InsertOne({
+                        "id": str(uuid.uuid4()),
+                        "branch_id": txn.get('branch_id'),
+                        "date": txn.get('transaction_date'),
+                        "entry_type": entry_type,
+                        "amount": from_minor(units),
+                        "amount_minor": units,
+                        "description": f"{desc_prefix} {txn.get('currency_code', '')} - {txn.get('customer_name', '')}",
+                        "reference_type": "transaction",
+                        "reference_id": txn['id'],
+                        "created_at": datetime.now(timezone.utc).isoformat()
+                    }))
+                    created += 1
+                    continue
+                fix = {}
+                if doc_minor(cb_entry, 'amount') != units:
+                    fix.update(amount=from_minor(units), amount_minor=units)
+                if cb_entry.get('entry_type') != entry_type:
+                    fix["entry_type"] = entry_type
+                if fix:
+                    operations.append(UpdateOne({"id": cb_entry['id']}, {"$set": fix}))
+                    updated += 1
+            if operations:
+                await db.cashbook_entries.bulk_write(operations, ordered=False)
+            # Counted only once the page is written, so a replayed page is not counted twice
+            stats["created"] += created
+            stats["updated"] += updated
+            stats["transactions_checked"] += len(transactions)
+            await save_repair_checkpoint(job_id, progress, "transactions", transactions)
+    
+    # 2. Delete orphan cashbook entries (linked to transactions that no longer exist)
+    await start_phase(job_id, progress, "orphans", db.cashbook_entries, cb_query)
+    async for entries in iterate_id_batches(
+        db.cashbook_entries, cb_query, {"_id": 0, "id": 1, "reference_id": 1}, progress["checkpoint"]
+    ):
+        ref_ids = list({e["reference_id"] for e in entries if e.get("reference_id")})
+        existing = {
+            t["id"] for t in await db.transactions.find({"id": {"$in": ref_ids}}, {"_id": 0, "id": 1}).to_list(None)
+        } if ref_ids else set()
+        operations = [
+            DeleteOne({"id": e["id"]}) for e in entries
+            if e.get("reference_id") and e["reference_id"] not in existing
+        ]
+        if operations:
+            result = await db.cashbook_entries.bulk_write(operations, ordered=False)
+            stats["deleted_orphans"] += result.deleted_count
+        stats["cashbook_entries_checked"] += len(entries)
+        await save_repair_checkpoint(job_id, progress, "orphans", entries)
+    
+    return {"message": "Cashbook sync completed", "stats": stats}
+
+async def run_recalculate_cashbook(job_id: str, params: dict, progress: dict) -> dict:
+    txn_query = {"is_deleted": {"$ne": True}}
+    if params.get("date"):
+        target_date = datetime.strptime(params["date"], "%Y-%m-%d").date()
+        start_dt = datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0, tzinfo=timezone.utc)
+        end_dt = datetime(target_date.year, target_date.month, target_date.day, 23, 59, 59, tzinfo=timezone.utc)
+        txn_query["transaction_date"] = {"$gte": start_dt, "$lte": end_dt}
+    stats = progress["stats"]
+    for key in ("deleted", "recreated", "failed"):
+        stats.setdefault(key, 0)
+    dates_processed = set(stats.get("dates_processed", []))
+    
+    await start_phase(job_id, progress, "transactions", db.transactions, txn_query)
+    async for transactions in iterate_id_batches(db.transactions, txn_query, {"_id": 0}, progress["checkpoint"]):
+        # Delete the page's transaction entries first, then recreate them from the transaction data
+        dated = []
+        for txn in transactions:
+            txn_date = txn.get('transaction_date')
+            if isinstance(txn_date, datetime):
+                dated.append((txn_date.date().isoformat(), txn))
+            elif isinstance(txn_date, str):
+                dated.append((txn_date.split('T')[0], txn))
+        operations = [DeleteMany({"reference_type": "transaction", "reference_id": {"$in": [t['id'] for _, t in dated]}})]
+        failed = 0
+        for date_str, txn in dated:
+            try:
+                total_idr, total_idr_minor = compute_total_idr(txn['amount'], txn['exchange_rate'])
+                entry_type = "debit" if txn['transaction_type'] in ['sell', 'jual'] else "credit"
+                operations.append(InsertOne({
+                    "id": str(uuid.uuid4()),
+                    "branch_id": txn['branch_id'],
+                    "date": txn['transaction_date'],
+                    "entry_type": entry_type,
+                    "amount": total_idr,
+                    "amount_minor": total_idr_minor,
+                    "description": f"Transaction {txn['transaction_number']}",
+                    "reference_type": "transaction",
+                    "reference_id": txn['id'],
+                    "created_at": datetime.now(timezone.utc).isoformat()
+                }))
+            except Exception as e:
+                failed += 1
+                logging.error(f"Failed to recreate cashbook for transaction {txn['id']}: {str(e)}")
+        if dated:
+            result = await db.cashbook_entries.bulk_write(operations, ordered=True)
+            stats["deleted"] += result.deleted_count
+            stats["recreated"] += result.inserted_count
+        stats["failed"] += failed
+        dates_processed.update(date_str for date_str, _ in dated)
+        stats["dates_processed"] = sorted(dates_processed)
+        await save_repair_checkpoint(job_id, progress, "transactions", transactions)
+    
+    stats["dates_processed"] = sorted(dates_processed)
+    if progress["total"] == 0:
+        return {"message": "No transactions found for the specified criteria", "stats": stats}
+    return {
+        "message": f"Cashbook recalculated successfully for {len(dates_processed)} date(s)",
+        "stats": stats,
+        "warning": "This operation DELETED and RECREATED cashbook entries. Manual entries (if any) were NOT affected."
+    }
+
+@api_router.post("/migrate/sync-cashbook", status_code=202)
 async def sync_cashbook_with_transactions(
     date: Optional[str] = None,
+    resume: bool = True,
     current_user: User = Depends(get_current_user)
 ):
     """
     Sync cashbook entries with transactions to fix any discrepancies.
     This will:
-    1. Delete orphan cashbook entries (no matching transaction)
-    2. Create missing cashbook entries for transactions
-    3. Fix amount mismatches
+    1. Create missing cashbook entries for transactions
+    2. Fix amount / entry_type mismatches
+    3. Delete orphan cashbook entries (no matching transaction)
+    
+    Runs as a background job; poll GET /jobs/{job_id} for progress and the stats.
     
     Args:
         date: Optional date filter (YYYY-MM-DD). If not provided, sync all.
+        resume: Continue the last interrupted sync for the same date from its checkpoint.
     """
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    from datetime import datetime as dt
-    
-    # Get all transactions
-    txn_query = {}
-    if date:
-        txn_query["$or"] = [
-            {"transaction_date": {"$regex": f"^{date}"}},
-            {"transaction_date": {"$gte": f"{date}T00:00:00", "$lte": f"{date}T23:59:59"}}
-        ]
-    
-    transactions = await db.transactions.find(txn_query, {"_id": 0}).to_list(100000)
-    txn_map = {t['id']: t for t in transactions}
-    
-    # Get all cashbook entries
-    cb_query = {}
-    if date:
-        cb_query["$or"] = [
-            {"date": {"$regex": f"^{date}"}},
-            {"date": {"$gte": f"{date}T00:00:00", "$lte": f"{date}T23:59:59"}}
-        ]
-    
-    cashbook_entries = await db.cashbook_entries.find(cb_query, {"_id": 0}).to_list(100000)
-    cb_by_ref = {e.get('reference_id'): e for e in cashbook_entries if e.get('reference_id')}
-    
-    stats = {
-        "transactions_checked": len(transactions),
-        "cashbook_entries_checked": len(cashbook_entries),
-        "created": 0,
-        "updated": 0,
-        "deleted_orphans": 0
-    }
-    
-    # 1. Create missing cashbook entries for transactions
-    for txn in transactions:
-        txn_id = txn['id']
-        if txn_id not in cb_by_ref:
-            # Missing cashbook entry - create it
-            entry_type = "debit" if txn.get('transaction_type') in ["jual", "sell"] else "credit"
-            desc_prefix = "Penjualan" if entry_type == "debit" else "Pembelian"
-            
-            new_entry = {
-                "id": str(uuid.uuid4()),
-                "branch_id": txn.get('branch_id'),
-                "date": txn.get('transaction_date'),
-                "entry_type": entry_type,
-                "amount": txn.get('total_idr', 0),
-                "description": f"{desc_prefix} {txn.get('currency_code', '')} - {txn.get('customer_name', '')}",
-                "reference_type": "transaction",
-                "reference_id": txn_id,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.cashbook_entries.insert_one(new_entry)
-            stats["created"] += 1
-        else:
-            # Check if amount matches
-            cb_entry = cb_by_ref[txn_id]
-            if abs(cb_entry.get('amount', 0) - txn.get('total_idr', 0)) > 0.01:
-                # Update amount
-                await db.cashbook_entries.update_one(
-                    {"id": cb_entry['id']},
-                    {"$set": {"amount": txn.get('total_idr', 0)}}
-                )
-                stats["updated"] += 1
-            
-            # Check entry_type
-            correct_type = "debit" if txn.get('transaction_type') in ["jual", "sell"] else "credit"
-            if cb_entry.get('entry_type') != correct_type:
-                await db.cashbook_entries.update_one(
-                    {"id": cb_entry['id']},
-                    {"$set": {"entry_type": correct_type}}
-                )
-                stats["updated"] += 1
-    
-    # 2. Find and report orphan cashbook entries (linked to non-existent transactions)
-    for entry in cashbook_entries:
-        ref_id = entry.get('reference_id')
-        if ref_id and ref_id not in txn_map:
-            # Orphan entry - delete it
-            await db.cashbook_entries.delete_one({"id": entry['id']})
-            stats["deleted_orphans"] += 1
-    
-    return {
-        "message": "Cashbook sync completed",
-        "stats": stats
-    }
+    job = await start_cashbook_repair_job("cashbook_sync", run_sync_cashbook, {"date": date}, resume, current_user)
+    return repair_job_response(job)
 
-@api_router.post("/admin/recalculate-cashbook-from-transactions")
+@api_router.post("/admin/recalculate-cashbook-from-transactions", status_code=202)
 async def recalculate_cashbook_from_transactions(
     date: Optional[str] = None,
+    resume: bool = True,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -2774,103 +5465,25 @@ async def recalculate_cashbook_from_transactions(
     
     Parameters:
     - date: Specific date to recalculate (YYYY-MM-DD). If None, recalculates ALL dates.
+    - resume: Continue the last interrupted recalculation for the same date from its checkpoint.
+    
+    Runs as a background job; poll GET /jobs/{job_id} for progress and the stats.
     
     DANGER: This will DELETE existing cashbook entries! Use with caution!
     """
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    stats = {
-        "deleted": 0,
-        "recreated": 0,
-        "failed": 0,
-        "dates_processed": []
-    }
+    if date:
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
-    try:
-        # Build query for transactions
-        txn_query = {"is_deleted": {"$ne": True}}
-        if date:
-            # Parse date and get range
-            try:
-                target_date = datetime.strptime(date, "%Y-%m-%d").date()
-                start_dt = datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0, tzinfo=timezone.utc)
-                end_dt = datetime(target_date.year, target_date.month, target_date.day, 23, 59, 59, tzinfo=timezone.utc)
-                txn_query["transaction_date"] = {"$gte": start_dt, "$lte": end_dt}
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-        
-        # Get all transactions to recreate
-        transactions = await db.transactions.find(txn_query, {"_id": 0}).to_list(100000)
-        
-        if not transactions:
-            return {
-                "message": "No transactions found for the specified criteria",
-                "stats": stats
-            }
-        
-        # Group transactions by date for processing
-        from collections import defaultdict
-        txns_by_date = defaultdict(list)
-        for txn in transactions:
-            txn_date = txn.get('transaction_date')
-            if isinstance(txn_date, datetime):
-                date_str = txn_date.date().isoformat()
-            elif isinstance(txn_date, str):
-                date_str = txn_date.split('T')[0]
-            else:
-                continue
-            txns_by_date[date_str].append(txn)
-        
-        # Process each date
-        for process_date, date_txns in txns_by_date.items():
-            stats["dates_processed"].append(process_date)
-            
-            # Step 1: Delete ALL cashbook entries for transactions on this date
-            txn_ids = [t['id'] for t in date_txns]
-            delete_result = await db.cashbook_entries.delete_many({
-                "reference_type": "transaction",
-                "reference_id": {"$in": txn_ids}
-            })
-            stats["deleted"] += delete_result.deleted_count
-            
-            # Step 2: Recreate cashbook entries from actual transaction data
-            for txn in date_txns:
-                try:
-                    # Recalculate total_idr from transaction
-                    total_idr = txn['amount'] * txn['exchange_rate']
-                    
-                    # Determine entry type
-                    entry_type = "debit" if txn['transaction_type'] in ['sell', 'jual'] else "credit"
-                    
-                    # Create new cashbook entry
-                    new_entry = {
-                        "id": str(uuid.uuid4()),
-                        "branch_id": txn['branch_id'],
-                        "date": txn['transaction_date'],
-                        "entry_type": entry_type,
-                        "amount": total_idr,
-                        "description": f"Transaction {txn['transaction_number']}",
-                        "reference_type": "transaction",
-                        "reference_id": txn['id'],
-                        "created_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    
-                    await db.cashbook_entries.insert_one(new_entry)
-                    stats["recreated"] += 1
-                    
-                except Exception as e:
-                    stats["failed"] += 1
-                    logging.error(f"Failed to recreate cashbook for transaction {txn['id']}: {str(e)}")
-        
-        return {
-            "message": f"Cashbook recalculated successfully for {len(stats['dates_processed'])} date(s)",
-            "stats": stats,
-            "warning": "This operation DELETED and RECREATED cashbook entries. Manual entries (if any) were NOT affected."
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Recalculation failed: {str(e)}")
+    job = await start_cashbook_repair_job(
+        "cashbook_recalculate", run_recalculate_cashbook, {"date": date}, resume, current_user
+    )
+    return repair_job_response(job)
 
 
 @api_router.get("/admin/check-data-consistency")
@@ -2913,8 +5526,8 @@ async def check_data_consistency(current_user: User = Depends(get_current_user))
             cb_amount = cb_entry['amount']
             cb_type = cb_entry['entry_type']
             
-            # Check for mismatches
-            if cb_amount != expected_amount or cb_type != expected_type:
+            # Check for mismatches - amounts compared exactly in sen, not as floats
+            if doc_minor(cb_entry, 'amount') != doc_minor(txn, 'total_idr') or cb_type != expected_type:
                 mismatches.append({
                     "transaction_id": txn_id,
                     "transaction_number": txn['transaction_number'],
@@ -2923,7 +5536,7 @@ async def check_data_consistency(current_user: User = Depends(get_current_user))
                     "cashbook_amount": cb_amount,
                     "expected_entry_type": expected_type,
                     "cashbook_entry_type": cb_type,
-                    "amount_diff": expected_amount - cb_amount,
+                    "amount_diff": from_minor(doc_minor(txn, 'total_idr') - doc_minor(cb_entry, 'amount')),
                     "type_mismatch": cb_type != expected_type
                 })
         else:
@@ -2980,6 +5593,14 @@ async def delete_transactions_by_date(date: str, current_user: User = Depends(ge
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
+    # The day's stored mutasi results would no longer match - locked branches block the delete
+    locked = await db.daily_mutasi_results.find({"date": date}, {"_id": 0, "branch_id": 1}).to_list(1000)
+    if locked:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Mutasi valas tanggal {date} sudah dikunci untuk {len(locked)} cabang - transaksi tidak dapat dihapus"
+        )
+    
     # Helper function to normalize transaction_date
     def normalize_date(txn_date):
         if txn_date is None:
@@ -3000,9 +5621,11 @@ async def delete_transactions_by_date(date: str, current_user: User = Depends(ge
     all_txns = await db.transactions.find({}).to_list(100000)
     
     txns_to_delete = []
+    deleted_txn_docs = []
     for txn in all_txns:
         txn_date = normalize_date(txn.get('transaction_date'))
         if txn_date and start_datetime <= txn_date <= end_datetime:
+            deleted_txn_docs.append(txn)
             txns_to_delete.append({
                 "id": txn['id'],
                 "transaction_number": txn.get('transaction_number'),
@@ -3028,6 +5651,12 @@ async def delete_transactions_by_date(date: str, current_user: User = Depends(ge
     # Delete related cashbook entries
     cashbook_result = await db.cashbook_entries.delete_many({"reference_id": {"$in": txn_ids}})
     
+    await apply_customer_stats_changes(removed=tuple(deleted_txn_docs))
+    await apply_customer_threshold_changes(removed=tuple(deleted_txn_docs))
+    await retract_transaction_alerts(txn_ids)
+    for txn in deleted_txn_docs:
+        publish_transaction_changed("transaction_deleted", txn)
+    
     return {
         "message": f"Successfully deleted {txn_result.deleted_count} transactions on {date}",
         "deleted_transactions": txn_result.deleted_count,
@@ -3239,65 +5868,490 @@ async def get_cashbook_entries_by_date(date: str, current_user: User = Depends(g
         "entries": entries_on_date
     }
 
+# ============= INDEX CATALOG =============
+# Every index the app relies on, created by startup_db_client(). Entries are
+# (collection, keys, options); compound keys follow equality -> sort -> range.
+# Hot queries filter on {"is_deleted": {"$ne": True}}. MongoDB's partialFilterExpression
+# cannot express $ne / $exists: false, and a partial index on is_deleted: false would never
+# be chosen for a $ne predicate, so is_deleted is an index key instead (two bounded intervals).
+
+INDEX_CATALOG = [
+    # Transactions
+    ("transactions", "id", {"unique": True}),
+    ("transactions", "transaction_date", {}),
+    ("transactions", "currency_code", {}),
+    ("transactions", "transaction_number", {}),  # ^TRX-MBA-J-... prefix count when a day counter starts
+    ("transactions", [("branch_id", 1), ("transaction_date", -1)], {}),
+    ("transactions", [("branch_id", 1), ("is_deleted", 1), ("transaction_date", -1)], {}),
+    ("transactions", [("user_id", 1), ("is_deleted", 1), ("transaction_date", -1)], {}),  # teller view
+    ("transactions", [("customer_id", 1), ("is_deleted", 1), ("transaction_date", -1)], {}),  # customer history / stats
+    ("transactions", [("branch_id", 1), ("created_at", -1)], {}),  # dashboard recent
+    
+    # Customers
+    ("customers", "id", {"unique": True}),
+    ("customers", "name", {}),
+    ("customers", "customer_code", {}),
+    ("customers", "entity_name", {}),
+    ("customers", "identity_number", {}),
+    ("customers", "phone", {}),
+    ("customers", "search_keys", {}),
+    ("customers", [("branch_id", 1), ("search_keys", 1)], {}),
+    ("customers", [("branch_id", 1), ("created_at", -1)], {}),
+    
+    # Customer stats (YTD aggregates)
+    ("customer_stats", [("customer_id", 1), ("year", 1)], {"unique": True}),
+    
+    # Idempotency keys - one record per user/key, expired by TTL
+    ("idempotency_keys", [("user_id", 1), ("key", 1)], {"unique": True}),
+    ("idempotency_keys", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # AML threshold monitor
+    ("customer_period_totals", [("customer_id", 1), ("period_type", 1), ("period_key", 1)], {"unique": True}),
+    
+    # Alerts / notification feed - cursor polling per branch and TTL for transient alerts
+    ("alerts", [("type", 1), ("created_at", -1)], {}),
+    ("alerts", [("branch_id", 1), ("created_at", 1), ("id", 1)], {}),
+    ("alerts", [("created_at", 1), ("id", 1)], {}),
+    ("alerts", "transaction_id", {}),
+    ("alerts", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # SSE stream tickets - single-use lookup, removed by TTL once expired
+    ("stream_tickets", "ticket_hash", {"unique": True}),
+    ("stream_tickets", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # Transaction number counters - one per type and day, removed by TTL after the day
+    ("transaction_counters", "expires_at", {"expireAfterSeconds": 0}),
+    
+    # Cashbook entries
+    ("cashbook_entries", "id", {"unique": True}),
+    ("cashbook_entries", "date", {}),
+    ("cashbook_entries", [("branch_id", 1), ("date", -1)], {}),
+    ("cashbook_entries", [("reference_id", 1), ("reference_type", 1)], {}),
+    
+    # Users
+    ("users", "id", {"unique": True}),
+    ("users", "email", {"unique": True}),
+    ("users", [("is_active", 1), ("last_seen", -1)], {}),  # online status
+    
+    # Branches / currencies
+    ("branches", "id", {"unique": True}),
+    ("branches", "code", {"unique": True}),
+    ("currencies", "id", {"unique": True}),
+    ("currencies", "code", {"unique": True}),
+    
+    # Daily stock snapshots - exact stock continuity
+    ("daily_stock_snapshots", "id", {"unique": True}),
+    ("daily_stock_snapshots", [("branch_id", 1), ("date", 1), ("currency_code", 1)], {"unique": True}),
+    ("daily_stock_snapshots", "date", {}),
+    ("daily_mutasi_results", [("branch_id", 1), ("date", 1)], {"unique": True}),
+    
+    # Background jobs
+    ("background_jobs", "id", {"unique": True}),
+    ("background_jobs", [("type", 1), ("status", 1), ("created_at", -1)], {}),
+    
+    # SIPESAT period locks
+    ("sipesat_reports", [("year", 1), ("branch_id", 1), ("period", 1)], {}),
+    
+    # User activity log
+    ("user_activity_logs", [("timestamp", -1)], {}),
+    ("user_activity_logs", [("user_id", 1), ("timestamp", -1)], {}),
+]
+
+# Indexes earlier versions created that a catalog compound index now covers by its prefix
+# (every customer query also filters is_deleted) - dropped from existing databases
+RETIRED_INDEXES = [
+    ("transactions", "branch_id_1"),
+    ("transactions", "customer_id_1"),
+    ("transactions", "customer_id_1_transaction_date_-1"),
+    ("customers", "branch_id_1"),
+    ("cashbook_entries", "branch_id_1"),
+]
+
+async def ensure_indexes():
+    """Create every catalog index; one failure (e.g. duplicate data on a unique key) doesn't stop the rest"""
+    for collection, name in RETIRED_INDEXES:
+        try:
+            await db[collection].drop_index(name)
+            logger.info(f"Dropped redundant index {collection}.{name}")
+        except OperationFailure:
+            pass  # Already gone
+    
+    failed = 0
+    for collection, keys, options in INDEX_CATALOG:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error creating index {collection} {keys}: {e}")
+    logger.info(f"Database indexes ensured ({len(INDEX_CATALOG) - failed}/{len(INDEX_CATALOG)})")
+
+def get_hot_queries() -> list:
+    """Representative shapes of the frequent queries, for the index advisor (values are placeholders)"""
+    sample = "sample"
+    year_start = datetime(datetime.now(timezone.utc).year, 1, 1)
+    return [
+        {"name": "transactions list (branch)", "collection": "transactions",
+         "filter": {"is_deleted": {"$ne": True}, "branch_id": sample}},
+        {"name": "transactions list (teller)", "collection": "transactions",
+         "filter": {"is_deleted": {"$ne": True}, "branch_id": sample, "user_id": sample}},
+        {"name": "transaction report (branch + date)", "collection": "transactions",
+         "filter": {"branch_id": sample, "transaction_date": {"$gte": "2025-01-01", "$lte": "2025-01-31"}},
+         "sort": [("transaction_date", -1)]},
+        {"name": "customer history", "collection": "transactions",
+         "filter": {"customer_id": sample, "is_deleted": {"$ne": True},
+                    **build_date_range_filter("transaction_date", year_start, None)},
+         "sort": [("transaction_date", -1)]},
+        {"name": "transaction number sequence", "collection": "transactions",
+         "filter": {"transaction_number": {"$regex": "^TRX-MBA-J-.*-010125"}}},
+        {"name": "dashboard recent transactions", "collection": "transactions",
+         "filter": {"branch_id": sample}, "sort": [("created_at", -1)]},
+        {"name": "customer search", "collection": "customers",
+         "filter": {"is_active": {"$ne": False}, "branch_id": sample, "search_keys": {"$regex": "^budi"}}},
+        {"name": "cashbook entry by transaction", "collection": "cashbook_entries",
+         "filter": {"reference_id": sample, "reference_type": "transaction"}},
+        {"name": "cashbook by branch", "collection": "cashbook_entries",
+         "filter": {"is_deleted": {"$ne": True}, "branch_id": sample}},
+        {"name": "notifications feed", "collection": "alerts",
+         "filter": {"branch_id": sample}, "sort": [("created_at", -1), ("id", -1)]},
+        {"name": "stock snapshot", "collection": "daily_stock_snapshots",
+         "filter": {"branch_id": sample, "date": "2025-01-01", "currency_code": "USD"}},
+        {"name": "locked mutasi day", "collection": "daily_mutasi_results",
+         "filter": {"branch_id": sample, "date": "2025-01-01"}},
+        {"name": "sipesat period lock", "collection": "sipesat_reports",
+         "filter": {"year": 2025, "period": 1, "status": "locked", "branch_id": None}},
+        {"name": "activity log", "collection": "user_activity_logs",
+         "filter": {}, "sort": [("timestamp", -1)]},
+        {"name": "activity log (user)", "collection": "user_activity_logs",
+         "filter": {"user_id": sample}, "sort": [("timestamp", -1)]},
+    ]
+
+def collect_plan_stages(plan: dict) -> list:
+    """Flatten an explain() winning plan into (stage, index name) pairs"""
+    stages = [(plan.get("stage"), plan.get("indexName"))]
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        stages.extend(collect_plan_stages(child))
+    return stages
+
+@api_router.get("/admin/index-advisor")
+async def index_advisor(current_user: User = Depends(get_current_user)):
+    """
+    Run explain() (query planner only, nothing executed) on each hot query shape and
+    report the winning plan. Queries whose plan contains a COLLSCAN or an in-memory SORT
+    are flagged.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    results = []
+    for query in get_hot_queries():
+        command = {"find": query["collection"], "filter": query["filter"]}
+        if query.get("sort"):
+            command["sort"] = dict(query["sort"])
+        try:
+            explain = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        except Exception as e:
+            results.append({"name": query["name"], "collection": query["collection"], "error": str(e)})
+            continue
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        # Newer servers wrap the classic plan in queryPlan (slot-based engine)
+        stages = collect_plan_stages(winning_plan.get("queryPlan", winning_plan))
+        stage_names = [stage for stage, _ in stages]
+        results.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "stages": stage_names,
+            "indexes": [index for _, index in stages if index],
+            "collscan": "COLLSCAN" in stage_names,
+            "in_memory_sort": "SORT" in stage_names
+        })
+    
+    return {
+        "queries": results,
+        "flagged": [r["name"] for r in results if r.get("collscan") or r.get("in_memory_sort")],
+        "catalog_size": len(INDEX_CATALOG)
+    }
+
+# ============= BACKGROUND JOBS =============
+# Long-running work runs outside the request and is tracked in background_jobs:
+# {id, type, status: queued|running|completed|failed, params, result, error,
+#  created_by, created_at, updated_at, started_at, finished_at}. Poll GET /jobs/{job_id}.
+
+JOB_ACTIVE_STATUSES = ["queued", "running"]
+background_tasks = set()  # references to running job tasks
+
+async def create_job(job_type: str, current_user: Optional[User] = None, params: Optional[dict] = None,
+                     job_id: Optional[str] = None) -> dict:
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": job_id or str(uuid.uuid4()),
+        "type": job_type,
+        "status": "queued",
+        "params": params or {},
+        "result": None,
+        "error": None,
+        "created_by": current_user.id if current_user else None,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None
+    }
+    await db.background_jobs.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+async def update_job(job_id: str, **fields):
+    fields.setdefault("updated_at", datetime.now(timezone.utc))  # heartbeat
+    if fields.get("status") == "running":
+        fields.setdefault("started_at", datetime.now(timezone.utc))
+    elif fields.get("status") in ("completed", "failed"):
+        fields.setdefault("finished_at", datetime.now(timezone.utc))
+    await db.background_jobs.update_one({"id": job_id}, {"$set": fields})
+
+async def find_active_job(job_type: str, max_age_minutes: int, params: Optional[dict] = None,
+                          age_field: str = "created_at") -> Optional[dict]:
+    """
+    Most recent queued/running job of this type (and matching params, if given);
+    older ones are assumed dead (worker restarted). age_field="updated_at" judges jobs
+    that save progress regularly by their last heartbeat instead of their start.
+    """
+    query = {
+        "type": job_type,
+        "status": {"$in": JOB_ACTIVE_STATUSES},
+        age_field: {"$gte": datetime.now(timezone.utc) - timedelta(minutes=max_age_minutes)}
+    }
+    for key, value in (params or {}).items():
+        query[f"params.{key}"] = value
+    return await db.background_jobs.find_one(query, {"_id": 0}, sort=[("created_at", -1)])
+
+def start_background_task(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+@api_router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: User = Depends(get_current_user)):
+    """Status of a background job (Admin, or the user who started it)"""
+    job = await db.background_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_user.role != UserRole.ADMIN and job.get("created_by") != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job
+
 # ============= USER MANUAL ENDPOINTS =============
+# Generated manuals are content-addressed: the key is a hash of the generator module source
+# and the screenshots it can embed, and files live in MANUAL_CACHE_DIR as
+# user_manual.<hash>.<ext>. A build only happens when that hash has no files yet.
+# DOCX/PDF generation takes seconds of CPU, so it runs in a process pool as a tracked
+# background job, both formats in parallel. Each file is written to a temp name and swapped
+# in with os.replace() once both are done - downloads never see a half-written file.
+
+MANUAL_FORMATS = {
+    "docx": ("user_manual.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+             "Petunjuk_Teknis_MBA_Money_Changer.docx"),
+    "pdf": ("user_manual.pdf", "application/pdf", "Petunjuk_Teknis_MBA_Money_Changer.pdf"),
+}
+
+# generator -> (module, {format: function}); MANUAL_GENERATOR selects the one served
+MANUAL_GENERATORS = {
+    "enhanced": ("user_manual_enhanced", {"docx": "create_enhanced_user_manual_docx", "pdf": "create_enhanced_user_manual_pdf"}),
+    "basic": ("user_manual_generator", {"docx": "create_user_manual_docx", "pdf": "create_user_manual_pdf"}),
+}
+
+MANUAL_CACHE_KEEP_VERSIONS = 2
+
+manual_executor = None
+manual_job_tasks = {}  # job_id -> task, for requests in this process waiting on a job
+manual_job_lock = asyncio.Lock()
+manual_hash_cache = {}  # generator -> (input file signature, hash)
+
+def get_manual_executor() -> ProcessPoolExecutor:
+    global manual_executor
+    if manual_executor is None:
+        # spawn: workers import only the generator module, not this app (and no forked Motor threads)
+        manual_executor = ProcessPoolExecutor(
+            max_workers=MANUAL_GENERATOR_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return manual_executor
+
+def compute_manual_inputs_hash(generator: str) -> str:
+    """
+    Hash of the generator source plus every screenshot it can embed (get_screenshot_path
+    picks from MANUAL_SCREENSHOTS_DIR). File contents are only re-read when a file's
+    mtime/size changes.
+    """
+    module_name = MANUAL_GENERATORS[generator][0]
+    paths = [Path(importlib.util.find_spec(module_name).origin)]
+    if MANUAL_SCREENSHOTS_DIR.exists():
+        paths += sorted(path for path in MANUAL_SCREENSHOTS_DIR.iterdir() if path.is_file())
+    signature = tuple((str(path), path.stat().st_mtime_ns, path.stat().st_size) for path in paths)
+    cached = manual_hash_cache.get(generator)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256(generator.encode())
+    for path in paths:
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    inputs_hash = digest.hexdigest()[:20]
+    manual_hash_cache[generator] = (signature, inputs_hash)
+    return inputs_hash
+
+def get_manual_path(fmt: str, inputs_hash: str) -> Path:
+    stem, ext = MANUAL_FORMATS[fmt][0].rsplit(".", 1)
+    return MANUAL_CACHE_DIR / f"{stem}.{inputs_hash}.{ext}"
+
+def prune_manual_cache(fmt: str, keep: int = MANUAL_CACHE_KEEP_VERSIONS):
+    """Delete all but the newest `keep` builds of one format"""
+    stem, ext = MANUAL_FORMATS[fmt][0].rsplit(".", 1)
+    builds = sorted(MANUAL_CACHE_DIR.glob(f"{stem}.*.{ext}"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in builds[keep:]:
+        path.unlink(missing_ok=True)
+
+async def run_manual_job(job_id: str, generator: str, formats: list, inputs_hash: str):
+    """Render the requested formats in parallel worker processes, then swap them into the cache"""
+    await update_job(job_id, status="running")
+    module_name, functions = MANUAL_GENERATORS[generator]
+    module = importlib.import_module(module_name)
+    MANUAL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    temp_paths = {fmt: MANUAL_CACHE_DIR / f"{get_manual_path(fmt, inputs_hash).name}.{job_id}.tmp" for fmt in formats}
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.gather(*(
+            loop.run_in_executor(get_manual_executor(), getattr(module, functions[fmt]), str(path))
+            for fmt, path in temp_paths.items()
+        ))
+        files = {}
+        for fmt, path in temp_paths.items():
+            final_path = get_manual_path(fmt, inputs_hash)
+            os.replace(path, final_path)
+            prune_manual_cache(fmt)
+            files[fmt] = str(final_path)
+        await update_job(job_id, status="completed", result={"files": files, "inputs_hash": inputs_hash})
+    except Exception as e:
+        for path in temp_paths.values():
+            path.unlink(missing_ok=True)
+        logging.error(f"User manual generation failed: {e}")
+        await update_job(job_id, status="failed", error=str(e))
+    finally:
+        manual_job_tasks.pop(job_id, None)
+
+async def start_manual_job(generator: str, formats: list, inputs_hash: str, current_user: Optional[User] = None) -> dict:
+    """Start a generation job for these inputs, or return the one already queued/running"""
+    async with manual_job_lock:
+        active = await find_active_job("manual_generation", MANUAL_JOB_TIMEOUT_MINUTES, {"inputs_hash": inputs_hash})
+        if active:
+            return active
+        job = await create_job(
+            "manual_generation", current_user,
+            {"generator": generator, "formats": formats, "inputs_hash": inputs_hash}
+        )
+        manual_job_tasks[job["id"]] = start_background_task(run_manual_job(job["id"], generator, formats, inputs_hash))
+        return job
+
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def ranged_file_response(request: Request, path: Path, media_type: str, filename: str, etag: str) -> Response:
+    """
+    Serve a file with a strong ETag (If-None-Match -> 304) and single byte-range requests
+    (Range / If-Range -> 206, unsatisfiable -> 416). Multi-range requests get the full file.
+    """
+    size = path.stat().st_size
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, no-cache",
+        # Already compressed formats; also keeps GZipMiddleware off so byte offsets stay valid
+        "Content-Encoding": "identity"
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range", "").strip()
+    if_range = request.headers.get("if-range")
+    match = BYTE_RANGE.match(range_header) if range_header and (not if_range or if_range == etag) else None
+    if not match or match.groups() == ("", ""):
+        return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
+    
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(0, size - int(last)), size - 1  # suffix range: last N bytes
+    if start >= size or start > end or (not first and int(last) == 0):
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    async def read_range():
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(file.read, min(64 * 1024, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    
+    return StreamingResponse(read_range(), status_code=206, media_type=media_type, headers={
+        **headers,
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
 
 @api_router.get("/manual/download/{format}")
-async def download_user_manual(format: str):
+async def download_user_manual(format: str, request: Request):
     """
     Download user manual in DOCX or PDF format.
     format: 'docx' or 'pdf'
+    Supports If-None-Match and Range; the ETag changes only when the manual's inputs do.
     """
-    from fastapi.responses import FileResponse
-    import os
-    
-    if format.lower() == 'docx':
-        file_path = "/app/backend/static/user_manual.docx"
-        media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        filename = "Petunjuk_Teknis_MBA_Money_Changer.docx"
-    elif format.lower() == 'pdf':
-        file_path = "/app/backend/static/user_manual.pdf"
-        media_type = "application/pdf"
-        filename = "Petunjuk_Teknis_MBA_Money_Changer.pdf"
-    else:
+    fmt = format.lower()
+    if fmt not in MANUAL_FORMATS:
         raise HTTPException(status_code=400, detail="Invalid format. Use 'docx' or 'pdf'")
+    _, media_type, filename = MANUAL_FORMATS[fmt]
+    
+    inputs_hash = await asyncio.to_thread(compute_manual_inputs_hash, MANUAL_GENERATOR)
+    file_path = get_manual_path(fmt, inputs_hash)
+    
+    if not file_path.exists():
+        # Inputs changed (or first start) - build off the event loop and wait, or join the running job
+        job = await start_manual_job(MANUAL_GENERATOR, list(MANUAL_FORMATS), inputs_hash)
+        task = manual_job_tasks.get(job["id"])
+        if task is None:
+            # Job runs in another worker process - let the client retry
+            raise HTTPException(
+                status_code=503,
+                detail="Petunjuk teknis sedang dibuat, silakan coba lagi",
+                headers={"Retry-After": "10"}
+            )
+        await asyncio.shield(task)
+        if not file_path.exists():
+            raise HTTPException(status_code=500, detail="Gagal membuat petunjuk teknis")
     
-    if not os.path.exists(file_path):
-        # Generate if not exists
-        from user_manual_generator import create_user_manual_docx, create_user_manual_pdf
-        os.makedirs("/app/backend/static", exist_ok=True)
-        if format.lower() == 'docx':
-            create_user_manual_docx(file_path)
-        else:
-            create_user_manual_pdf(file_path)
-    
-    return FileResponse(
-        path=file_path,
-        media_type=media_type,
-        filename=filename
-    )
+    return ranged_file_response(request, file_path, media_type, filename, f'"{inputs_hash}-{fmt}"')
 
-@api_router.post("/manual/regenerate")
-async def regenerate_user_manual(current_user: User = Depends(get_current_user)):
+@api_router.post("/manual/regenerate", status_code=202)
+async def regenerate_user_manual(response: Response, force: bool = False, current_user: User = Depends(get_current_user)):
     """
-    Regenerate user manual files (Admin only).
+    Build the user manual for the current inputs (Admin only) as a background job.
+    Does nothing if both files for the current inputs already exist, unless force=true.
+    Poll GET /jobs/{job_id} for the status; the current files stay downloadable meanwhile.
     """
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    from user_manual_enhanced import create_enhanced_user_manual_docx, create_enhanced_user_manual_pdf
-    import os
-    
-    os.makedirs("/app/backend/static", exist_ok=True)
-    
-    docx_path = create_enhanced_user_manual_docx("/app/backend/static/user_manual.docx")
-    pdf_path = create_enhanced_user_manual_pdf("/app/backend/static/user_manual.pdf")
+    inputs_hash = await asyncio.to_thread(compute_manual_inputs_hash, MANUAL_GENERATOR)
+    if not force and all(get_manual_path(fmt, inputs_hash).exists() for fmt in MANUAL_FORMATS):
+        response.status_code = 200
+        return {"message": "User manual is up to date", "job_id": None, "status": "up_to_date", "inputs_hash": inputs_hash}
     
+    job = await start_manual_job(MANUAL_GENERATOR, list(MANUAL_FORMATS), inputs_hash, current_user)
     return {
-        "message": "User manual regenerated successfully",
-        "files": {
-            "docx": docx_path,
-            "pdf": pdf_path
-        }
+        "message": "User manual regeneration started",
+        "job_id": job["id"],
+        "status": job["status"],
+        "inputs_hash": inputs_hash
     }
 
 @api_router.post("/admin/migrate-date-formats")
@@ -3558,6 +6612,7 @@ async def migrate_date_formats(dry_run: bool = True, current_user: User = Depend
             if not dry_run:
                 try:
                     await db.customers.update_one({"id": customer['id']}, {"$set": updates})
+                    await collection_versions.bump("customers")
                     stats["customers"]["updated"] += 1
                 except Exception as e:
                     stats["customers"]["failed"] += 1
@@ -3588,14 +6643,154 @@ async def migrate_date_formats(dry_run: bool = True, current_user: User = Depend
         "next_step": "Call this endpoint with dry_run=false to execute the migration" if dry_run else "Migration complete. Please verify your data."
     }
 
+MONEY_MIGRATION_BATCH_SIZE = 1000
+MONEY_MIGRATION_MISMATCH_SAMPLE = 100  # mismatched transactions listed in the response
+
+@api_router.post("/admin/migrate-money-minor-units")
+async def migrate_money_minor_units(dry_run: bool = True, current_user: User = Depends(get_current_user)):
+    """
+    Backfill the exact minor-unit money fields (see MONEY section) on existing data.
+    
+    - transactions: total_idr recomputed in Decimal from amount x exchange_rate. Where the
+      stored total_idr is within 1 sen of it, total_idr_minor and total_idr are set to the
+      exact value; totals further off (edited by hand at some point) are left untouched,
+      without minor units, and reported under "mismatches"
+    - cashbook_entries: amount_minor; a transaction-linked entry within 1 sen of its
+      transaction takes the transaction's exact total (real mismatches are left for
+      /admin/check-data-consistency to report)
+    - daily_stock_snapshots: ending_stock_valas_minor / ending_stock_idr_minor
+    
+    Only documents without the minor fields are updated, so it can be re-run safely.
+    dry_run=True (default) only counts; "changed" counts documents whose float value moves.
+    When transaction totals moved, the customer stats of the affected customers are rebuilt
+    and a customer period totals rebuild job is started.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    stats = {
+        collection: {"checked": 0, "updated": 0, "changed": 0}
+        for collection in ("transactions", "cashbook_entries", "daily_stock_snapshots")
+    }
+    
+    async def flush(collection: str, operations: list, force: bool = False):
+        if operations and (force or len(operations) >= MONEY_MIGRATION_BATCH_SIZE):
+            if not dry_run:
+                await db[collection].bulk_write(operations, ordered=False)
+            stats[collection]["updated"] += len(operations)
+            operations.clear()
+    
+    # Transactions - also keep every transaction's exact total for the cashbook pass
+    transaction_totals = {}
+    changed_transactions = []  # customer/date of totals that moved - their derived totals are rebuilt
+    mismatches = []
+    mismatch_count = 0
+    operations = []
+    async for txn in db.transactions.find(
+        {}, {"_id": 0, "id": 1, "transaction_number": 1, "customer_id": 1, "transaction_date": 1,
+             "amount": 1, "exchange_rate": 1, "total_idr": 1, "total_idr_minor": 1}
+    ):
+        stats["transactions"]["checked"] += 1
+        units = txn.get("total_idr_minor")
+        if units is None:
+            stored_units = to_minor(txn.get("total_idr"))
+            if txn.get("amount") is not None and txn.get("exchange_rate") is not None:
+                units = money_product_minor(txn["amount"], txn["exchange_rate"])
+            else:
+                units = stored_units
+            if abs(units - stored_units) > 1:
+                # Edited total - keep it (and the float fallback) for review instead of overwriting
+                mismatch_count += 1
+                if len(mismatches) < MONEY_MIGRATION_MISMATCH_SAMPLE:
+                    mismatches.append({
+                        "id": txn["id"],
+                        "transaction_number": txn.get("transaction_number"),
+                        "total_idr": txn.get("total_idr"),
+                        "computed_total_idr": from_minor(units)
+                    })
+                transaction_totals[txn["id"]] = stored_units
+                continue
+            if from_minor(units) != txn.get("total_idr"):
+                stats["transactions"]["changed"] += 1
+                changed_transactions.append({
+                    "customer_id": txn.get("customer_id"),
+                    "transaction_date": txn.get("transaction_date")
+                })
+            operations.append(UpdateOne(
+                {"id": txn["id"]},
+                {"$set": {"total_idr": from_minor(units), "total_idr_minor": units}}
+            ))
+            await flush("transactions", operations)
+        transaction_totals[txn["id"]] = units
+    await flush("transactions", operations, force=True)
+    stats["transactions"]["mismatched"] = mismatch_count
+    
+    operations = []
+    async for entry in db.cashbook_entries.find(
+        {"amount_minor": {"$exists": False}},
+        {"_id": 0, "id": 1, "amount": 1, "reference_type": 1, "reference_id": 1}
+    ):
+        stats["cashbook_entries"]["checked"] += 1
+        units = to_minor(entry.get("amount"))
+        linked_units = transaction_totals.get(entry.get("reference_id")) if entry.get("reference_type") == "transaction" else None
+        if linked_units is not None and abs(linked_units - units) <= 1:
+            units = linked_units
+        if from_minor(units) != entry.get("amount"):
+            stats["cashbook_entries"]["changed"] += 1
+        operations.append(UpdateOne({"id": entry["id"]}, {"$set": {"amount": from_minor(units), "amount_minor": units}}))
+        await flush("cashbook_entries", operations)
+    await flush("cashbook_entries", operations, force=True)
+    
+    operations = []
+    async for snap in db.daily_stock_snapshots.find(
+        {"ending_stock_valas_minor": {"$exists": False}},
+        {"_id": 0, "id": 1, "ending_stock_valas": 1, "ending_stock_idr": 1}
+    ):
+        stats["daily_stock_snapshots"]["checked"] += 1
+        valas_units = to_minor(snap.get("ending_stock_valas"))
+        idr_units = to_minor(snap.get("ending_stock_idr"))
+        if from_minor(valas_units) != snap.get("ending_stock_valas") or from_minor(idr_units) != snap.get("ending_stock_idr"):
+            stats["daily_stock_snapshots"]["changed"] += 1
+        operations.append(UpdateOne({"id": snap["id"]}, {"$set": {
+            "ending_stock_valas": from_minor(valas_units),
+            "ending_stock_idr": from_minor(idr_units),
+            "ending_stock_valas_minor": valas_units,
+            "ending_stock_idr_minor": idr_units
+        }}))
+        await flush("daily_stock_snapshots", operations)
+    await flush("daily_stock_snapshots", operations, force=True)
+    if not dry_run and stats["daily_stock_snapshots"]["updated"]:
+        await collection_versions.bump("daily_stock_snapshots")
+    
+    # Derived totals summed from transaction totals that moved
+    period_totals_job = None
+    stats_job = None
+    if not dry_run and changed_transactions:
+        stats_job = await start_customer_stats_job(current_user)
+        period_totals_job = await start_customer_period_totals_job(current_user)
+    
+    return {
+        "mode": "DRY RUN (Simulasi)" if dry_run else "EXECUTION (Eksekusi Sebenarnya)",
+        "details_by_collection": stats,
+        "mismatches": mismatches,
+        "customer_period_totals_job_id": period_totals_job["id"] if period_totals_job else None,
+        "customer_stats_job_id": stats_job["id"] if stats_job else None,
+        "note": "This is a simulation. No actual changes were made." if dry_run else "Migration completed successfully!",
+        "next_step": "Call this endpoint with dry_run=false to execute the migration" if dry_run else "Run /admin/check-data-consistency to verify."
+    }
+
 app.include_router(api_router)
 
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the frontend's idempotent-retry logic
+    expose_headers=["Retry-After", "Idempotent-Replayed"],
 )
 
 logging.basicConfig(
@@ -3607,48 +6802,79 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_db_client():
     """Create database indexes on startup for better performance"""
+    await ensure_indexes()
+    activity_log_writer.start()
+    
     try:
-        # Transactions indexes
-        await db.transactions.create_index("id", unique=True)
-        await db.transactions.create_index("branch_id")
-        await db.transactions.create_index("customer_id")
-        await db.transactions.create_index("transaction_date")
-        await db.transactions.create_index("currency_code")
-        await db.transactions.create_index([("branch_id", 1), ("transaction_date", -1)])
-        
-        # Customers indexes
-        await db.customers.create_index("id", unique=True)
-        await db.customers.create_index("branch_id")
-        await db.customers.create_index("name")
-        await db.customers.create_index("customer_code")
-        
-        # Cashbook entries indexes
-        await db.cashbook_entries.create_index("id", unique=True)
-        await db.cashbook_entries.create_index("branch_id")
-        await db.cashbook_entries.create_index("date")
-        await db.cashbook_entries.create_index([("branch_id", 1), ("date", -1)])
-        
-        # Users indexes
-        await db.users.create_index("id", unique=True)
-        await db.users.create_index("email", unique=True)
-        
-        # Branches indexes
-        await db.branches.create_index("id", unique=True)
-        await db.branches.create_index("code", unique=True)
-        
-        # Currencies indexes
-        await db.currencies.create_index("id", unique=True)
-        await db.currencies.create_index("code", unique=True)
-        
-        # Daily Stock Snapshots indexes - for exact stock continuity
-        await db.daily_stock_snapshots.create_index("id", unique=True)
-        await db.daily_stock_snapshots.create_index([("branch_id", 1), ("date", 1), ("currency_code", 1)], unique=True)
-        await db.daily_stock_snapshots.create_index("date")
-        
-        logger.info("Database indexes created successfully")
+        # Backfill search_keys for customers created before /customers/search existed
+        operations = []
+        backfilled = 0
+        cursor = db.customers.find(
+            {"search_keys": {"$exists": False}},
+            {"_id": 0, "id": 1, **{field: 1 for field in CUSTOMER_SEARCH_FIELDS}}
+        )
+        async for customer in cursor:
+            operations.append(UpdateOne(
+                {"id": customer["id"]},
+                {"$set": {"search_keys": build_customer_search_keys(customer)}}
+            ))
+            if len(operations) >= 1000:
+                await db.customers.bulk_write(operations, ordered=False)
+                backfilled += len(operations)
+                operations = []
+        if operations:
+            await db.customers.bulk_write(operations, ordered=False)
+            backfilled += len(operations)
+        if backfilled:
+            logger.info(f"Backfilled search_keys for {backfilled} customers")
+    except Exception as e:
+        logger.error(f"Error backfilling customer search keys: {e}")
+    
+    try:
+        # Legacy ISO-string activity log timestamps are converted by a background job
+        if await db.user_activity_logs.find_one({"timestamp": {"$type": "string"}}, {"_id": 1}):
+            await start_activity_log_timestamp_job()
+            logger.info("Started activity log timestamp migration")
     except Exception as e:
-        logger.error(f"Error creating indexes: {e}")
+        logger.error(f"Error starting activity log timestamp migration: {e}")
+    
+    try:
+        # Backfill the customer yearly stats once (deploy on top of existing transactions)
+        if not await db.customer_stats.find_one({}, {"_id": 1}) and \
+                await db.transactions.find_one({}, {"_id": 1}):
+            await start_customer_stats_job()
+            logger.info("Started customer stats backfill")
+    except Exception as e:
+        logger.error(f"Error starting customer stats backfill: {e}")
+    
+    try:
+        # Backfill the AML customer totals once (deploy on top of existing transactions)
+        if not await db.customer_period_totals.find_one({}, {"_id": 1}) and \
+                await db.transactions.find_one({}, {"_id": 1}):
+            await start_customer_period_totals_job()
+            logger.info("Started customer period totals backfill")
+    except Exception as e:
+        logger.error(f"Error starting customer period totals backfill: {e}")
+    
+    app.state.activity_log_retention_task = asyncio.create_task(activity_log_retention_loop())
+    app.state.presence_sweep_task = asyncio.create_task(presence_sweep_loop())
+    
+    if EVENT_SOURCE == "change_stream":
+        app.state.change_stream_task = asyncio.create_task(watch_change_stream_events())
+        logger.info("SSE events sourced from MongoDB change stream")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    change_stream_task = getattr(app.state, "change_stream_task", None)
+    if change_stream_task:
+        change_stream_task.cancel()
+    retention_task = getattr(app.state, "activity_log_retention_task", None)
+    if retention_task:
+        retention_task.cancel()
+    presence_sweep_task = getattr(app.state, "presence_sweep_task", None)
+    if presence_sweep_task:
+        presence_sweep_task.cancel()
+    await activity_log_writer.stop()
+    if manual_executor is not None:
+        manual_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
\ No newline at end of file
@@ -14,8 +14,75 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image as RLImage
 from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
 from datetime import datetime
+import hashlib
 import os
 
+try:
+    from PIL import Image
+except ImportError:  # Pillow missing: screenshots are embedded unprocessed
+    Image = None
+
+# Screenshots are placed 5.5" wide; 150 DPI keeps text legible in print
+SCREENSHOT_PRINT_WIDTH_INCHES = 5.5
+SCREENSHOT_DPI = 150
+SCREENSHOT_MAX_WIDTH_PX = int(SCREENSHOT_PRINT_WIDTH_INCHES * SCREENSHOT_DPI)
+SCREENSHOT_JPEG_QUALITY = 80
+SCREENSHOT_CACHE_DIR = os.environ.get(
+    "MANUAL_SCREENSHOT_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "static", "manual_cache", "screenshots")
+)
+
+def prepare_screenshot(path):
+    """
+    Return a copy of the screenshot resized to the print width and recompressed as JPEG.
+    Results are cached by content hash, so each image is processed once per change.
+    Falls back to the original file when Pillow is unavailable or the image can't be read.
+    """
+    if Image is None:
+        return path
+    with open(path, "rb") as f:
+        data = f.read()
+    settings = f"{SCREENSHOT_MAX_WIDTH_PX}:{SCREENSHOT_JPEG_QUALITY}".encode()
+    digest = hashlib.sha256(settings + data).hexdigest()[:24]
+    cached_path = os.path.join(SCREENSHOT_CACHE_DIR, f"{digest}.jpeg")
+    if os.path.exists(cached_path):
+        return cached_path
+    
+    try:
+        with Image.open(path) as img:
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            if img.width > SCREENSHOT_MAX_WIDTH_PX:
+                height = round(img.height * SCREENSHOT_MAX_WIDTH_PX / img.width)
+                img = img.resize((SCREENSHOT_MAX_WIDTH_PX, height), Image.LANCZOS)
+            os.makedirs(SCREENSHOT_CACHE_DIR, exist_ok=True)
+            # Unique temp name: the DOCX and PDF builds may run in parallel processes
+            temp_path = f"{cached_path}.{os.getpid()}.tmp"
+            img.save(temp_path, "JPEG", quality=SCREENSHOT_JPEG_QUALITY, optimize=True, progressive=True,
+                     dpi=(SCREENSHOT_DPI, SCREENSHOT_DPI))
+    except Exception as e:
+        print(f"Warning: Could not optimize image {path}: {str(e)}")
+        return path
+    
+    if os.path.getsize(temp_path) >= len(data):
+        # Already small enough - cache the original bytes so it isn't re-encoded next build
+        with open(temp_path, "wb") as f:
+            f.write(data)
+    os.replace(temp_path, cached_path)
+    return cached_path
+
+def add_picture(doc, screenshot_file, width=Inches(SCREENSHOT_PRINT_WIDTH_INCHES)):
+    """Add a centered, print-optimized screenshot paragraph"""
+    p = doc.add_paragraph()
+    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    p.add_run().add_picture(prepare_screenshot(screenshot_file), width=width)
+    return p
+
 def get_screenshot_path(base_dir, filename):
     """Get screenshot path, prefer .jpeg over .png"""
     jpeg_path = os.path.join(base_dir, filename.replace('.png', '.jpeg'))
@@ -66,16 +133,15 @@ def add_step_with_screenshot(doc, step_number, title, description, visual_note="
     # Description
     doc.add_paragraph(description)
     
+    # Prefer the .jpeg variant of a screenshot when one exists
+    if screenshot_file:
+        screenshot_file = get_screenshot_path(os.path.dirname(screenshot_file), os.path.basename(screenshot_file))
+    
     # Add screenshot if file exists
-    if screenshot_file and os.path.exists(screenshot_file):
+    if screenshot_file:
         try:
-            # Add centered paragraph for image
-            p_img = doc.add_paragraph()
-            p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
             # Add image with reasonable width (5.5 inches for good visibility)
-            run = p_img.add_run()
-            run.add_picture(screenshot_file, width=Inches(5.5))
+            add_picture(doc, screenshot_file)
             
             # Add caption
             caption = doc.add_paragraph()
@@ -705,9 +771,7 @@ def create_enhanced_user_manual_docx(output_path: str):
     
     # Add screenshot untuk Settings page overview
     if os.path.exists(os.path.join(screenshots_base, "45_settings_company_tab.jpeg")):
-        p = doc.add_paragraph()
-        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        p.add_run().add_picture(os.path.join(screenshots_base, "45_settings_company_tab.jpeg"), width=Inches(5.5))
+        add_picture(doc, os.path.join(screenshots_base, "45_settings_company_tab.jpeg"))
         caption = doc.add_paragraph()
         caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
         runner = caption.add_run("Gambar: Halaman Pengaturan - Tab Perusahaan")
@@ -744,9 +808,7 @@ def create_enhanced_user_manual_docx(output_path: str):
     
     # Add screenshot untuk Maintenance tab
     if os.path.exists(os.path.join(screenshots_base, "51_settings_maintenance_tab.jpeg")):
-        p = doc.add_paragraph()
-        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        p.add_run().add_picture(os.path.join(screenshots_base, "51_settings_maintenance_tab.jpeg"), width=Inches(5.5))
+        add_picture(doc, os.path.join(screenshots_base, "51_settings_maintenance_tab.jpeg"))
         caption = doc.add_paragraph()
         caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
         runner = caption.add_run("Gambar: Tab Maintenance dengan Tools Migrasi Format Tanggal")
@@ -1,5 +1,6 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import api from '../utils/api';
+import { subscribe, isStreamConnected } from '../utils/events';
 import { toast } from 'sonner';
 import { Activity, User, Clock, LogIn, LogOut, Filter, RefreshCw, Circle } from 'lucide-react';
 import { format } from 'date-fns';
@@ -48,12 +49,54 @@ const ActivityLog = () => {
 
   useEffect(() => {
     fetchData();
-    
-    // Auto refresh every 60 seconds
-    const interval = setInterval(fetchData, 60000);
-    return () => clearInterval(interval);
   }, [fetchData]);
 
+  // New log entries are announced over SSE (debounced re-read); poll only while the stream is down
+  const fetchLogsRef = useRef(fetchData);
+  const logsTimer = useRef(null);
+  fetchLogsRef.current = fetchData;
+  useEffect(() => {
+    const unsubscribe = subscribe('activity_logged', () => {
+      clearTimeout(logsTimer.current);
+      logsTimer.current = setTimeout(() => fetchLogsRef.current(), 2000);
+    });
+    const interval = setInterval(() => {
+      if (!isStreamConnected()) fetchLogsRef.current();
+    }, 60000);
+    return () => {
+      unsubscribe();
+      clearInterval(interval);
+      clearTimeout(logsTimer.current);
+    };
+  }, []);
+
+  // Online status is pushed (login / entering or leaving the online window) instead of polled
+  useEffect(() => {
+    const setOnline = (userId, changes) => {
+      setUserStatus(prev => {
+        const users = prev.users.map(u => (u.id === userId ? { ...u, ...changes } : u));
+        return {
+          ...prev,
+          users,
+          online_count: users.filter(u => u.is_online).length
+        };
+      });
+    };
+    const unsubscribeOnline = subscribe('user_online', (onlineUser) => {
+      setOnline(onlineUser.id, {
+        is_online: true,
+        ...(onlineUser.last_login ? { last_login: onlineUser.last_login } : {})
+      });
+    });
+    const unsubscribeOffline = subscribe('user_offline', (offlineUser) => {
+      setOnline(offlineUser.id, { is_online: false });
+    });
+    return () => {
+      unsubscribeOnline();
+      unsubscribeOffline();
+    };
+  }, []);
+
   const getActionIcon = (action) => {
     switch (action) {
       case 'login':
@@ -162,7 +205,7 @@ const ActivityLog = () => {
                   {user.role}
                 </span>
                 <span className={`text-xs ${user.is_online ? 'text-emerald-400' : 'text-gray-500'}`}>
-                  {user.is_online ? 'Online' : formatRelativeTime(user.last_login)}
+                  {user.is_online ? 'Online' : formatRelativeTime(user.last_seen || user.last_login)}
                 </span>
               </div>
             </div>
@@ -1,5 +1,6 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import api from '../utils/api';
+import { subscribe, isStreamConnected } from '../utils/events';
 import { Bell } from 'lucide-react';
 import { Popover, PopoverContent, PopoverTrigger } from './ui/popover';
 import { format } from 'date-fns';
@@ -10,19 +11,55 @@ const NotificationBell = () => {
   const { t } = useTranslation();
   const [notifications, setNotifications] = useState([]);
   const [unreadCount, setUnreadCount] = useState(0);
+  // Cursor of the newest notification received - polls only ask for newer ones
+  const lastCursor = useRef(null);
 
   useEffect(() => {
     fetchNotifications();
-    // Poll for new notifications every 30 seconds
-    const interval = setInterval(fetchNotifications, 30000);
-    return () => clearInterval(interval);
+    // New notifications are pushed over SSE; polling is only a fallback while the stream is down
+    const unsubscribe = subscribe('notification', (notif) => addNotifications([notif]));
+    // Alerts of deleted transactions are retracted
+    const unsubscribeRetracted = subscribe('notification_retracted', ({ id }) => {
+      setNotifications(prev => prev.filter(n => n.id !== id));
+    });
+    const interval = setInterval(() => {
+      if (!isStreamConnected()) fetchNotifications();
+    }, 30000);
+    return () => {
+      unsubscribe();
+      unsubscribeRetracted();
+      clearInterval(interval);
+    };
   }, []);
 
+  // Notifications already in the list - polls re-read an overlap window, so repeats are dropped here
+  const seenIds = useRef(new Set());
+
+  const addNotifications = (newItems) => {
+    // Cursors are "<created_at>|<id>" strings that sort in feed order
+    newItems.forEach((n) => {
+      if (!lastCursor.current || n.cursor > lastCursor.current) lastCursor.current = n.cursor;
+    });
+    const fresh = newItems.filter((n) => !seenIds.current.has(n.id));
+    if (fresh.length === 0) return;
+    fresh.forEach((n) => seenIds.current.add(n.id));
+    setNotifications(prev => [...fresh, ...prev].slice(0, 10));
+    setUnreadCount(prev => Math.min(prev + fresh.length, 10));
+  };
+
   const fetchNotifications = async () => {
     try {
-      const response = await api.get('/notifications/recent');
-      setNotifications(response.data);
-      setUnreadCount(response.data.length);
+      // The first page of a poll overlaps the cursor a little; later pages continue strictly
+      // after the newest alert of the previous page until the feed is drained
+      const pageSize = 10;
+      let params = lastCursor.current ? { after: lastCursor.current, overlap: true, limit: pageSize } : {};
+      while (true) {
+        const response = await api.get('/notifications/recent', { params });
+        const items = response.data || [];
+        addNotifications(items);
+        if (!params.after || items.length < pageSize) break;
+        params = { after: items[0].cursor, limit: pageSize };
+      }
     } catch (error) {
       console.error('Failed to fetch notifications:', error);
     }
@@ -1,5 +1,6 @@
 import React, { createContext, useState, useContext, useEffect, useCallback } from 'react';
 import api from '../utils/api';
+import { closeEventStream } from '../utils/events';
 
 const AuthContext = createContext(null);
 
@@ -75,6 +76,7 @@ export const AuthProvider = ({ children }) => {
     setUser(null);
     setError(null);
     localStorage.removeItem('token');
+    closeEventStream();
   };
 
   const retry = () => {
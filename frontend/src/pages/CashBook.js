@@ -12,6 +12,10 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '.
 import { useAuth } from '../context/AuthContext';
 import { exportToExcel, exportToPDF, printTable } from '../utils/exportUtils';
 
+// Repair jobs are polled until they finish, but not forever
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_POLL_TIMEOUT_MS = 15 * 60 * 1000;
+
 const CashBook = () => {
   const { user } = useAuth();
   const [cashbook, setCashbook] = useState(null);
@@ -262,6 +266,20 @@ const CashBook = () => {
     }
   };
 
+  // Cashbook repairs run as background jobs - poll until the job finishes
+  const waitForJob = async (jobId) => {
+    const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+      const { data: job } = await api.get(`/jobs/${jobId}`);
+      if (job.status === 'completed') return job.result;
+      // Resumed by another job (after this one stalled) - follow that one instead
+      if (job.resumed_by) return waitForJob(job.resumed_by);
+      if (job.status === 'failed') throw new Error(job.error || 'Job gagal');
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+    throw new Error('Job masih berjalan, cek lagi nanti');
+  };
+
   const handleFixDataConsistency = async () => {
     if (!window.confirm('Apakah Anda yakin ingin memperbaiki data? Proses ini akan menyinkronkan Buku Kas dengan Transaksi.')) {
       return;
@@ -269,8 +287,9 @@ const CashBook = () => {
     
     setFixingData(true);
     try {
-      const response = await api.post('/admin/sync-cashbook');
-      toast.success(`Data berhasil diperbaiki! ${response.data.stats.updated} entry diupdate, ${response.data.stats.created} entry dibuat.`);
+      const response = await api.post('/migrate/sync-cashbook');
+      const result = await waitForJob(response.data.job_id);
+      toast.success(`Data berhasil diperbaiki! ${result.stats.updated} entry diupdate, ${result.stats.created} entry dibuat.`);
       
       // Re-check consistency
       await handleCheckDataConsistency();
@@ -304,7 +323,8 @@ Apakah Anda yakin ingin melanjutkan?`;
     setFixingData(true);
     try {
       const response = await api.post(`/admin/recalculate-cashbook-from-transactions?date=${periodDate}`);
-      toast.success(`Berhasil! ${response.data.stats.deleted} entry dihapus, ${response.data.stats.recreated} entry dibuat ulang.`);
+      const result = await waitForJob(response.data.job_id);
+      toast.success(`Berhasil! ${result.stats.deleted} entry dihapus, ${result.stats.recreated} entry dibuat ulang.`);
       
       // Refresh cashbook
       fetchCashbook();
@@ -312,7 +332,7 @@ Apakah Anda yakin ingin melanjutkan?`;
       // Re-check consistency
       await handleCheckDataConsistency();
     } catch (error) {
-      toast.error(error.response?.data?.detail || 'Gagal menghitung ulang data');
+      toast.error(error.response?.data?.detail || error.message || 'Gagal menghitung ulang data');
       console.error(error);
     } finally {
       setFixingData(false);
@@ -15,6 +15,8 @@ import { exportToExcel, exportToPDF, printTable } from '../utils/exportUtils';
 import MemberCard from '../components/MemberCard';
 import TransactionBook from '../components/TransactionBook';
 
+const TRANSACTION_PAGE_SIZE = 100;
+
 const CustomersNew = () => {
   const { user } = useAuth();
   const [customers, setCustomers] = useState([]);
@@ -28,6 +30,7 @@ const CustomersNew = () => {
   const [ytdSummary, setYtdSummary] = useState(null);
   const [loadingTransactions, setLoadingTransactions] = useState(false);
   const [transactionsLoaded, setTransactionsLoaded] = useState(false);
+  const [transactionsPagination, setTransactionsPagination] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
   const [customerType, setCustomerType] = useState('perorangan');
   const [filterType, setFilterType] = useState('');
@@ -141,20 +144,30 @@ const CustomersNew = () => {
     setCustomerTransactions([]);
     setYtdSummary(null);
     setTransactionsLoaded(false);
+    setTransactionsPagination(null);
     setShowProfileDialog(true);
   };
 
-  const loadCustomerTransactions = async (customerId) => {
+  // The history is paginated - the first page is loaded on demand, later pages via "Muat Lebih Banyak"
+  const loadCustomerTransactions = async (customerId, page = 1) => {
     setLoadingTransactions(true);
     try {
-      const response = await api.get(`/customers/${customerId}/transactions`);
-      setCustomerTransactions(response.data.transactions || []);
+      const response = await api.get(`/customers/${customerId}/transactions`, {
+        params: { page, page_size: TRANSACTION_PAGE_SIZE }
+      });
+      const transactions = response.data.transactions || [];
+      setCustomerTransactions((prev) => (page === 1 ? transactions : prev.concat(transactions)));
       setYtdSummary(response.data.ytd_summary || null);
+      setTransactionsPagination(response.data.pagination || null);
       setTransactionsLoaded(true);
-      toast.success(`Berhasil memuat ${response.data.transactions?.length || 0} transaksi`);
+      if (page === 1) {
+        toast.success(`Berhasil memuat ${transactions.length} dari ${response.data.pagination?.total ?? transactions.length} transaksi`);
+      }
     } catch (error) {
-      setCustomerTransactions([]);
-      setYtdSummary(null);
+      if (page === 1) {
+        setCustomerTransactions([]);
+        setYtdSummary(null);
+      }
       toast.error('Gagal memuat transaksi');
     } finally {
       setLoadingTransactions(false);
@@ -618,12 +631,27 @@ const CustomersNew = () => {
                       </Button>
                     </div>
                   ) : (
-                    <TransactionBook 
-                      customer={selectedCustomer} 
-                      transactions={customerTransactions}
-                      companySettings={companySettings}
-                      ytdSummary={ytdSummary}
-                    />
+                    <>
+                      <TransactionBook 
+                        customer={selectedCustomer} 
+                        transactions={customerTransactions}
+                        companySettings={companySettings}
+                        ytdSummary={ytdSummary}
+                      />
+                      {transactionsPagination && transactionsPagination.page < transactionsPagination.total_pages && (
+                        <div className="flex justify-center mt-4">
+                          <Button
+                            onClick={() => loadCustomerTransactions(selectedCustomer.id, transactionsPagination.page + 1)}
+                            disabled={loadingTransactions}
+                            className="btn-secondary px-8"
+                          >
+                            {loadingTransactions
+                              ? 'Memuat...'
+                              : `Muat Lebih Banyak (${customerTransactions.length} dari ${transactionsPagination.total})`}
+                          </Button>
+                        </div>
+                      )}
+                    </>
                   )}
                 </TabsContent>
 
@@ -1,7 +1,8 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { useAuth } from '../context/AuthContext';
 import { useTranslation } from 'react-i18next';
 import api from '../utils/api';
+import { subscribe } from '../utils/events';
 import { toast } from 'sonner';
 import {
   TrendingUp,
@@ -20,10 +21,33 @@ const Dashboard = () => {
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [companyName, setCompanyName] = useState('Mulia Bali Valuta (MBA Money Changer)');
+  const refetchTimer = useRef(null);
 
   useEffect(() => {
     fetchDashboardStats();
     fetchCompanySettings();
+    // Apply pushed transactions as deltas instead of re-fetching /dashboard/stats
+    const unsubscribeCreated = subscribe('transaction_created', (trx) => {
+      setStats(prev => prev && {
+        ...prev,
+        total_transactions_today: (prev.total_transactions_today || 0) + 1,
+        total_revenue_today: (prev.total_revenue_today || 0) + (trx.total_idr || 0),
+        recent_transactions: [trx, ...(prev.recent_transactions || [])].slice(0, 5)
+      });
+    });
+    // Edits and deletes can't be applied as deltas - re-read the stats once the burst settles
+    const scheduleRefetch = () => {
+      clearTimeout(refetchTimer.current);
+      refetchTimer.current = setTimeout(fetchDashboardStats, 1000);
+    };
+    const unsubscribeUpdated = subscribe('transaction_updated', scheduleRefetch);
+    const unsubscribeDeleted = subscribe('transaction_deleted', scheduleRefetch);
+    return () => {
+      unsubscribeCreated();
+      unsubscribeUpdated();
+      unsubscribeDeleted();
+      clearTimeout(refetchTimer.current);
+    };
   }, []);
 
   const fetchDashboardStats = async () => {
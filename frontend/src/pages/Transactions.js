@@ -56,6 +56,7 @@ const Transactions = () => {
   
   // Customer search state
   const [customerSearch, setCustomerSearch] = useState('');
+  const [customerResults, setCustomerResults] = useState([]);
   
   const [formData, setFormData] = useState({
     customer_id: '',
@@ -106,32 +107,46 @@ const Transactions = () => {
 
   useEffect(() => {
     fetchInitialData();
-    fetchCompanySettings();
   }, []);
-  
-  const fetchCompanySettings = async () => {
-    try {
-      const response = await api.get('/settings/company');
-      setCompanySettings(response.data);
-    } catch (error) {
-      console.log('Using default company settings');
-    }
-  };
 
   useEffect(() => {
     fetchTransactions();
   }, [periodDate, filterBranch, filterCurrency]);
 
+  // Server-side customer lookup (debounced) so older customers outside the preloaded list are found
+  useEffect(() => {
+    if (!customerSearch || formData.customer_id) {
+      setCustomerResults([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await api.get('/customers/search', { params: { q: customerSearch, limit: 10, fields: 'summary' } });
+        const results = response.data || [];
+        setCustomerResults(results);
+        // Keep found customers available for selection display and receipt printing
+        setCustomers(prev => {
+          const known = new Set(prev.map(c => c.id));
+          const missing = results.filter(c => !known.has(c.id));
+          return missing.length > 0 ? [...prev, ...missing] : prev;
+        });
+      } catch (error) {
+        console.error('Error searching customers:', error);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [customerSearch, formData.customer_id]);
+
   const fetchInitialData = async () => {
     try {
-      const [customersRes, currenciesRes, branchesRes] = await Promise.all([
-        api.get('/customers'),
-        api.get('/currencies'),
-        api.get('/branches')
-      ]);
-      setCustomers(customersRes.data);
-      setCurrencies(currenciesRes.data);
-      setBranches(branchesRes.data);
+      // One request for all form reference data; the browser revalidates it via ETag (304 when unchanged)
+      const response = await api.get('/bootstrap', { params: { fields: 'summary' } });
+      setCustomers(response.data.customers);
+      setCurrencies(response.data.currencies);
+      setBranches(response.data.branches);
+      if (response.data.company_settings) {
+        setCompanySettings(response.data.company_settings);
+      }
     } catch (error) {
       console.error('Error fetching initial data:', error);
       toast.error('Gagal memuat data awal');
@@ -290,9 +305,8 @@ const Transactions = () => {
       
       toast.success('Nasabah berhasil ditambahkan dan dipilih');
       
-      // Refresh customers list
-      const customersRes = await api.get('/customers');
-      setCustomers(customersRes.data);
+      // Add the new customer locally instead of re-fetching the whole list
+      setCustomers(prev => [response.data, ...prev.filter(c => c.id !== response.data.id)]);
       
       // Auto-select the new customer in the form
       setFormData({ ...formData, customer_id: response.data.id });
@@ -522,18 +536,9 @@ const Transactions = () => {
       branchCustomers = customers.filter(c => c.branch_id === user.branch_id);
     }
     
-    // If search term exists, filter by search
+    // If search term exists, use server-side search results
     if (customerSearch && customerSearch.length > 0) {
-      const search = customerSearch.toLowerCase();
-      const filtered = branchCustomers.filter(c => 
-        (c.name || '').toLowerCase().includes(search) ||
-        (c.entity_name || '').toLowerCase().includes(search) ||
-        (c.customer_code || '').toLowerCase().includes(search) ||
-        (c.identity_number || '').toLowerCase().includes(search) ||
-        (c.phone || '').toLowerCase().includes(search)
-      );
-      // Return up to 10 results when searching
-      return filtered.slice(0, 10);
+      return customerResults;
     }
     
     // If no search, show max 10 most recent customers
@@ -544,7 +549,7 @@ const Transactions = () => {
       return dateB - dateA;
     });
     return sorted.slice(0, 10);
-  }, [customers, customerSearch, user]);
+  }, [customers, customerSearch, customerResults, user]);
 
   // Export functions
   const exportColumns = [
@@ -10,11 +10,27 @@ const api = axios.create({
   },
 });
 
+// POSTs that create transactions carry an Idempotency-Key so the automatic
+// retries below replay the first response instead of creating duplicates
+const IDEMPOTENT_POSTS = ['/transactions', '/transactions/multi'];
+
+const generateIdempotencyKey = () => {
+  if (window.crypto?.randomUUID) return window.crypto.randomUUID();
+  return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+};
+
 api.interceptors.request.use((config) => {
   const token = localStorage.getItem('token');
   if (token) {
     config.headers.Authorization = `Bearer ${token}`;
   }
+  if (
+    config.method === 'post' &&
+    IDEMPOTENT_POSTS.includes(config.url) &&
+    !config.headers['Idempotency-Key']
+  ) {
+    config.headers['Idempotency-Key'] = generateIdempotencyKey();
+  }
   return config;
 });
 
@@ -30,6 +46,21 @@ api.interceptors.response.use(
       return Promise.reject(error);
     }
     
+    // 409 with Retry-After on an idempotent POST: the first attempt (e.g. one that hit the
+    // client timeout) is still running - retry with the same key until it is replayed or fails
+    if (
+      error.response?.status === 409 &&
+      error.response.headers?.['retry-after'] &&
+      originalRequest.headers?.['Idempotency-Key']
+    ) {
+      originalRequest._inProgressRetries = (originalRequest._inProgressRetries || 0) + 1;
+      if (originalRequest._inProgressRetries <= 30) {
+        const delay = Math.min(1000 * Math.pow(2, originalRequest._inProgressRetries - 1), 10000);
+        await new Promise(resolve => setTimeout(resolve, delay));
+        return api(originalRequest);
+      }
+    }
+    
     // Don't retry for client errors (4xx except 401)
     if (error.response?.status >= 400 && error.response?.status < 500) {
       return Promise.reject(error);
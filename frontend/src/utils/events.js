@@ -0,0 +1,102 @@
+// Shared Server-Sent Events connection (/api/events/stream).
+// Components subscribe to named events instead of polling; one EventSource per tab.
+import api from './api';
+
+const API_URL = process.env.REACT_APP_BACKEND_URL;
+const RECONNECT_DELAY_MS = 5000;
+
+let source = null;
+let connecting = false;
+let reconnectTimer = null;
+const listeners = {};
+// Event names with a listener on the current source - each is attached once per source
+let attached = new Set();
+
+const connect = async () => {
+  const token = localStorage.getItem('token');
+  if (source || connecting || !token || typeof EventSource === 'undefined') return;
+
+  connecting = true;
+  try {
+    // The stream is opened with a single-use ticket so the JWT never appears in a URL
+    const { data } = await api.post('/events/ticket');
+    if (!hasListeners()) return;  // everyone unsubscribed while the ticket was fetched
+    source = new EventSource(`${API_URL}/api/events/stream?ticket=${encodeURIComponent(data.ticket)}`);
+    attached = new Set();
+    // A ticket only works once, so the browser's own reconnect cannot succeed -
+    // close and reconnect with a fresh ticket instead (also after auth_expired)
+    source.onerror = reconnect;
+    source.addEventListener('auth_expired', reconnect);
+    Object.keys(listeners).forEach((eventName) => attach(eventName));
+  } catch {
+    scheduleReconnect();
+  } finally {
+    connecting = false;
+  }
+};
+
+const scheduleReconnect = () => {
+  if (reconnectTimer) return;
+  reconnectTimer = setTimeout(() => {
+    reconnectTimer = null;
+    if (hasListeners()) connect();
+  }, RECONNECT_DELAY_MS);
+};
+
+const reconnect = () => {
+  if (source) {
+    source.close();
+    source = null;
+  }
+  scheduleReconnect();
+};
+
+const hasListeners = () => Object.keys(listeners).length > 0;
+
+const attach = (eventName) => {
+  if (attached.has(eventName)) return;
+  attached.add(eventName);
+  source.addEventListener(eventName, (e) => {
+    let data;
+    try {
+      data = JSON.parse(e.data);
+    } catch {
+      return;
+    }
+    (listeners[eventName] || []).forEach((handler) => handler(data));
+  });
+};
+
+export const subscribe = (eventName, handler) => {
+  if (!listeners[eventName]) {
+    listeners[eventName] = [];
+    if (source) attach(eventName);
+  }
+  listeners[eventName].push(handler);
+  connect();
+
+  return () => {
+    const remaining = (listeners[eventName] || []).filter((h) => h !== handler);
+    if (remaining.length > 0) {
+      listeners[eventName] = remaining;
+    } else {
+      delete listeners[eventName];
+    }
+    // Last listener gone - stop the stream instead of reconnecting with new tickets forever
+    if (!hasListeners()) closeEventStream();
+  };
+};
+
+// True while the stream is open - polling fallbacks can skip their request
+export const isStreamConnected = () => !!source && source.readyState === 1;
+
+export const closeEventStream = () => {
+  if (reconnectTimer) {
+    clearTimeout(reconnectTimer);
+    reconnectTimer = null;
+  }
+  if (source) {
+    source.close();
+    source = null;
+  }
+};
@@ -0,0 +1,27 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# server.py reads these at import time; the Motor client connects lazily and is never used
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+from .fake_mongo import FakeDatabase  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database installed as server.db"""
+    fake = FakeDatabase()
+    monkeypatch.setattr(server, "db", fake)
+    return fake
+
+
+@pytest.fixture
+def admin():
+    return server.User(email="admin@example.com", name="Admin", role=server.UserRole.ADMIN)
@@ -0,0 +1,359 @@
+"""
+In-memory stand-in for the Motor collections used by backend/server.py.
+
+Covers the query/update operators the server uses, with Mongo's comparison rules:
+range operators only match values of the same BSON type, and sorts order mixed types
+by type first (numbers < strings < datetimes), which is what the server has to cope
+with for transaction_date.
+"""
+import copy
+import itertools
+import re
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+_object_ids = itertools.count(1)
+
+
+def _type_rank(value):
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _bson(value):
+    """Mongo stores datetimes as naive UTC"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _sort_key(value):
+    return (_type_rank(value), _bson(value) if value is not None else 0)
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _comparable(a, b):
+    return a is not None and b is not None and _type_rank(a) == _type_rank(b)
+
+
+def _matches_operators(value, present, operators):
+    for op, arg in operators.items():
+        if op == "$ne":
+            if value == arg:
+                return False
+        elif op == "$eq":
+            if value != arg:
+                return False
+        elif op == "$in":
+            if value not in arg:
+                return False
+        elif op == "$nin":
+            if value in arg:
+                return False
+        elif op == "$exists":
+            if present != bool(arg):
+                return False
+        elif op == "$regex":
+            if not isinstance(value, str) or not re.search(arg, value, re.I if "i" in operators.get("$options", "") else 0):
+                return False
+        elif op == "$options":
+            continue
+        elif op == "$type":
+            expected = {"string": 3, "date": 9, "double": 2, "int": 2, "number": 2, "null": 1}[arg]
+            if not present or _type_rank(value) != expected:
+                return False
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if not _comparable(value, arg):
+                return False
+            value, arg = _bson(value), _bson(arg)
+            if op == "$gt" and not value > arg:
+                return False
+            if op == "$gte" and not value >= arg:
+                return False
+            if op == "$lt" and not value < arg:
+                return False
+            if op == "$lte" and not value <= arg:
+                return False
+        else:
+            raise NotImplementedError(op)
+    return True
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value, present = _get(doc, key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if not _matches_operators(value, present, condition):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        keep = included + ([] if projection.get("_id") == 0 else ["_id"])
+        return {k: doc[k] for k in keep if k in doc}
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+def _set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def apply_update(doc, update, inserting=False):
+    for path, value in update.get("$set", {}).items():
+        _set_path(doc, path, copy.deepcopy(value))
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            _set_path(doc, path, copy.deepcopy(value))
+    for path, value in update.get("$inc", {}).items():
+        current, _ = _get(doc, path)
+        _set_path(doc, path, (current or 0) + value)
+    for path, value in update.get("$max", {}).items():
+        current, _ = _get(doc, path)
+        if current is None or _sort_key(value) > _sort_key(current):
+            _set_path(doc, path, value)
+    for path in update.get("$unset", {}):
+        doc.pop(path, None)
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCursor:
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, str) else list(key)
+        for field, field_direction in reversed(keys):
+            self._docs.sort(key=lambda d: _sort_key(_get(d, field)[0]), reverse=field_direction == -1)
+        return self
+
+    def skip(self, count):
+        self._docs = self._docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    async def to_list(self, length):
+        docs = self._docs[:length] if length else self._docs
+        return [project(d, self._projection) for d in docs]
+
+    def __aiter__(self):
+        self._iter = (project(d, self._projection) for d in self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, name, unique_keys=()):
+        self.name = name
+        self.docs = []
+        self.unique_keys = unique_keys
+
+    def _check_unique(self, doc, ignore=None):
+        for keys in [("_id",), *self.unique_keys]:
+            for other in self.docs:
+                if other is not ignore and all(other.get(k) == doc.get(k) for k in keys):
+                    raise DuplicateKeyError(f"E11000 duplicate key in {self.name}")
+
+    def _insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", next(_object_ids))
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return doc
+
+    def find(self, query=None, projection=None, sort=None, **kwargs):
+        cursor = FakeCursor([d for d in self.docs if matches(d, query)], projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor
+
+    async def find_one(self, query=None, projection=None, sort=None, **kwargs):
+        docs = await self.find(query, projection, sort=sort).limit(1).to_list(1)
+        return docs[0] if docs else None
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs if matches(d, query))
+
+    async def insert_one(self, doc):
+        inserted = self._insert(doc)
+        doc["_id"] = inserted["_id"]
+        return Result(inserted_id=inserted["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        ids = []
+        for doc in docs:
+            inserted = self._insert(doc)
+            doc["_id"] = inserted["_id"]
+            ids.append(inserted["_id"])
+        return Result(inserted_ids=ids)
+
+    def _upsert_doc(self, query, update):
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        apply_update(doc, update, inserting=True)
+        return self._insert(doc)
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                before = copy.deepcopy(doc)
+                apply_update(doc, update)
+                return Result(matched_count=1, modified_count=int(before != doc), upserted_id=None)
+        if upsert:
+            doc = self._upsert_doc(query, update)
+            return Result(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update):
+        modified = 0
+        for doc in self.docs:
+            if matches(doc, query):
+                before = copy.deepcopy(doc)
+                apply_update(doc, update)
+                modified += int(before != doc)
+        return Result(modified_count=modified)
+
+    async def replace_one(self, query, replacement, upsert=False):
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                self.docs[index] = {"_id": doc["_id"], **copy.deepcopy(replacement)}
+                return Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = self._insert(replacement)
+            return Result(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=False, **kwargs):
+        candidates = FakeCursor([d for d in self.docs if matches(d, query)])
+        if sort:
+            candidates.sort(sort)
+        if candidates._docs:
+            doc = candidates._docs[0]
+            before = copy.deepcopy(doc)
+            apply_update(doc, update)
+            return project(doc if return_document else before, projection)
+        if upsert:
+            doc = self._upsert_doc(query, update)
+            return project(doc, projection) if return_document else None
+        return None
+
+    async def find_one_and_delete(self, query, projection=None, **kwargs):
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[index]
+                return project(doc, projection)
+        return None
+
+    async def delete_one(self, query):
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[index]
+                return Result(deleted_count=1)
+        return Result(deleted_count=0)
+
+    async def delete_many(self, query):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not matches(d, query)]
+        return Result(deleted_count=before - len(self.docs))
+
+    async def bulk_write(self, operations, ordered=True):
+        result = Result(inserted_count=0, matched_count=0, modified_count=0, upserted_count=0, deleted_count=0)
+        for operation in operations:
+            kind = type(operation).__name__
+            if kind == "InsertOne":
+                await self.insert_one(operation._doc)
+                result.inserted_count += 1
+            elif kind == "UpdateOne":
+                outcome = await self.update_one(operation._filter, operation._doc, upsert=bool(operation._upsert))
+                result.matched_count += outcome.matched_count
+                result.modified_count += outcome.modified_count
+                result.upserted_count += int(outcome.upserted_id is not None)
+            elif kind == "DeleteOne":
+                result.deleted_count += (await self.delete_one(operation._filter)).deleted_count
+            elif kind == "DeleteMany":
+                result.deleted_count += (await self.delete_many(operation._filter)).deleted_count
+            else:
+                raise NotImplementedError(kind)
+        return result
+
+    async def create_index(self, *args, **kwargs):
+        return None
+
+
+class FakeDatabase:
+    """Collections are created on first access, with the server's unique keys declared"""
+
+    UNIQUE_KEYS = {
+        "customer_stats": [("customer_id", "year")],
+        "customer_period_totals": [("customer_id", "period_type", "period_key")],
+        "idempotency_keys": [("user_id", "key")],
+    }
+
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.UNIQUE_KEYS.get(name, ()))
+        return self._collections[name]
+
+    def __getitem__(self, name):
+        return getattr(self, name)
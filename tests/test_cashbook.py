@@ -0,0 +1,51 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import server
+
+
+def add_entry(db, branch_id, date, entry_type, amount, **extra):
+    db.cashbook_entries.docs.append({
+        "id": str(uuid.uuid4()), "branch_id": branch_id, "date": date, "entry_type": entry_type,
+        "amount": amount, "description": "kas", "created_at": "2025-03-01T00:00:00+00:00", **extra,
+    })
+
+
+def seed(db):
+    db.branches.docs.extend([
+        {"id": "B1", "code": "A", "name": "Satu", "is_active": True, "opening_balance": 0.1},
+        {"id": "B2", "code": "B", "name": "Dua", "is_active": True, "opening_balance": 0.2},
+    ])
+    add_entry(db, "B1", datetime(2025, 2, 28, 9), "debit", 10.0)
+    add_entry(db, "B1", "2025-02-28T10:00:00Z", "credit", 2.5)
+    add_entry(db, "B1", datetime(2025, 3, 1, 9), "debit", 0.1)
+    add_entry(db, "B1", "2025-03-01T23:00:00+00:00", "credit", 0.05)
+    add_entry(db, "B1", datetime(2025, 3, 2, 1), "debit", 99.0)
+    add_entry(db, "B1", datetime(2025, 3, 1, 8), "debit", 50.0, is_deleted=True)
+    add_entry(db, "B2", "2025-02-27T08:00:00", "debit", 0.2)
+    add_entry(db, "B2", datetime(2025, 3, 1, 12), "debit", 0.2)
+    add_entry(db, "B3", datetime(2025, 3, 1, 12), "debit", 1000.0)
+
+
+def test_day_filter_covers_datetime_and_string_dates(db):
+    seed(db)
+    cashbook = asyncio.run(server.build_cashbook("B1", "2025-03-01"))
+
+    assert [entry["amount"] for entry in cashbook["entries"]] == [0.1, 0.05]
+    assert cashbook["opening_balance"] == 7.6
+    assert cashbook["balance"] == 7.65
+
+
+def test_consolidated_total_is_summed_in_minor_units(db, admin):
+    seed(db)
+    response = asyncio.run(server.get_consolidated_cashbook(period_date="2025-03-01", current_user=admin))
+    body = server.json.loads(response.body)
+
+    assert [row["branch_id"] for row in body["branches"]] == ["B1", "B2"]
+    assert [row["balance"] for row in body["branches"]] == [7.65, 0.6]
+    # Summing the per-branch floats would give total_debit 0.1 + 0.2 == 0.30000000000000004
+    assert [row["total_debit"] for row in body["branches"]] == [0.1, 0.2]
+    assert body["total"] == {
+        "opening_balance": 8.0, "total_debit": 0.3, "total_credit": 0.05, "balance": 8.25, "entry_count": 3
+    }
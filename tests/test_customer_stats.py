@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime
+
+import server
+
+
+def make_transaction(txn_id, date, total_idr, transaction_type="jual", customer_id="C1"):
+    return {
+        "id": txn_id,
+        "customer_id": customer_id,
+        "customer_name": "Budi",
+        "branch_id": "B1",
+        "transaction_type": transaction_type,
+        "transaction_date": date,
+        "total_idr": total_idr,
+        "is_deleted": False,
+    }
+
+
+def stats_for(db, year, customer_id="C1"):
+    return next(d for d in db.customer_stats.docs if d["customer_id"] == customer_id and d["year"] == year)
+
+
+def test_concurrent_first_transactions_are_each_counted_once(db):
+    first = make_transaction("T1", datetime(2025, 3, 1, 10), 1000.0)
+    second = make_transaction("T2", "2025-03-02T11:00:00", 2500.0, "beli")
+    db.transactions.docs.extend([dict(first), dict(second)])
+
+    async def run():
+        await asyncio.gather(server.record_customer_stats(first), server.record_customer_stats(second))
+    asyncio.run(run())
+
+    stats = stats_for(db, 2025)
+    assert stats["total_transactions"] == 2
+    assert stats["total_sell_idr"] == 1000.0
+    assert stats["total_buy_idr"] == 2500.0
+    assert stats["last_transaction_date"] == datetime(2025, 3, 2, 11)
+
+
+def test_edit_applies_the_net_change(db):
+    existing = make_transaction("T1", datetime(2025, 3, 1, 10), 1000.0)
+    db.transactions.docs.append(dict(existing))
+    asyncio.run(server.record_customer_stats(existing))
+
+    updated = {**existing, "total_idr": 1750.5}
+    db.transactions.docs[0].update(updated)
+    asyncio.run(server.apply_customer_stats_changes(added=(updated,), removed=(existing,)))
+
+    stats = stats_for(db, 2025)
+    assert stats["total_transactions"] == 1
+    assert stats["total_sell_idr"] == 1750.5
+
+
+def test_edit_moving_a_transaction_to_another_year(db):
+    existing = make_transaction("T1", datetime(2025, 12, 31, 10), 1000.0)
+    db.transactions.docs.append(dict(existing))
+    asyncio.run(server.record_customer_stats(existing))
+
+    updated = {**existing, "transaction_date": datetime(2026, 1, 2, 9)}
+    db.transactions.docs[0].update(updated)
+    asyncio.run(server.apply_customer_stats_changes(added=(updated,), removed=(existing,)))
+
+    assert stats_for(db, 2025)["total_transactions"] == 0
+    assert stats_for(db, 2025)["last_transaction_date"] is None
+    assert stats_for(db, 2026)["total_sell_idr"] == 1000.0
+
+
+def test_delete_moves_last_transaction_date_back(db):
+    older = make_transaction("T1", "2025-03-01T10:00:00", 1000.0)
+    newer = make_transaction("T2", datetime(2025, 4, 1, 10), 2000.0)
+    db.transactions.docs.extend([dict(older), dict(newer)])
+    asyncio.run(server.apply_customer_stats_changes(added=(older, newer)))
+
+    db.transactions.docs[1]["is_deleted"] = True
+    asyncio.run(server.apply_customer_stats_changes(removed=(newer,)))
+
+    stats = stats_for(db, 2025)
+    assert stats["total_transactions"] == 1
+    assert stats["total_sell_idr"] == 1000.0
+    assert stats["last_transaction_date"] == datetime(2025, 3, 1, 10)
+
+
+def test_rebuild_matches_the_incremental_stats(db):
+    transactions = [
+        make_transaction("T1", "2025-03-01T10:00:00", 1000.1),
+        make_transaction("T2", datetime(2025, 4, 1, 10), 2000.2, "beli"),
+        make_transaction("T3", datetime(2024, 4, 1, 10), 300.0),
+    ]
+    db.transactions.docs.extend(dict(t) for t in transactions)
+    asyncio.run(server.apply_customer_stats_changes(added=tuple(transactions)))
+    incremental = {(d["customer_id"], d["year"]): d for d in map(dict, db.customer_stats.docs)}
+
+    asyncio.run(server.rebuild_customer_stats())
+
+    for key, expected in incremental.items():
+        rebuilt = stats_for(db, key[1], key[0])
+        for field in ("total_buy_idr", "total_sell_idr", "total_transactions", "last_transaction_date"):
+            assert rebuilt[field] == expected[field]
+
+
+def test_history_pages_are_ordered_across_string_and_datetime_dates(db, admin):
+    db.customers.docs.append({"id": "C1", "name": "Budi", "branch_id": "B1"})
+    for day in range(1, 11):
+        date = datetime(2025, 5, day, 9)
+        db.transactions.docs.append(make_transaction(f"T{day}", date.isoformat() if day % 2 else date, 100.0))
+
+    async def page(number):
+        response = await server.get_customer_transactions(
+            "C1", start_date="2025-01-01", page=number, page_size=4, current_user=admin
+        )
+        return response
+
+    pages = [asyncio.run(page(n)) for n in (1, 2, 3)]
+    ids = [t["id"] for p in pages for t in p["transactions"]]
+    assert ids == [f"T{day}" for day in range(10, 0, -1)]
+    assert pages[0]["pagination"]["total"] == 10
+    assert pages[0]["pagination"]["total_pages"] == 3
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+
+import server
+
+DAILY = server.AML_THRESHOLDS_IDR["daily"]
+
+
+def seed_reference_data(db):
+    db.customers.docs.append({"id": "C1", "name": "Budi", "branch_id": "B1", "customer_code": "N0001"})
+    db.currencies.docs.append({"id": "USD", "code": "USD", "name": "US Dollar"})
+
+
+def store_transaction(db, txn_id, total_idr, date=datetime(2025, 3, 1, 2)):
+    txn = {
+        "id": txn_id,
+        "transaction_number": f"TRX-{txn_id}",
+        "branch_id": "B1",
+        "customer_id": "C1",
+        "customer_name": "Budi",
+        "transaction_type": "jual",
+        "currency_id": "USD",
+        "currency_code": "USD",
+        "amount": total_idr / 10000,
+        "exchange_rate": 10000.0,
+        "total_idr": total_idr,
+        "transaction_date": date,
+        "created_at": date,
+        "user_id": "U1",
+        "is_deleted": False,
+    }
+    db.transactions.docs.append(dict(txn))
+    asyncio.run(server.track_customer_thresholds(txn))
+    return txn
+
+
+def edit(db, admin, txn_id, total_idr):
+    update = server.TransactionCreate(
+        customer_id="C1", transaction_type="jual", currency_id="USD", amount=total_idr / 10000, exchange_rate=10000.0
+    )
+    return asyncio.run(server.update_transaction(txn_id, update, current_user=admin))
+
+
+def daily_total(db):
+    return next(d for d in db.customer_period_totals.docs if d["period_type"] == "daily")["total_idr"]
+
+
+def alerts_of(db, alert_type):
+    return [a for a in db.alerts.docs if a["type"] == alert_type and "retracted_at" not in a]
+
+
+def test_crossing_the_threshold_raises_one_alert(db):
+    store_transaction(db, "T1", DAILY - 1000)
+    store_transaction(db, "T2", 2000)
+    assert len(alerts_of(db, "customer_threshold_daily")) == 1
+
+
+def test_edit_above_the_threshold_applies_the_net_change_without_a_new_alert(db, admin):
+    seed_reference_data(db)
+    store_transaction(db, "T1", DAILY)
+    assert len(alerts_of(db, "customer_threshold_daily")) == 1
+
+    edit(db, admin, "T1", DAILY + 10000)
+    edit(db, admin, "T1", DAILY + 20000)
+
+    assert daily_total(db) == DAILY + 20000
+    assert len(alerts_of(db, "customer_threshold_daily")) == 1
+
+
+def test_edit_that_crosses_the_threshold_alerts(db, admin):
+    seed_reference_data(db)
+    store_transaction(db, "T1", DAILY - 10000)
+    edit(db, admin, "T1", DAILY)
+    assert daily_total(db) == DAILY
+    assert len(alerts_of(db, "customer_threshold_daily")) == 1
+
+
+def test_large_transaction_alert_follows_edits_across_the_threshold(db, admin):
+    seed_reference_data(db)
+    large = server.LARGE_TRANSACTION_THRESHOLD_IDR
+    store_transaction(db, "T1", large - 10000)
+
+    edit(db, admin, "T1", large)
+    assert [a["transaction_id"] for a in alerts_of(db, "large_transaction")] == ["T1"]
+
+    edit(db, admin, "T1", large + 10000)
+    assert len(alerts_of(db, "large_transaction")) == 1
+
+    edit(db, admin, "T1", large - 10000)
+    assert alerts_of(db, "large_transaction") == []
+    retracted = [a for a in db.alerts.docs if a["type"] == "large_transaction"]
+    assert retracted[0]["retracted_reason"] == "transaction_edited"
+
+
+def test_removal_lowers_the_total(db):
+    txn = store_transaction(db, "T1", 5000)
+    asyncio.run(server.track_customer_thresholds(txn, sign=-1))
+    assert daily_total(db) == 0
@@ -0,0 +1,36 @@
+import server
+
+
+def received(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait()["event"])
+    return events
+
+
+def test_branch_events_reach_their_branch_and_admins_only():
+    broker = server.EventBroker()
+    admin = broker.subscribe(None, True)
+    branch_one = broker.subscribe("B1", False)
+    branch_two = broker.subscribe("B2", False)
+    no_branch = broker.subscribe(None, False)
+
+    broker.publish("transaction_created", {}, branch_id="B1")
+
+    assert received(admin) == ["transaction_created"]
+    assert received(branch_one) == ["transaction_created"]
+    assert received(branch_two) == []
+    assert received(no_branch) == []
+
+
+def test_events_without_a_branch_are_not_fanned_out_to_every_branch():
+    broker = server.EventBroker()
+    admin = broker.subscribe(None, True)
+    branch_one = broker.subscribe("B1", False)
+
+    broker.publish("notification", {})
+    broker.publish("user_online", {}, admin_only=True)
+    broker.publish("announcement", {}, broadcast=True)
+
+    assert received(admin) == ["notification", "user_online", "announcement"]
+    assert received(branch_one) == ["announcement"]
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+
+import server
+
+
+class Payload(BaseModel):
+    amount: float
+
+
+class Handler:
+    """Stands in for create_single_transaction: claims the write, writes, then runs side effects"""
+
+    def __init__(self, fail_before_write=False, fail_after_write=False):
+        self.calls = 0
+        self.writes = 0
+        self.fail_before_write = fail_before_write
+        self.fail_after_write = fail_after_write
+
+    async def __call__(self, before_write):
+        self.calls += 1
+        if self.fail_before_write:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        await before_write()
+        self.writes += 1
+        if self.fail_after_write:
+            raise RuntimeError("cashbook insert failed")
+        return {"id": f"T{self.calls}"}
+
+
+def run(handler, key="K1", amount=100.0, response=None):
+    return asyncio.run(server.run_idempotent(
+        key, "U1", "POST /transactions", Payload(amount=amount), handler, response or Response()
+    ))
+
+
+def test_retry_replays_the_stored_response(db):
+    handler = Handler()
+    first = run(handler)
+    response = Response()
+    second = run(handler, response=response)
+
+    assert second == first
+    assert handler.calls == 1
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+
+def test_same_key_with_a_different_request_is_rejected(db):
+    run(Handler())
+    with pytest.raises(HTTPException) as error:
+        run(Handler(), amount=200.0)
+    assert error.value.status_code == 422
+
+
+def test_live_request_answers_409_with_retry_after(db):
+    now = datetime.now(timezone.utc)
+    db.idempotency_keys.docs.append({
+        "user_id": "U1", "key": "K1", "endpoint": "POST /transactions",
+        "request_hash": server.hashlib.sha256(Payload(amount=100.0).model_dump_json().encode()).hexdigest(),
+        "status": "in_progress", "owner": "other", "created_at": now - timedelta(hours=1), "heartbeat_at": now,
+    })
+    handler = Handler()
+    with pytest.raises(HTTPException) as error:
+        run(handler)
+    assert error.value.status_code == 409
+    assert error.value.headers == {"Retry-After": "2"}
+    assert handler.calls == 0
+
+
+def test_claim_without_heartbeat_is_taken_over(db):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=server.IDEMPOTENCY_STALE_SECONDS + 1)
+    db.idempotency_keys.docs.append({
+        "user_id": "U1", "key": "K1", "endpoint": "POST /transactions",
+        "request_hash": server.hashlib.sha256(Payload(amount=100.0).model_dump_json().encode()).hexdigest(),
+        "status": "in_progress", "owner": "dead", "created_at": stale, "heartbeat_at": stale,
+    })
+    handler = Handler()
+    assert run(handler) == {"id": "T1"}
+    assert db.idempotency_keys.docs[0]["status"] == "completed"
+
+
+def test_taken_over_request_does_not_write(db):
+    handler = Handler()
+
+    async def lose_the_claim(before_write):
+        # Another request took the key over while this one was stalled
+        db.idempotency_keys.docs[0]["owner"] = "someone-else"
+        return await handler(before_write)
+
+    with pytest.raises(HTTPException) as error:
+        run(lose_the_claim)
+    assert error.value.status_code == 409
+    assert handler.writes == 0
+
+
+def test_failure_before_writing_frees_the_key(db):
+    with pytest.raises(HTTPException):
+        run(Handler(fail_before_write=True))
+    assert db.idempotency_keys.docs == []
+
+    handler = Handler()
+    assert run(handler) == {"id": "T1"}
+
+
+def test_failure_after_writing_is_reported_not_replayed_or_repeated(db):
+    with pytest.raises(RuntimeError):
+        run(Handler(fail_after_write=True))
+    assert db.idempotency_keys.docs[0]["status"] == "failed"
+
+    retry = Handler()
+    with pytest.raises(HTTPException) as error:
+        run(retry)
+    assert error.value.status_code == 409
+    assert error.value.headers is None
+    assert retry.calls == 0
@@ -0,0 +1,27 @@
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import server
+
+CONTENT = {
+    "created_at": datetime(2025, 3, 1, 2, 30, tzinfo=timezone.utc),
+    "total": np.float64(1.5),
+    "count": np.int64(3),
+    "series": np.array([1, 2]),
+}
+EXPECTED = {"created_at": "2025-03-01T02:30:00+00:00", "total": 1.5, "count": 3, "series": [1, 2]}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_raw_documents_keep_their_offset_and_numpy_values(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(server, "orjson", None)
+    elif server.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    body = server.FastJSONResponse(CONTENT).body
+
+    assert json.loads(body) == EXPECTED
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("value, units", [
+    (1.005, 101), (0.125, 13), (2.675, 268), (-1.005, -101), (1234567.89, 123456789), (None, 0), (0, 0),
+])
+def test_to_minor_rounds_half_up_on_the_decimal_value(value, units):
+    assert server.to_minor(value) == units
+
+
+def test_to_minor_agrees_with_the_product_rounding():
+    for value in (1.005, 0.125, 2.675, 99.995, 15123.455):
+        assert server.to_minor(value) == server.money_product_minor(value, 1)
+
+
+def test_money_product_minor_is_exact_where_floats_are_not():
+    assert 1.15 * 15000.5 * 100 != 1725057.5
+    assert server.money_product_minor(1.15, 15000.5) == 1725058
+    assert server.compute_total_idr(0.1, 3) == (0.3, 30)
+
+
+def test_minor_column_falls_back_to_the_same_rounding():
+    docs = [{"amount": 1.005}, {"amount": 2.675, "amount_minor": 267}, {"amount": None}]
+    assert server.minor_column(docs, "amount").tolist() == [101, 267, 0]
+    assert server.to_minor_array(np.array([0.125, 1.005])).tolist() == [13, 101]
+    assert server.sum_minor(docs, "amount") == sum(server.doc_minor(doc, "amount") for doc in docs)
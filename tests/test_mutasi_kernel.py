@@ -0,0 +1,162 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import server
+
+CURRENCIES = [{"code": code, "name": code, "symbol": ""} for code in ("USD", "SGD", "JPY")]
+START = datetime(2025, 3, 1)
+DAYS = 6
+# Rounded report values may land on either side of a rounding boundary: float sums vs exact sen
+TOLERANCE = {field: 0.011 if "valas" in field or field == "avg_rate" else 1.01 for field in server.MUTASI_KERNEL_FIELDS}
+
+
+def make_transactions(count=400, seed=7):
+    rng = random.Random(seed)
+    transactions = []
+    for i in range(count):
+        when = START - timedelta(days=3) + timedelta(seconds=rng.randint(0, (DAYS + 3) * 86400 - 1))
+        amount = rng.randint(1, 50000) / 100
+        style = i % 5
+        transactions.append({
+            "currency_code": rng.choice(["USD", "SGD", "JPY", "JPY", "XAU"]),
+            "transaction_type": rng.choice(["beli", "buy", "beli", "jual", "sell"]),
+            "amount": amount,
+            "total_idr": round(amount * rng.uniform(90, 17000), 2),
+            "transaction_date": (
+                when if style == 0 else
+                when.replace(tzinfo=server.timezone.utc) if style == 1 else
+                when.isoformat() + "Z" if style == 2 else
+                when.isoformat() + "+08:00" if style == 3 else
+                when.isoformat()
+            ),
+        })
+    transactions += [
+        {"currency_code": "USD", "transaction_type": "beli", "amount": 1.01, "total_idr": 15150.15,
+         "transaction_date": "2025-03-02T23:59:59"},
+        {"currency_code": "USD", "transaction_type": "beli", "amount": 2.02, "total_idr": 30300.3,
+         "transaction_date": datetime(2025, 3, 2, 23, 59, 59, 500000)},
+        {"currency_code": "USD", "transaction_type": "jual", "amount": 5.0, "total_idr": 80000.0,
+         "transaction_date": "not a date"},
+        {"currency_code": "SGD", "transaction_type": "beli", "amount": 7.0, "total_idr": 77000.0,
+         "transaction_date": None},
+    ]
+    return transactions
+
+
+def normalize_transaction_date(txn_date):
+    """build_mutasi_valas' per-row normalizer before the kernel"""
+    if txn_date is None:
+        return None
+    if isinstance(txn_date, datetime):
+        return txn_date.replace(tzinfo=None) if txn_date.tzinfo is not None else txn_date
+    if isinstance(txn_date, str):
+        try:
+            return datetime.fromisoformat(txn_date.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+
+def float_report(all_transactions, start_datetime, end_datetime, snapshots):
+    """
+    The float per-currency loops build_mutasi_valas ran before the kernel: Stock Awal from the
+    previous day's snapshot when there is one, else from every earlier transaction.
+    """
+    dated = [(normalize_transaction_date(t.get("transaction_date")), t) for t in all_transactions]
+    prev_transactions = [t for d, t in dated if d and d < start_datetime]
+    transactions = [t for d, t in dated if d and start_datetime <= d <= end_datetime]
+    rows = []
+    for currency in CURRENCIES:
+        code = currency["code"]
+        if code in snapshots:
+            beginning_stock_valas, beginning_stock_idr = snapshots[code]
+        else:
+            prev = [t for t in prev_transactions if t.get("currency_code") == code]
+            prev_buy_valas = sum(t["amount"] for t in prev if t.get("transaction_type") in ["beli", "buy"])
+            prev_buy_idr = sum(t["total_idr"] for t in prev if t.get("transaction_type") in ["beli", "buy"])
+            prev_sell_valas = sum(t["amount"] for t in prev if t.get("transaction_type") in ["jual", "sell"])
+            beginning_stock_valas = prev_buy_valas - prev_sell_valas
+            prev_avg_rate = prev_buy_idr / prev_buy_valas if prev_buy_valas > 0 else 0
+            beginning_stock_idr = beginning_stock_valas * prev_avg_rate
+        if beginning_stock_valas < 0:
+            beginning_stock_valas = 0.0
+            beginning_stock_idr = 0.0
+        if beginning_stock_idr < 0:
+            beginning_stock_idr = 0.0
+        current = [t for t in transactions if t.get("currency_code") == code]
+        purchase_valas = sum(t["amount"] for t in current if t.get("transaction_type") in ["beli", "buy"])
+        purchase_idr = sum(t["total_idr"] for t in current if t.get("transaction_type") in ["beli", "buy"])
+        sale_valas = sum(t["amount"] for t in current if t.get("transaction_type") in ["jual", "sell"])
+        sale_idr = sum(t["total_idr"] for t in current if t.get("transaction_type") in ["jual", "sell"])
+        ending_stock_valas = max(beginning_stock_valas + purchase_valas - sale_valas, 0.0)
+        total_valas_in = beginning_stock_valas + purchase_valas
+        avg_rate = (beginning_stock_idr + purchase_idr) / total_valas_in if total_valas_in > 0 else 0
+        ending_stock_idr = max(ending_stock_valas * avg_rate, 0.0)
+        rows.append({
+            "currency_code": code,
+            "beginning_stock_valas": beginning_stock_valas, "beginning_stock_idr": beginning_stock_idr,
+            "purchase_valas": purchase_valas, "purchase_idr": purchase_idr,
+            "sale_valas": sale_valas, "sale_idr": sale_idr,
+            "ending_stock_valas": ending_stock_valas, "ending_stock_idr": ending_stock_idr,
+            "avg_rate": avg_rate,
+            "profit_loss": (ending_stock_idr + sale_idr) - (beginning_stock_idr + purchase_idr),
+            "transaction_count": len(current),
+        })
+    return rows
+
+
+def assert_reports_match(kernel_rows, float_rows):
+    assert [row["currency_code"] for row in kernel_rows] == [row["currency_code"] for row in float_rows]
+    for kernel, expected in zip(kernel_rows, float_rows):
+        assert kernel["transaction_count"] == expected["transaction_count"]
+        for field, tolerance in TOLERANCE.items():
+            digits = 2 if tolerance < 1 else 0
+            assert round(kernel[field], digits) == pytest.approx(round(expected[field], digits), abs=tolerance), \
+                (kernel["currency_code"], field)
+
+
+def day_bounds(day):
+    start = START + timedelta(days=day)
+    return start, start + timedelta(hours=23, minutes=59, seconds=59)
+
+
+@pytest.fixture
+def transactions():
+    return make_transactions()
+
+
+@pytest.fixture
+def columns(transactions):
+    return server.load_mutasi_columns(transactions, [currency["code"] for currency in CURRENCIES])
+
+
+def test_period_report_matches_the_float_loops(transactions, columns):
+    n = len(CURRENCIES)
+    for start, end in (day_bounds(1), (START, day_bounds(DAYS - 1)[1]), (START - timedelta(days=10), day_bounds(0)[1])):
+        opening_valas, opening_idr = server.mutasi_opening_from_history(columns, n, start)
+        kernel = server.mutasi_rows(CURRENCIES, server.compute_mutasi_period(columns, n, start, end, opening_valas, opening_idr))
+        assert_reports_match(kernel, float_report(transactions, start, end, {}))
+
+
+def test_daily_matrix_matches_day_by_day_float_reports(transactions, columns):
+    matrix = server.compute_mutasi_daily(columns, len(CURRENCIES), START, DAYS)
+    snapshots = {}
+    for day in range(DAYS):
+        expected = float_report(transactions, *day_bounds(day), snapshots)
+        assert_reports_match(server.mutasi_rows(CURRENCIES, matrix, day), expected)
+        # Pre-kernel auto-save: a snapshot only for currencies with stock or activity that day
+        snapshots = {
+            row["currency_code"]: (row["ending_stock_valas"], row["ending_stock_idr"])
+            for row in expected
+            if row["purchase_valas"] > 0 or row["sale_valas"] > 0 or row["beginning_stock_valas"] > 0
+        }
+
+
+def test_mixed_dates_normalize_like_the_row_normalizer(transactions):
+    dates = [t["transaction_date"] for t in transactions]
+    expected = [normalize_transaction_date(value) for value in dates]
+    normalized = server.normalize_transaction_dates(dates)
+    assert [None if np.isnat(value) else value.astype(datetime) for value in normalized] == expected
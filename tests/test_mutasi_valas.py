@@ -0,0 +1,70 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+CURRENCIES = [{"id": code, "code": code, "name": code, "is_active": True} for code in ("USD", "SGD", "EUR")]
+
+
+def seed(db):
+    db.currencies.docs.extend(dict(c) for c in CURRENCIES)
+    db.branches.docs.append({"id": "B1", "name": "Pusat", "code": "HQ", "currency_balances": {}})
+
+
+def add_transaction(db, date, currency, transaction_type, amount, rate, branch_id="B1"):
+    db.transactions.docs.append({
+        "id": str(uuid.uuid4()), "branch_id": branch_id, "currency_code": currency,
+        "transaction_type": transaction_type, "amount": amount, "exchange_rate": rate,
+        "total_idr": round(amount * rate), "transaction_date": date, "is_deleted": False,
+    })
+
+
+def snapshot_version(db):
+    doc = next((d for d in db.collection_versions.docs if d["_id"] == "daily_stock_snapshots"), None)
+    return doc["version"] if doc else 0
+
+
+def build_day(day):
+    return asyncio.run(server.build_mutasi_valas("B1", day, day, day))
+
+
+def test_recalculating_an_unchanged_day_does_not_move_the_snapshot_etag(db):
+    seed(db)
+    add_transaction(db, datetime(2025, 3, 1, 2), "USD", "beli", 100.0, 15000.0)
+    add_transaction(db, "2025-03-01T03:00:00", "SGD", "beli", 50.0, 11000.0)
+
+    build_day("2025-03-01")
+    assert snapshot_version(db) == 1
+    assert len(db.daily_stock_snapshots.docs) == 2
+
+    build_day("2025-03-01")
+    assert snapshot_version(db) == 1
+
+    add_transaction(db, datetime(2025, 3, 1, 4), "USD", "jual", 40.0, 15500.0)
+    build_day("2025-03-01")
+    assert snapshot_version(db) == 2
+    usd = next(d for d in db.daily_stock_snapshots.docs if d["currency_code"] == "USD")
+    assert usd["ending_stock_valas_minor"] == 6000
+
+
+def ensure_unlocked(*dates):
+    return asyncio.run(server.ensure_mutasi_days_unlocked("B1", *dates))
+
+
+def test_days_with_a_stored_result_or_a_locked_snapshot_are_locked(db):
+    db.daily_mutasi_results.docs.append({"branch_id": "B1", "date": "2025-03-01", "mutasi_data": []})
+    # Locked before lock-day stored results: only the snapshot carries the lock
+    db.daily_stock_snapshots.docs.append({"branch_id": "B1", "date": "2025-03-02", "currency_code": "USD", "is_locked": True})
+    db.daily_stock_snapshots.docs.append({"branch_id": "B1", "date": "2025-03-03", "currency_code": "USD", "is_locked": False})
+
+    for day in (datetime(2025, 3, 1, 9), "2025-03-02T10:00:00+00:00"):
+        with pytest.raises(HTTPException) as error:
+            ensure_unlocked(day)
+        assert error.value.status_code == 409
+
+    ensure_unlocked("2025-03-03T10:00:00", datetime(2025, 3, 4), None)
+    assert asyncio.run(server.find_locked_mutasi_days("B2", ["2025-03-01", "2025-03-02"])) == []
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def insert_alert(db, alert_id, created_at):
+    db.alerts.docs.append({
+        "_id": alert_id, "id": alert_id, "type": "large_transaction", "title": "Transaksi Besar",
+        "message": alert_id, "branch_id": "B1", "created_at": created_at,
+    })
+
+
+def poll(admin, **params):
+    return asyncio.run(server.get_recent_notifications(current_user=admin, limit=params.pop("limit", 3), **params))
+
+
+def drain(admin, cursor):
+    """The NotificationBell loop: one overlapping page, then strict pages until a short one"""
+    seen = []
+    page = poll(admin, after=cursor, overlap=True)
+    while True:
+        seen += [n["id"] for n in page]
+        if len(page) < 3:
+            return seen
+        page = poll(admin, after=page[0]["cursor"])
+
+
+def test_cursor_round_trips_and_sorts_in_feed_order():
+    early = {"id": "b", "created_at": datetime(2025, 1, 1, 10, 0, 0, 123456)}
+    late = {"id": "a", "created_at": datetime(2025, 1, 1, 10, 0, 0, 124000)}
+    assert server.alert_cursor(early) < server.alert_cursor(late)
+    assert server.parse_alert_cursor(server.alert_cursor(early)) == (datetime(2025, 1, 1, 10, 0, 0, 123000), "b")
+    with pytest.raises(HTTPException):
+        server.parse_alert_cursor("64f0c0ffee")
+
+
+def test_paging_after_a_cursor_reaches_every_alert(db, admin):
+    start = datetime.utcnow() - timedelta(minutes=10)
+    for i in range(8):
+        insert_alert(db, f"A{i}", start + timedelta(seconds=i))
+    cursor = server.alert_cursor({"id": "", "created_at": start - timedelta(hours=1)})
+
+    seen = drain(admin, cursor)
+
+    assert sorted(set(seen)) == [f"A{i}" for i in range(8)]
+
+
+def test_alert_stamped_before_the_cursor_but_written_later_is_delivered(db, admin):
+    now = datetime.utcnow()
+    insert_alert(db, "A1", now - timedelta(seconds=5))
+    insert_alert(db, "A2", now - timedelta(seconds=2))
+    first = poll(admin)
+    cursor = first[0]["cursor"]
+    assert [n["id"] for n in first] == ["A2", "A1"]
+
+    # Another worker stamped this alert before A2 but wrote it after the client's poll
+    insert_alert(db, "A3", now - timedelta(seconds=3))
+    seen = drain(admin, cursor)
+
+    assert "A3" in seen
+
+
+def test_a_full_overlap_window_of_seen_alerts_does_not_stall_paging(db, admin):
+    now = datetime.utcnow()
+    for i in range(7):
+        insert_alert(db, f"A{i}", now - timedelta(seconds=30 - i))
+    cursor = server.alert_cursor({"id": "A6", "created_at": now - timedelta(seconds=24)})
+    insert_alert(db, "A7", now - timedelta(seconds=1))
+
+    seen = drain(admin, cursor)
+
+    assert "A7" in seen
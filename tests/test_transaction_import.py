@@ -0,0 +1,87 @@
+import asyncio
+import io
+import json
+
+from fastapi import UploadFile
+from pymongo.errors import BulkWriteError
+
+import server
+
+AML_DAILY = server.AML_THRESHOLDS_IDR["daily"]
+
+
+def seed_reference_data(db):
+    db.branches.docs.append({"id": "B1", "name": "Pusat", "code": "HQ"})
+    db.currencies.docs.append({"id": "USD", "code": "USD", "name": "US Dollar", "is_active": True})
+    db.customers.docs.append({"id": "C1", "name": "Budi", "branch_id": "B1", "customer_code": "N0001"})
+
+
+def upload(rows):
+    content = "\n".join(json.dumps(row) for row in rows).encode()
+    return UploadFile(file=io.BytesIO(content), filename="import.jsonl")
+
+
+def row(amount, voucher):
+    return {
+        "customer_code": "N0001", "currency_code": "USD", "transaction_type": "jual",
+        "amount": amount, "exchange_rate": 10000, "voucher_number": voucher,
+        "transaction_date": "2025-03-01T02:00:00+00:00",
+    }
+
+
+def reject_where(collection, predicate):
+    """Make unordered insert_many reject the matching documents, like a unique index would"""
+    insert_many = collection.insert_many
+
+    async def partial_insert_many(docs, ordered=True):
+        rejected = [index for index, doc in enumerate(docs) if predicate(doc)]
+        await insert_many([doc for index, doc in enumerate(docs) if index not in rejected])
+        if rejected:
+            raise BulkWriteError({
+                "writeErrors": [{"index": index, "code": 11000, "errmsg": "E11000 duplicate key"} for index in rejected],
+                "nInserted": len(docs) - len(rejected)
+            })
+
+    collection.insert_many = partial_insert_many
+
+
+def run_import(rows, admin):
+    return asyncio.run(server.import_transactions(file=upload(rows), dry_run=False, current_user=admin))
+
+
+def test_rejected_transaction_rows_are_reported_and_skipped(db, admin):
+    seed_reference_data(db)
+    reject_where(db.transactions, lambda doc: doc["voucher_number"] == "V2")
+
+    result = run_import([row(100, "V1"), row(200, "V2"), row(300, "V3")], admin)
+
+    assert result["imported"] == 2
+    assert result["failed"] == 1
+    assert [error["row"] for error in result["errors"]] == [2]
+    assert len(db.cashbook_entries.docs) == 2
+    assert {d["voucher_number"] for d in db.transactions.docs} == {"V1", "V3"}
+    assert next(d for d in db.customer_stats.docs)["total_transactions"] == 2
+
+
+def test_rejected_cashbook_entries_are_reported(db, admin):
+    seed_reference_data(db)
+    reject_where(db.cashbook_entries, lambda doc: doc["amount"] == 2000000)
+
+    result = run_import([row(100, "V1"), row(200, "V2")], admin)
+
+    assert result["imported"] == 2
+    assert [error["row"] for error in result["errors"]] == [2]
+    assert result["errors"][0]["transaction_number"] == result["transaction_numbers"][1]
+    assert "Buku Kas" in result["errors"][0]["errors"][0]
+
+
+def test_threshold_totals_are_applied_once_per_customer_period(db, admin):
+    seed_reference_data(db)
+    amount = AML_DAILY / 10000 / 4
+    result = run_import([row(amount, f"V{i}") for i in range(5)], admin)
+
+    assert result["imported"] == 5
+    daily = next(d for d in db.customer_period_totals.docs if d["period_type"] == "daily")
+    assert daily["total_idr"] == AML_DAILY * 5 / 4
+    assert daily["transaction_count"] == 5
+    assert len([a for a in db.alerts.docs if a["type"] == "customer_threshold_daily"]) == 1